@@ -0,0 +1,320 @@
+"""
+Load and latency benchmark of the API against a local synthetic website.
+
+    python -m benchmarks.run --crawls 20 --concurrency 4 --links 5
+    python -m benchmarks.run --replay traffic.jsonl --output after.json --baseline before.json
+
+The app runs in process, with mongomock in place of MongoDB and fakeredis in
+place of Redis, so nothing but the synthetic website is reached over the
+network. The screenshots still need a local Chromium for pyppeteer.
+
+A replay file has one request per line:
+
+    {"session": "a", "method": "POST", "path": "/screenshots", "json": {"start_url": "{site}/page/1", "number_of_links_to_follow": 3}}
+    {"session": "a", "method": "GET", "path": "/screenshots/{run_id}"}
+
+`{site}` is replaced by the address of the synthetic website, and `{run_id}`
+by the run id of the last POST of the same session. The requests of a
+session are sent one after the other, the sessions run concurrently.
+"""
+import argparse
+import asyncio
+import json
+import math
+import os
+import resource
+import shutil
+import sys
+import tempfile
+import time
+from collections import defaultdict
+from typing import Dict, List, Optional
+from benchmarks.synthetic_site import SyntheticSite
+
+STAGE_METRIC = "crawl_stage_seconds"
+
+
+def percentile(values: List[float], q: float) -> Optional[float]:
+    """
+    Nearest rank percentile, `q` between 0 and 100.
+    """
+    if not values:
+        return None
+    ordered = sorted(values)
+    rank = max(1, math.ceil(q / 100 * len(ordered)))
+    return ordered[rank - 1]
+
+
+def histogram_quantile(buckets: Dict[float, float], q: float) -> Optional[float]:
+    """
+    Estimates a quantile from cumulative bucket counts keyed by upper bound,
+    interpolating linearly within the bucket, as Prometheus does.
+    """
+    bounds = sorted(buckets)
+    total = buckets[bounds[-1]] if bounds else 0
+    if not total:
+        return None
+    target = q * total
+    lower_bound, lower_count = 0.0, 0.0
+    for bound in bounds:
+        count = buckets[bound]
+        if count >= target:
+            if bound == float("inf"):
+                return lower_bound
+            if count == lower_count:
+                return bound
+            return lower_bound + (bound - lower_bound) * (target - lower_count) / (count - lower_count)
+        lower_bound, lower_count = bound, count
+    return lower_bound
+
+
+def stage_buckets() -> Dict[str, Dict[float, float]]:
+    from utils.metrics import metrics_registry
+
+    buckets: Dict[str, Dict[float, float]] = defaultdict(dict)
+    for metric in metrics_registry().collect():
+        if metric.name != STAGE_METRIC:
+            continue
+        for sample in metric.samples:
+            if sample.name.endswith("_bucket"):
+                buckets[sample.labels["stage"]][float(sample.labels["le"])] = sample.value
+    return buckets
+
+
+def stage_report(before: Dict[str, Dict[float, float]], after: Dict[str, Dict[float, float]]) -> dict:
+    report = {}
+    for stage, counts in after.items():
+        delta = {bound: count - before.get(stage, {}).get(bound, 0) for bound, count in counts.items()}
+        observed = delta.get(float("inf"), 0)
+        if not observed:
+            continue
+        report[stage] = {
+            "count": int(observed),
+            "p50": histogram_quantile(delta, 0.50),
+            "p95": histogram_quantile(delta, 0.95),
+            "p99": histogram_quantile(delta, 0.99),
+        }
+    return report
+
+
+def generated_traffic(site: SyntheticSite, args) -> List[dict]:
+    steps = []
+    for i in range(args.crawls):
+        session = f"crawl-{i}"
+        steps.append({
+            "session": session,
+            "method": "POST",
+            "path": "/screenshots",
+            "params": {"run_in_background": "true"} if args.background else {},
+            "json": {
+                "start_url": site.page_url(i * (args.links + 1)),
+                "number_of_links_to_follow": args.links,
+                "discovery_mode": args.discovery_mode,
+                "capture": {"profile": args.profile},
+            },
+        })
+        if args.background:
+            steps.append({"session": session, "method": "GET", "path": "/screenshots/{run_id}/status"})
+        else:
+            steps.append({"session": session, "method": "GET", "path": "/screenshots/{run_id}"})
+    return steps
+
+
+def read_traffic(path: str) -> List[dict]:
+    with open(path) as traffic_file:
+        return [json.loads(line) for line in traffic_file if line.strip()]
+
+
+def _substitute(value, replacements: Dict[str, str]):
+    if isinstance(value, str):
+        for placeholder, replacement in replacements.items():
+            value = value.replace(placeholder, replacement)
+        return value
+    if isinstance(value, dict):
+        return {key: _substitute(item, replacements) for key, item in value.items()}
+    if isinstance(value, list):
+        return [_substitute(item, replacements) for item in value]
+    return value
+
+
+def configure_offline(screenshot_folder: str):
+    """
+    Points the dependency container to in-memory stand-ins of MongoDB and
+    Redis. Must run before the app is imported.
+    """
+    os.environ["SCREENSHOT_FOLDER"] = screenshot_folder
+    # Every page is on the same local host, spacing them would measure the
+    # politeness delay only. Set them to benchmark the scheduler itself.
+    os.environ.setdefault("HOST_MIN_INTERVAL_MS", "0")
+    os.environ.setdefault("HOST_MAX_CONCURRENT_PAGES", "1000")
+    import fakeredis
+    import mongomock
+    import dep_container
+    from dep_container import commons
+
+    mongo_client = mongomock.MongoClient()
+    cache_client = fakeredis.FakeAsyncRedis(decode_responses=True)
+    # Replaced where they are defined, for the other getters, and where the
+    # app imports them from
+    for module in (commons, dep_container):
+        module.get_mongo_client = lambda use_mongomock=False: mongo_client
+        module.get_cache_client = lambda: cache_client
+        module.get_stream_client = lambda: cache_client
+    return mongo_client
+
+
+async def drive(app, steps: List[dict], site: SyntheticSite, concurrency: int, timeout: float):
+    import httpx
+
+    sessions: Dict[str, List[dict]] = defaultdict(list)
+    for number, step in enumerate(steps):
+        sessions[step.get("session", f"request-{number}")].append(step)
+    pending: asyncio.Queue = asyncio.Queue()
+    for session_steps in sessions.values():
+        pending.put_nowait(session_steps)
+
+    latencies: Dict[str, List[float]] = defaultdict(list)
+    errors: Dict[str, int] = defaultdict(int)
+    transport = httpx.ASGITransport(app=app)
+
+    async with httpx.AsyncClient(transport=transport, base_url="http://benchmark", timeout=timeout) as client:
+        async def worker():
+            while not pending.empty():
+                session_steps = pending.get_nowait()
+                replacements = {"{site}": site.base_url}
+                for step in session_steps:
+                    endpoint = f"{step['method']} {step['path']}"
+                    request = _substitute(step, replacements)
+                    start = time.perf_counter()
+                    try:
+                        response = await client.request(
+                            request["method"], request["path"],
+                            params=request.get("params"), json=request.get("json")
+                        )
+                    except httpx.HTTPError:
+                        errors[endpoint] += 1
+                        continue
+                    latencies[endpoint].append(time.perf_counter() - start)
+                    if response.status_code >= 400:
+                        errors[endpoint] += 1
+                        continue
+                    body = response.json() if "json" in response.headers.get("content-type", "") else {}
+                    if isinstance(body, dict) and "run_id" in body:
+                        replacements["{run_id}"] = body["run_id"]
+
+        await asyncio.gather(*(worker() for _ in range(max(1, concurrency))))
+    return latencies, errors
+
+
+async def benchmark(args) -> dict:
+    folder = tempfile.mkdtemp(prefix="benchmark_screenshots_", dir=".")
+    try:
+        mongo_client = configure_offline(os.path.relpath(folder))
+
+        from dep_container import get_job_runner
+        from main import app
+
+        with SyntheticSite(args.pages, args.site_links, args.asset_kb, args.delay_ms) as site:
+            steps = read_traffic(args.replay) if args.replay else generated_traffic(site, args)
+            async with app.router.lifespan_context(app):
+                stages_before = stage_buckets()
+                start = time.perf_counter()
+                latencies, errors = await drive(app, steps, site, args.concurrency, args.timeout)
+                await get_job_runner().join()
+                elapsed = time.perf_counter() - start
+                stages = stage_report(stages_before, stage_buckets())
+    finally:
+        shutil.rmtree(folder, ignore_errors=True)
+
+    runs = list(mongo_client["screenshots_db"]["screenshots"].find({}, {"screenshots": 1}))
+    pages = sum(len(run["screenshots"]) for run in runs)
+    usage = resource.getrusage(resource.RUSAGE_SELF)
+    children = resource.getrusage(resource.RUSAGE_CHILDREN)
+    return {
+        "requests": sum(len(values) for values in latencies.values()) + sum(errors.values()),
+        "runs": len(runs),
+        "pages": pages,
+        "elapsed_seconds": elapsed,
+        "pages_per_second": pages / elapsed if elapsed else 0,
+        "endpoints": {
+            endpoint: {
+                "count": len(values),
+                "errors": errors.get(endpoint, 0),
+                "p50": percentile(values, 50),
+                "p95": percentile(values, 95),
+                "p99": percentile(values, 99),
+            }
+            for endpoint, values in sorted(latencies.items())
+        },
+        "stages": stages,
+        # Kilobytes on Linux; the browsers are children, reported once they exited
+        "peak_rss_kb": usage.ru_maxrss,
+        "peak_child_rss_kb": children.ru_maxrss,
+    }
+
+
+def _ms(value: Optional[float]) -> str:
+    return "-" if value is None else f"{value * 1000:.1f}"
+
+
+def _change(after: Optional[float], before: Optional[float]) -> str:
+    if not after or not before:
+        return ""
+    return f" ({(after - before) / before:+.0%})"
+
+
+def print_report(report: dict, baseline: Optional[dict] = None, out=sys.stdout):
+    baseline = baseline or {}
+    print(f"runs: {report['runs']}  pages: {report['pages']}  requests: {report['requests']}  "
+          f"elapsed: {report['elapsed_seconds']:.2f}s", file=out)
+    print(f"pages/sec: {report['pages_per_second']:.2f}"
+          f"{_change(report['pages_per_second'], baseline.get('pages_per_second'))}", file=out)
+    print(f"peak rss: {report['peak_rss_kb'] / 1024:.1f} MiB  "
+          f"largest child: {report['peak_child_rss_kb'] / 1024:.1f} MiB", file=out)
+
+    for title, key in (("endpoint", "endpoints"), ("stage", "stages")):
+        print(f"\n{title:<40} {'count':>7} {'p50 ms':>10} {'p95 ms':>10} {'p99 ms':>10}", file=out)
+        for name, stats in report[key].items():
+            before = baseline.get(key, {}).get(name, {})
+            errors = f"  errors: {stats['errors']}" if stats.get("errors") else ""
+            print(f"{name:<40} {stats['count']:>7} {_ms(stats['p50']):>10} {_ms(stats['p95']):>10} "
+                  f"{_ms(stats['p99']):>10}{_change(stats['p95'], before.get('p95'))}{errors}", file=out)
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    traffic = parser.add_argument_group("traffic")
+    traffic.add_argument("--crawls", type=int, default=10, help="Crawls posted when no replay file is given.")
+    traffic.add_argument("--links", type=int, default=5, help="Links followed by every crawl.")
+    traffic.add_argument("--concurrency", type=int, default=4, help="Sessions sending requests at the same time.")
+    traffic.add_argument("--background", action="store_true", help="Post the crawls with run_in_background.")
+    traffic.add_argument("--discovery-mode", default="http", choices=["auto", "http", "browser"])
+    traffic.add_argument("--profile", default="default", help="Capture profile of the crawls.")
+    traffic.add_argument("--replay", help="JSONL file of requests to send instead of the generated crawls.")
+    traffic.add_argument("--timeout", type=float, default=300, help="Timeout of every request, in seconds.")
+    site = parser.add_argument_group("synthetic website")
+    site.add_argument("--pages", type=int, default=200, help="Number of pages of the website.")
+    site.add_argument("--site-links", type=int, default=10, help="Links on every page.")
+    site.add_argument("--asset-kb", type=int, default=50, help="Weight of the image of every page.")
+    site.add_argument("--delay-ms", type=int, default=0, help="Delay of every response of the website.")
+    output = parser.add_argument_group("output")
+    output.add_argument("--output", help="Write the report to this JSON file.")
+    output.add_argument("--baseline", help="Report saved by a previous run, to compare with.")
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    report = asyncio.run(benchmark(args))
+    baseline = None
+    if args.baseline:
+        with open(args.baseline) as baseline_file:
+            baseline = json.load(baseline_file)
+    print_report(report, baseline)
+    if args.output:
+        with open(args.output, "w") as output_file:
+            json.dump(report, output_file, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,88 @@
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlsplit
+
+class SyntheticSite:
+    """
+    Local website of `pages` generated pages, each linking to the `links`
+    next ones and loading one image of `asset_kb` kilobytes. Every response
+    is delayed by `delay_ms`, to stand for the latency of a real server.
+
+    Served from a thread, so it can be used from the event loop of the app.
+    """
+
+    def __init__(self, pages: int = 100, links: int = 10, asset_kb: int = 50, delay_ms: int = 0, port: int = 0):
+        self.pages = max(1, pages)
+        self.links = links
+        self.asset_kb = asset_kb
+        self.delay_ms = delay_ms
+        self._asset = bytes(range(256)) * (asset_kb * 4)
+        self._server = ThreadingHTTPServer(("127.0.0.1", port), self._handler())
+        self._server.daemon_threads = True
+        self._thread = None
+
+    @property
+    def base_url(self) -> str:
+        host, port = self._server.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def page_url(self, number: int) -> str:
+        return f"{self.base_url}/page/{number % self.pages}"
+
+    def start(self) -> "SyntheticSite":
+        self._thread = threading.Thread(target=self._server.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._server.shutdown()
+        self._server.server_close()
+
+    def __enter__(self) -> "SyntheticSite":
+        return self.start()
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.stop()
+
+    def render_page(self, number: int) -> str:
+        anchors = "\n".join(
+            f'<li><a href="/page/{(number + k) % self.pages}">Page {(number + k) % self.pages}</a></li>'
+            for k in range(1, self.links + 1)
+        )
+        image = f'<img src="/asset/{number}.bin" width="400" height="300">' if self.asset_kb else ""
+        return (
+            f"<!DOCTYPE html><html><head><title>Page {number}</title></head>"
+            f"<body><h1>Page {number}</h1>{image}<ul>{anchors}</ul></body></html>"
+        )
+
+    def _handler(self):
+        site = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                if site.delay_ms:
+                    time.sleep(site.delay_ms / 1000)
+                path = urlsplit(self.path).path
+                if path == "/robots.txt":
+                    self._send(200, "text/plain", b"User-agent: *\nAllow: /\n")
+                elif path.startswith("/page/") and path[len("/page/"):].isdigit():
+                    body = site.render_page(int(path[len("/page/"):])).encode()
+                    self._send(200, "text/html; charset=utf-8", body)
+                elif path.startswith("/asset/"):
+                    self._send(200, "application/octet-stream", site._asset)
+                else:
+                    self._send(404, "text/plain", b"not found")
+
+            def _send(self, status: int, content_type: str, body: bytes):
+                self.send_response(status)
+                self.send_header("Content-Type", content_type)
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):
+                # Keeps the benchmark output readable
+                pass
+
+        return Handler
@@ -0,0 +1,90 @@
+from fastapi import APIRouter, Depends, Header, HTTPException, Query, Response, status
+from fastapi.responses import RedirectResponse
+from logging import Logger
+from typing import Optional
+import asyncio
+import os
+import stat
+from dep_container import get_logger, get_screenshot_files
+from services.screenshot_files import ScreenshotFiles
+from utils.file_responses import RangeFileResponse, RangeNotSatisfiable, caching_headers, etag_matches, parse_range, strong_etag
+
+# Included under the prefix of the screenshots folder, in `main.py`
+router = APIRouter()
+
+
+@router.api_route("/{file_name:path}",
+            methods=["GET", "HEAD"],
+            summary="Get a screenshot file",
+            description="""
+            Serves the files of the runs by their storage key. They never change once written, so 
+            they are sent with a strong `ETag` and cached for a year; `If-None-Match` gets a 304 and 
+            `Range` a 206 with the asked bytes. With `width` a resized copy is sent, made on the first 
+            request. Files kept in an object store are redirected to a signed URL of the store.
+            """,
+            response_class=Response,
+            responses={
+                200: {"description": "The file", "content": {"image/png": {}, "image/jpeg": {}, "image/webp": {}}},
+                206: {"description": "The asked bytes of the file"},
+                307: {"description": "Signed URL of the file in the object store"},
+                304: {"description": "The cached file is still valid"},
+                400: {"description": "Width not offered, or the file is not an image"},
+                404: {"description": "File not found"},
+                416: {"description": "Range past the end of the file"}
+            }
+        )
+async def get_screenshot_file(
+                file_name: str,
+                width: Optional[int] = Query(None, description="Width of a resized copy of the image."),
+                if_none_match: Optional[str] = Header(None),
+                range_header: Optional[str] = Header(None, alias="range"),
+                if_range: Optional[str] = Header(None),
+                screenshot_files: ScreenshotFiles = Depends(get_screenshot_files),
+                logger: Logger = Depends(get_logger)
+                ):
+    """
+        Serves a screenshot, or a part of it.
+    """
+    key = file_name
+    if width is not None:
+        try:
+            key = await screenshot_files.variant(key, width)
+        except FileNotFoundError:
+            raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="File not found")
+        except ValueError as e:
+            raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=str(e))
+        except Exception as e:
+            logger.error("Could not resize the screenshot", extra= {"file_name": file_name, "width": width, "exception": e})
+            raise HTTPException(status_code=status.HTTP_500_INTERNAL_SERVER_ERROR, detail="Could not resize the screenshot")
+
+    storage = screenshot_files.storage
+    path = storage.local_path(key)
+    if path is None:
+        # Not on this machine, the object store serves it
+        url = await storage.url(key)
+        if url is None or not await storage.exists(key):
+            raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="File not found")
+        return RedirectResponse(url, status_code=status.HTTP_307_TEMPORARY_REDIRECT)
+
+    try:
+        stat_result = await asyncio.to_thread(os.stat, path)
+    except (FileNotFoundError, NotADirectoryError):
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="File not found")
+    if not stat.S_ISREG(stat_result.st_mode):
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="File not found")
+    etag = strong_etag(stat_result)
+    if etag_matches(if_none_match, etag):
+        return Response(status_code=status.HTTP_304_NOT_MODIFIED, headers=caching_headers(stat_result))
+
+    byte_range = None
+    # A range of an older version of the file must not be mixed with this one
+    if if_range is None or if_range == etag:
+        try:
+            byte_range = parse_range(range_header, stat_result.st_size)
+        except RangeNotSatisfiable:
+            raise HTTPException(
+                status_code=status.HTTP_416_REQUESTED_RANGE_NOT_SATISFIABLE,
+                detail="Range not satisfiable",
+                headers={"Content-Range": f"bytes */{stat_result.st_size}"}
+            )
+    return RangeFileResponse(str(path), stat_result, byte_range)
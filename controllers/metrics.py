@@ -1,9 +1,13 @@
 from prometheus_client.exposition import generate_latest
 from starlette.responses import PlainTextResponse
-from fastapi import APIRouter
+from fastapi import APIRouter, Depends
+from dep_container import get_run_cache
+from services.run_cache import RunCache
+from utils.metrics import metrics_registry
 
 router = APIRouter()
 
 @router.get("/metrics")
-async def metrics():
-    return PlainTextResponse(generate_latest(), media_type="text/plain")
+async def metrics(run_cache: RunCache = Depends(get_run_cache)):
+    await run_cache.refresh_stats()
+    return PlainTextResponse(generate_latest(metrics_registry()), media_type="text/plain")
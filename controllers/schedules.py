@@ -0,0 +1,163 @@
+import uuid
+from datetime import datetime
+from fastapi import APIRouter, Depends, HTTPException, Query, Response, status
+from logging import Logger
+from typing import Optional
+from dtos.schedule import ScheduleListResponse, ScheduleRequest, ScheduleResponse
+from dep_container import get_crawl_scheduler, get_logger, get_schedule_repository
+from models.schedule_document import ScheduleDocument
+from repositories.schedule_repository import AsyncScheduleRepository
+from services.scheduler import CrawlScheduler
+
+router = APIRouter()
+
+NOT_FOUND_RESPONSE = {
+    404: {
+        "description": "Schedule not found",
+        "content": {
+            "application/json": {
+                "example": {
+                    "detail": "Schedule not found for the provided ID"
+                }
+            }
+        }
+    }
+}
+
+
+def _to_response(document: dict) -> dict:
+    return {**document, "schedule_id": document["_id"]}
+
+
+def _not_found(schedule_id: str, logger: Logger) -> HTTPException:
+    logger.error("Schedule not found", extra= {"schedule_id": schedule_id})
+    return HTTPException(
+                         status_code=status.HTTP_404_NOT_FOUND,
+                         detail="Schedule not found for the provided ID"
+                         )
+
+
+@router.post("/schedules",
+            summary="Create a recurring crawl",
+            description="""
+            Stores a crawl that the service starts by itself every `interval_seconds` or on the
+            minutes of a `cron` expression. The runs get a small random delay and the schedules of
+            the same interval are spread over it. A run is skipped while the previous one is still going.
+            """,
+            status_code=status.HTTP_201_CREATED,
+            response_model=ScheduleResponse
+        )
+async def create_schedule(
+                          request: ScheduleRequest,
+                          repository: AsyncScheduleRepository = Depends(get_schedule_repository),
+                          scheduler: CrawlScheduler = Depends(get_crawl_scheduler),
+                          logger: Logger = Depends(get_logger)
+                          ):
+    """
+    Creates a schedule.
+
+    - **request**: The crawl, with the same fields than the body of `/screenshots`.
+    - **interval_seconds** / **cron**: When it runs, exactly one of them.
+    - **enabled**: Whether it runs.
+    """
+    now = datetime.now()
+    schedule_id = str(uuid.uuid4())
+    timing = {"_id": schedule_id, "interval_seconds": request.interval_seconds, "cron": request.cron}
+    schedule = ScheduleDocument(
+        _id=schedule_id,
+        request=request.request.model_dump(mode="json"),
+        interval_seconds=request.interval_seconds,
+        cron=request.cron,
+        enabled=request.enabled,
+        next_run_at=scheduler.next_run_at(timing, now),
+        created_at=now
+    )
+    await repository.insert_schedule(schedule)
+    logger.info("Schedule created", extra= {"schedule_id": schedule.id})
+    return _to_response(schedule.model_dump(by_alias=True))
+
+
+@router.get("/schedules",
+            summary="List the recurring crawls",
+            response_model=ScheduleListResponse
+        )
+async def list_schedules(
+                         limit: int = Query(20, ge=1, le=100, description="Maximum number of schedules in the page."),
+                         cursor: Optional[str] = Query(None, description="`next_cursor` of the previous page."),
+                         repository: AsyncScheduleRepository = Depends(get_schedule_repository)
+                         ):
+    """
+        Lists the schedules, by id.
+    """
+    # One more than asked tells whether there is a next page
+    documents = await repository.list_schedules(cursor, limit + 1)
+    schedules = [_to_response(document) for document in documents[:limit]]
+    next_cursor = schedules[-1]["schedule_id"] if len(documents) > limit else None
+    return {"schedules": schedules, "next_cursor": next_cursor}
+
+
+@router.get("/schedules/{schedule_id}",
+            summary="Get a recurring crawl",
+            response_model=ScheduleResponse,
+            responses=NOT_FOUND_RESPONSE
+        )
+async def get_schedule(
+                       schedule_id: str,
+                       repository: AsyncScheduleRepository = Depends(get_schedule_repository),
+                       logger: Logger = Depends(get_logger)
+                       ):
+    """
+        Retrieves the schedule with its next and last runs.
+    """
+    document = await repository.get_schedule(schedule_id)
+    if not document:
+        raise _not_found(schedule_id, logger)
+    return _to_response(document)
+
+
+@router.put("/schedules/{schedule_id}",
+            summary="Change a recurring crawl",
+            description="Replaces the crawl and the timing of the schedule. Its next run is computed again.",
+            response_model=ScheduleResponse,
+            responses=NOT_FOUND_RESPONSE
+        )
+async def update_schedule(
+                          schedule_id: str,
+                          request: ScheduleRequest,
+                          repository: AsyncScheduleRepository = Depends(get_schedule_repository),
+                          scheduler: CrawlScheduler = Depends(get_crawl_scheduler),
+                          logger: Logger = Depends(get_logger)
+                          ):
+    """
+        Updates the schedule given by its ID.
+    """
+    fields = {
+        "request": request.request.model_dump(mode="json"),
+        "interval_seconds": request.interval_seconds,
+        "cron": request.cron,
+        "enabled": request.enabled,
+    }
+    fields["next_run_at"] = scheduler.next_run_at({"_id": schedule_id, **fields}, datetime.now())
+    document = await repository.update_schedule(schedule_id, fields)
+    if not document:
+        raise _not_found(schedule_id, logger)
+    return _to_response(document)
+
+
+@router.delete("/schedules/{schedule_id}",
+            summary="Remove a recurring crawl",
+            description="Stops the schedule. Its runs already stored are kept.",
+            status_code=status.HTTP_204_NO_CONTENT,
+            responses=NOT_FOUND_RESPONSE
+        )
+async def delete_schedule(
+                          schedule_id: str,
+                          repository: AsyncScheduleRepository = Depends(get_schedule_repository),
+                          logger: Logger = Depends(get_logger)
+                          ):
+    """
+        Deletes the schedule given by its ID.
+    """
+    if not await repository.delete_schedule(schedule_id):
+        raise _not_found(schedule_id, logger)
+    return Response(status_code=status.HTTP_204_NO_CONTENT)
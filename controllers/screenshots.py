@@ -1,13 +1,93 @@
-from fastapi import APIRouter, Depends, HTTPException, status
+from fastapi import APIRouter, Depends, Header, HTTPException, Query, Response, status
+from fastapi.responses import StreamingResponse
+from starlette.background import BackgroundTask
 from logging import Logger
 from pathlib import Path
-from dtos.screenshot import ScreenshotRequest, ScreenshotResponse
+from datetime import datetime
+from typing import Awaitable, List, Optional, Tuple, Union
+from pydantic import TypeAdapter, ValidationError
+from dtos.screenshot import JobStatusResponse, PinResponse, RunListResponse, ScreenshotBatchRequest, ScreenshotBatchResponse, ScreenshotRequest, ScreenshotResponse
+import base64
+import binascii
+import json
 import uuid
-from dep_container import get_crawler_service, get_logger, get_cache_client
+from dep_container import get_crawl_coalescer, get_crawler_service, get_logger, get_run_cache, get_run_events, get_job_runner, get_job_tracker, get_screenshot_repository
+from models.screenshot_document import HttpUrlString
+from repositories.screenshot_repository import AsyncScreenshotRepository
+from services.coalescing import CrawlCoalescer
 from services.crawler import Crawler
+from services.jobs import JobQueueFull, JobRunner, JobStatus, JobTracker
+from services.run_cache import RunCache
+from services.run_events import RunEvents, RunEventType
+from utils.awaitables import maybe_await
 
 router = APIRouter()
 
+
+def _format_sse(event_type: str, data: dict, event_id: Optional[str] = None) -> str:
+    message = f"event: {event_type}\ndata: {json.dumps(data)}\n\n"
+    if event_id:
+        message = f"id: {event_id}\n{message}"
+    return message
+
+
+def _encode_cursor(timestamp: datetime, run_id: str) -> str:
+    payload = json.dumps([timestamp.isoformat(), run_id]).encode()
+    return base64.urlsafe_b64encode(payload).decode()
+
+
+def _decode_cursor(cursor: str) -> Tuple[datetime, str]:
+    try:
+        timestamp, run_id = json.loads(base64.urlsafe_b64decode(cursor.encode()))
+        return datetime.fromisoformat(timestamp), run_id
+    except (binascii.Error, ValueError, TypeError):
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="Invalid cursor")
+
+
+async def _crawl_and_cache(request: ScreenshotRequest, 
+                           run_id: str, 
+                           crawler_service: Crawler, 
+                           run_cache: RunCache,
+                           coalescer: Optional[CrawlCoalescer] = None) -> List[str]:
+    if coalescer is not None:
+        screenshots = await coalescer.crawl(crawler_service, request, run_id)
+    else:
+        screenshots = await crawler_service.crawl_website(**request.crawl_arguments(run_id))
+    await run_cache.store(run_id, screenshots)
+    return screenshots
+
+
+async def _crawl_batch_and_cache(requests: List[ScreenshotRequest], 
+                                 run_ids: List[str], 
+                                 crawler_service: Crawler, 
+                                 run_cache: RunCache,
+                                 logger: Logger) -> List[Union[List[str], Exception]]:
+    results = await crawler_service.crawl_batch(
+        [request.crawl_arguments(run_id) for request, run_id in zip(requests, run_ids)]
+    )
+    for run_id, result in zip(run_ids, results):
+        if isinstance(result, Exception):
+            continue
+        try:
+            await run_cache.store(run_id, result)
+        except Exception as e:
+            # The run is stored in the database already
+            logger.warn(f"Could not cache the run 'run_id': {run_id} 'exception': {e}")
+    return results
+
+
+async def _submit(submission: Awaitable, logger: Logger):
+    try:
+        await submission
+    except JobQueueFull as e:
+        logger.warn("Too many jobs queued", extra= {"exception": str(e)})
+        raise HTTPException(
+                            status_code=status.HTTP_503_SERVICE_UNAVAILABLE, 
+                            detail="Too many crawls queued, retry later",
+                            headers={"Retry-After": "30"}
+                            )
+
+
 @router.post(
             "/screenshots",
             summary="Start screenshot process",
@@ -15,6 +95,8 @@ router = APIRouter()
             This endpoint initiates a process that crawls a website starting from the provided `start_url` 
             and takes screenshots of the initial page and the first `number_of_links_to_follow` links found on the page. 
             It returns a unique `run_id` which can be used to retrieve the screenshots later.
+            With `run_in_background` the crawl is queued and the `run_id` is returned right away,
+            its progress can be followed on `/screenshots/{run_id}/status`.
             """,
             responses={
                 200: {
@@ -27,6 +109,17 @@ router = APIRouter()
                         }
                     }
                 },
+                202: {
+                    "description": "Screenshot process queued to run in background",
+                    "content": {
+                        "application/json": {
+                            "example": {
+                                "run_id": "abc123",
+                                "status": "queued"
+                            }
+                        }
+                    }
+                },
                 400: {
                     "description": "Invalid request parameters",
                     "content": {
@@ -36,31 +129,53 @@ router = APIRouter()
                             }
                         }
                     }
+                },
+                503: {
+                    "description": "Too many crawls queued",
+                    "content": {
+                        "application/json": {
+                            "example": {
+                                "detail": "Too many crawls queued, retry later"
+                            }
+                        }
+                    }
                 }
             }
         )
 async def start_screenshot_process(
                                    request: ScreenshotRequest, 
+                                   response: Response,
+                                   run_in_background: bool = Query(False, description="Queue the crawl and return the run id right away."),
                                    crawler_service: Crawler = Depends(get_crawler_service),
                                    logger: Logger = Depends(get_logger),
-                                   cache_client = Depends(get_cache_client)
+                                   run_cache: RunCache = Depends(get_run_cache),
+                                   job_runner: JobRunner = Depends(get_job_runner),
+                                   coalescer: Optional[CrawlCoalescer] = Depends(get_crawl_coalescer)
                                    ):
     """
     Starts a task to take screenshots of a webpage and its links.
     
     - **start_url**: The URL from which the crawling and screenshot process begins.
     - **number_of_links_to_follow**: The number of links to follow and take screenshots of.
+    - **max_depth**: How many links away from the start page the crawl may go.
+    - **same_origin** / **allowed_domains**: Restrict the links that are followed.
+    - **discovery_mode**: Find the links from the raw HTML (`http`), the rendered page (`browser`) or both (`auto`).
+    - **capture**: Format (png, jpeg or webp), quality, full page or clip region, and thumbnail width of the screenshots.
+    - **run_in_background**: Return the `run_id` with a 202 before the crawl is finished.
+
+    Identical requests in progress at the same time share one crawl, each with its own `run_id`.
     """
     run_id = str(uuid.uuid4())
     logger.info("Run id generated", extra= {"run_id": run_id})
+    job = lambda: _crawl_and_cache(request, run_id, crawler_service, run_cache, coalescer)
+
+    if run_in_background:
+        await _submit(job_runner.submit(run_id, job), logger)
+        response.status_code = status.HTTP_202_ACCEPTED
+        return {"run_id": run_id, "status": JobStatus.QUEUED.value}
+
     try:
-        screenshots = await crawler_service.crawl_website(
-                            request.start_url, 
-                            request.number_of_links_to_follow, 
-                            run_id
-                            )
-        if screenshots:
-            await cache_client.rpush(run_id, *screenshots)  # Cache for 1 hour
+        screenshots = await job_runner.run(run_id, job)
     except Exception as e:
         logger.error("Error occurred while crawling website", {"exception": e})
         raise HTTPException(
@@ -69,6 +184,129 @@ async def start_screenshot_process(
         
     return {"run_id": run_id, "screenshots": screenshots}
 
+@router.post(
+            "/screenshots/batch",
+            summary="Start many screenshot processes at once",
+            description="""
+            Crawls every item like `/screenshots` does, on shared browsers, and stores all the runs 
+            with one bulk write. Returns one `run_id` per item, in order. An item that fails is 
+            reported as failed without failing the others.
+            With `run_in_background` the batch is queued and the `run_id`s are returned right away.
+            """,
+            response_model=ScreenshotBatchResponse,
+            responses={
+                202: {
+                    "description": "Batch queued to run in background",
+                    "content": {
+                        "application/json": {
+                            "example": {
+                                "runs": [
+                                    {"run_id": "abc123", "start_url": "https://www.example.com", "status": "queued", "screenshots": []}
+                                ]
+                            }
+                        }
+                    }
+                },
+                503: {
+                    "description": "Too many crawls queued",
+                    "content": {
+                        "application/json": {
+                            "example": {
+                                "detail": "Too many crawls queued, retry later"
+                            }
+                        }
+                    }
+                }
+            }
+        )
+async def start_screenshot_batch(
+                                 request: ScreenshotBatchRequest, 
+                                 response: Response,
+                                 run_in_background: bool = Query(False, description="Queue the batch and return the run ids right away."),
+                                 crawler_service: Crawler = Depends(get_crawler_service),
+                                 logger: Logger = Depends(get_logger),
+                                 run_cache: RunCache = Depends(get_run_cache),
+                                 job_runner: JobRunner = Depends(get_job_runner)
+                                 ):
+    """
+    Starts one screenshot run per item of the batch.
+
+    - **items**: The crawls, with the same fields than the body of `/screenshots`.
+    - **run_in_background**: Return the `run_id`s with a 202 before the crawls are finished.
+    """
+    run_ids = [str(uuid.uuid4()) for _ in request.items]
+    logger.info("Run ids generated for batch", extra= {"runs": len(run_ids)})
+    job = lambda: _crawl_batch_and_cache(request.items, run_ids, crawler_service, run_cache, logger)
+
+    if run_in_background:
+        await _submit(job_runner.submit_batch(run_ids, job), logger)
+        response.status_code = status.HTTP_202_ACCEPTED
+        return {"runs": [
+            {"run_id": run_id, "start_url": item.start_url, "status": JobStatus.QUEUED.value}
+            for run_id, item in zip(run_ids, request.items)
+        ]}
+
+    results = await job_runner.run_batch(run_ids, job)
+    runs = []
+    for run_id, item, result in zip(run_ids, request.items, results):
+        if isinstance(result, Exception):
+            runs.append({"run_id": run_id, "start_url": item.start_url, "status": JobStatus.FAILED.value, "error": str(result)})
+        else:
+            runs.append({"run_id": run_id, "start_url": item.start_url, "status": JobStatus.DONE.value, "screenshots": result})
+    return {"runs": runs}
+
+
+@router.get("/screenshots",
+            summary="List the screenshot runs",
+            description="""
+            Lists the runs newest first, optionally only those of a `start_url` or within a time range. 
+            The results are paginated with a cursor: pass the `next_cursor` of a page to get the next one.
+            """,
+            response_model=RunListResponse,
+            responses={
+                400: {
+                    "description": "Invalid cursor or start URL",
+                    "content": {
+                        "application/json": {
+                            "example": {
+                                "detail": "Invalid cursor"
+                            }
+                        }
+                    }
+                }
+            }
+        )
+async def list_screenshot_runs(
+                start_url: Optional[str] = Query(None, description="Only the runs started from this URL."),
+                since: Optional[datetime] = Query(None, description="Only the runs started at or after this time."),
+                until: Optional[datetime] = Query(None, description="Only the runs started before this time."),
+                limit: int = Query(20, ge=1, le=100, description="Maximum number of runs in the page."),
+                cursor: Optional[str] = Query(None, description="`next_cursor` of the previous page."),
+                repository: AsyncScreenshotRepository = Depends(get_screenshot_repository)
+                ):
+    """
+        Lists the runs, without their screenshots.
+    """
+    if start_url:
+        try:
+            # Stored normalized, as the document model writes it
+            start_url = TypeAdapter(HttpUrlString).validate_python(start_url)
+        except ValidationError:
+            raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="Invalid start URL")
+    after = _decode_cursor(cursor) if cursor else None
+
+    # One more than asked tells whether there is a next page
+    documents = await maybe_await(repository.list_runs(start_url, since, until, after, limit + 1))
+    runs = [
+        {"run_id": document["_id"], "start_url": document["start_url"], "timestamp": document["timestamp"]}
+        for document in documents[:limit]
+    ]
+    next_cursor = None
+    if len(documents) > limit:
+        next_cursor = _encode_cursor(runs[-1]["timestamp"], runs[-1]["run_id"])
+    return {"runs": runs, "next_cursor": next_cursor}
+
+
 @router.get("/screenshots/{run_id}",
             summary="Get screenshots by run ID",
             description="Retrieve the screenshots associated with a specific run ID.",
@@ -102,17 +340,20 @@ async def start_screenshot_process(
             )
 async def get_screenshots(
                 run_id: str, 
-                crawler_service: Crawler = Depends(get_crawler_service),
+                offset: int = Query(0, ge=0, description="Skip this number of screenshots."),
+                limit: Optional[int] = Query(None, ge=1, le=1000, description="Return at most this number of screenshots."),
+                repository: AsyncScreenshotRepository = Depends(get_screenshot_repository),
                 logger: Logger = Depends(get_logger),
-                cache_client = Depends(get_cache_client)
+                run_cache: RunCache = Depends(get_run_cache)
                 ):
     """
-        Retrieves all screenshots associated with a given run ID.
+        Retrieves the screenshots associated with a given run ID.
     
         - **run_id**: A unique identifier generated when the screenshot process was initiated. This ID is used to fetch the corresponding screenshots from the database.
+        - **offset** / **limit**: Return only a slice of the screenshots of big runs.
         
         Returns:
-        - A list of screenshot file names associated with the run ID.
+        - A list of screenshot file names associated with the run ID, with their total number.
         - If the run ID is not found in the database, an HTTP 404 error is raised.
 
         Example response:
@@ -122,19 +363,21 @@ async def get_screenshots(
             "screenshots": [
                 "abc123_screenshot_0.png",
                 "abc123_screenshot_1.png"
-            ]
+            ],
+            "offset": 0,
+            "total": 2
         }
         ```
     """
 
     logger.info("Getting screenshots for run id", extra= {"run_id": run_id})
-    # Retrieve screenshots from cache or database if available
-    cached_data = await cache_client.lrange(run_id, 0, -1)
-    if cached_data:
+    # Retrieve screenshots from cache or database if available, only the asked slice
+    cached_data, total = await run_cache.get_range(run_id, offset, limit)
+    if total:
         logger.info("Screenshots fetched from cache", extra= {"run_id": run_id})
-        return {"run_id": run_id, "screenshots": cached_data}
+        return {"run_id": run_id, "screenshots": cached_data, "offset": offset, "total": total}
     
-    record = crawler_service.get_screenshots_by_run_id(run_id= run_id)
+    record = await maybe_await(repository.get_screenshots_page(run_id, offset, limit))
     if not record:
         logger.error("Screenshots not found in database", extra= {"run_id": run_id})  # Log error for debugging purposes
         raise HTTPException(
@@ -142,7 +385,215 @@ async def get_screenshots(
                             detail="Screenshots not found for the provided ID"
                             )
     
-    screenshots = record["screenshots"]
-    return {"run_id": run_id, "screenshots": screenshots}
+    return {"run_id": run_id, "screenshots": record["screenshots"], "offset": offset, "total": record["total"]}
+
+
+@router.get("/screenshots/{run_id}/status",
+            summary="Get the state of a screenshot run",
+            description="Retrieve the state and progress of the crawl associated with a specific run ID.",
+            response_model=JobStatusResponse,
+            responses={
+                404: {
+                        "description": "Run ID not found",
+                        "content": {
+                            "application/json": {
+                                "example": {
+                                    "detail": "Run ID not found"
+                                }
+                            }
+                        }
+                    }
+                }
+            )
+async def get_screenshot_process_status(
+                run_id: str, 
+                repository: AsyncScreenshotRepository = Depends(get_screenshot_repository),
+                logger: Logger = Depends(get_logger),
+                job_tracker: JobTracker = Depends(get_job_tracker),
+                run_events: RunEvents = Depends(get_run_events)
+                ):
+    """
+        Retrieves the state of the run: queued, running, done or failed, together
+        with the number of pages visited out of the total.
+    """
+    job = await job_tracker.get(run_id)
+    if job:
+        # The pages of a run attached to an identical crawl are those of that crawl
+        leader_run_id = await run_events.leader_of(run_id)
+        crawl = await job_tracker.get(leader_run_id) if leader_run_id else None
+        if crawl:
+            job.update(pages_done=crawl["pages_done"], pages_total=crawl["pages_total"])
+        return job
+
+    # The job state expired, but the run may still be stored
+    record = await maybe_await(repository.get_screenshots_page(run_id, 0, 1))
+    if not record:
+        logger.error("Run not found", extra= {"run_id": run_id})
+        raise HTTPException(
+                            status_code=status.HTTP_404_NOT_FOUND, 
+                            detail="Run not found for the provided ID"
+                            )
+    pages = record["total"]
+    return {
+        "run_id": run_id, 
+        "status": JobStatus.DONE.value, 
+        "pages_done": pages, 
+        "pages_total": pages
+    }
+
+
+@router.put("/screenshots/{run_id}/pin",
+            summary="Pin a screenshot run",
+            description="Keeps the run and its files whatever the retention policy says, until it is unpinned.",
+            response_model=PinResponse,
+            responses={
+                404: {
+                        "description": "Run ID not found",
+                        "content": {
+                            "application/json": {
+                                "example": {
+                                    "detail": "Run ID not found"
+                                }
+                            }
+                        }
+                    }
+                }
+            )
+async def pin_screenshot_run(
+                run_id: str, 
+                repository: AsyncScreenshotRepository = Depends(get_screenshot_repository),
+                logger: Logger = Depends(get_logger)
+                ):
+    """
+        Pins the run given by its ID.
+    """
+    return await _set_pinned(run_id, True, repository, logger)
+
+
+@router.delete("/screenshots/{run_id}/pin",
+            summary="Unpin a screenshot run",
+            description="Lets the retention policy remove the run again.",
+            response_model=PinResponse,
+            responses={
+                404: {
+                        "description": "Run ID not found",
+                        "content": {
+                            "application/json": {
+                                "example": {
+                                    "detail": "Run ID not found"
+                                }
+                            }
+                        }
+                    }
+                }
+            )
+async def unpin_screenshot_run(
+                run_id: str, 
+                repository: AsyncScreenshotRepository = Depends(get_screenshot_repository),
+                logger: Logger = Depends(get_logger)
+                ):
+    """
+        Unpins the run given by its ID.
+    """
+    return await _set_pinned(run_id, False, repository, logger)
+
+
+async def _set_pinned(run_id: str, pinned: bool, repository: AsyncScreenshotRepository, logger: Logger) -> dict:
+    if not await maybe_await(repository.set_pinned(run_id, pinned)):
+        logger.error("Run not found", extra= {"run_id": run_id})
+        raise HTTPException(
+                            status_code=status.HTTP_404_NOT_FOUND, 
+                            detail="Run not found for the provided ID"
+                            )
+    return {"run_id": run_id, "pinned": pinned}
+
+
+@router.get("/screenshots/{run_id}/events",
+            summary="Stream the progress of a screenshot run",
+            description="""
+            Server-Sent Events stream of a run. A `page` event is sent as soon as each page is captured 
+            or fails, and the stream ends with a `done` or `failed` event. Reconnecting with the 
+            `Last-Event-ID` header resumes after the last received event.
+            """,
+            response_class=StreamingResponse,
+            responses={
+                200: {
+                    "description": "Stream of events",
+                    "content": {
+                        "text/event-stream": {
+                            "example": "event: page\ndata: {\"index\": 0, \"url\": \"https://example.com/\", \"status\": \"captured\", \"path\": \"abc123_screenshot_0.png\"}\n\n"
+                        }
+                    }
+                },
+                404: {
+                        "description": "Run ID not found",
+                        "content": {
+                            "application/json": {
+                                "example": {
+                                    "detail": "Run ID not found"
+                                }
+                            }
+                        }
+                    },
+                503: {
+                        "description": "Too many event streams open",
+                        "content": {
+                            "application/json": {
+                                "example": {
+                                    "detail": "Too many event streams open, retry later"
+                                }
+                            }
+                        }
+                    }
+                }
+            )
+async def stream_screenshot_events(
+                run_id: str, 
+                last_event_id: Optional[str] = Header(None),
+                crawler_service: Crawler = Depends(get_crawler_service),
+                logger: Logger = Depends(get_logger),
+                run_events: RunEvents = Depends(get_run_events)
+                ):
+    """
+        Streams the progress of the run given by its ID, from its start or from
+        the event after `Last-Event-ID`.
+    """
+    headers = {"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+
+    if not await run_events.exists(run_id):
+        # The events expired, but the run may still be stored
+        record = await maybe_await(crawler_service.get_screenshots_by_run_id(run_id= run_id))
+        if not record:
+            logger.error("Run not found", extra= {"run_id": run_id})
+            raise HTTPException(
+                                status_code=status.HTTP_404_NOT_FOUND, 
+                                detail="Run not found for the provided ID"
+                                )
+
+        async def replay():
+            for page in record.get("pages") or [{"path": path} for path in record["screenshots"]]:
+                yield _format_sse(RunEventType.PAGE.value, dict(page, status="captured"))
+            yield _format_sse(RunEventType.DONE.value, {"screenshots": record["screenshots"]})
+
+        return StreamingResponse(replay(), media_type="text/event-stream", headers=headers)
+
+    slot = run_events.acquire()
+    if slot is None:
+        logger.warn("Too many event streams open", extra= {"run_id": run_id})
+        raise HTTPException(
+                            status_code=status.HTTP_503_SERVICE_UNAVAILABLE, 
+                            detail="Too many event streams open, retry later",
+                            headers={"Retry-After": "5"}
+                            )
 
+    async def stream():
+        async for event in run_events.stream(run_id, slot, last_event_id or "0"):
+            if event is None:
+                # Comment line keeping the connection open through proxies
+                yield ": keep-alive\n\n"
+                continue
+            event_id, event_type, data = event
+            yield _format_sse(event_type, data, event_id)
 
+    # Also released when the client is gone before the stream starts
+    return StreamingResponse(stream(), media_type="text/event-stream", headers=headers, background=BackgroundTask(slot.release))
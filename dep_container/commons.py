@@ -2,25 +2,53 @@ import logging
 import os
 import mongomock
 
+import httpx
+
 from redis import asyncio as aioredis
 from functools import lru_cache
-from typing import Generator
+from typing import Generator, Optional
 from pymongo import MongoClient
 from pymongo.database import Database
 from pathlib import Path
-from repositories.screenshot_repository import ScreenshotRepository
+from repositories.schedule_repository import AsyncScheduleRepository
+from repositories.screenshot_repository import AsyncScreenshotRepository, ScreenshotRepository
+from services.change_detection import ChangeDetector
+from services.coalescing import CrawlCoalescer
 from services.crawler import Crawler
+from services.image_processor import ImageProcessor
+from services.jobs import JobRunner, JobTracker
+from services.link_extractor import HttpLinkExtractor
+from services.politeness import PolitenessScheduler, RobotsCache
+from services.process_pool import CrawlProcessPool
+from services.retention import RetentionCollector
+from services.run_cache import RunCache
+from services.run_events import RunEvents
+from services.scheduler import CrawlScheduler
+from services.screenshot_cache import ScreenshotCache
+from services.screenshot_files import ScreenshotFiles
+from services.storage import LocalStorage, S3Storage, ScreenshotStorage
+from services.task_queue import CaptureTaskQueue
+from utils.browser_pool import BrowserPool
+from workers.crawl_process import process_crawler
 
 
 BASE_DIR = Path(os.getenv("SCREENSHOT_FOLDER"))
 BASE_DIR.mkdir(exist_ok=True)
 
 
-def get_db_session(use_mongomock: bool = False)-> Generator[Database, None, None]:
+@lru_cache(maxsize=None)
+def get_mongo_client(use_mongomock: bool = False) -> MongoClient:
+    # One client per process, it keeps its own connection pool
     if use_mongomock:
-        client = mongomock.MongoClient()
-    else:
-        client = MongoClient("mongodb://mongo:27017")
+        return mongomock.MongoClient()
+    return MongoClient(
+        os.getenv('MONGO_URI', 'mongodb://mongo:27017'),
+        maxPoolSize=int(os.getenv('MONGO_MAX_POOL_SIZE', '100'))
+    )
+
+
+def get_db_session(use_mongomock: bool = False)-> Generator[Database, None, None]:
+    client = get_mongo_client(use_mongomock)
 
     while True:
         db = client['screenshots_db']    
@@ -36,24 +64,339 @@ def get_logger():
     return logging.getLogger(__name__)
 
 
+@lru_cache(maxsize=None)
+def get_browser_pool() -> BrowserPool:
+    # Warm Chromium instances shared by every crawl, started in the app lifespan
+    return BrowserPool(
+        size=int(os.getenv('BROWSER_POOL_SIZE', '2')),
+        incognito=os.getenv('BROWSER_POOL_INCOGNITO', 'True') == 'True'
+    )
+
+
+@lru_cache(maxsize=None)
+def get_http_client() -> httpx.AsyncClient:
+    # Pooled client used to discover links without a browser
+    return httpx.AsyncClient(
+        follow_redirects=True,
+        timeout=float(os.getenv('HTTP_DISCOVERY_TIMEOUT_SECONDS', '10')),
+        limits=httpx.Limits(
+            max_connections=int(os.getenv('HTTP_DISCOVERY_MAX_CONNECTIONS', '100')),
+            max_keepalive_connections=20
+        ),
+        headers={"User-Agent": "Mozilla/5.0 (compatible; ScreenshotService/1.0)"}
+    )
+
+
+@lru_cache(maxsize=None)
+def get_link_extractor() -> HttpLinkExtractor:
+    return HttpLinkExtractor(
+        get_http_client(),
+        int(os.getenv('HTTP_DISCOVERY_MIN_LINKS', '3'))
+    )
+
+
+@lru_cache(maxsize=None)
+def get_image_processor() -> ImageProcessor:
+    # Worker processes re-encoding and resizing the screenshots
+    return ImageProcessor(int(os.getenv('IMAGE_WORKERS', '2')))
+
+
+@lru_cache(maxsize=None)
+def get_screenshot_storage() -> ScreenshotStorage:
+    # The screenshot files, in the SCREENSHOT_FOLDER or in an S3 compatible bucket
+    shard_depth = int(os.getenv('STORAGE_SHARD_DEPTH', '2'))
+    if os.getenv('SCREENSHOT_STORAGE', 'local') == 's3':
+        return S3Storage(
+            get_http_client(),
+            os.getenv('S3_ENDPOINT_URL', 'http://minio:9000'),
+            os.getenv('S3_BUCKET', 'screenshots'),
+            os.getenv('S3_ACCESS_KEY_ID', ''),
+            os.getenv('S3_SECRET_ACCESS_KEY', ''),
+            os.getenv('S3_REGION', 'us-east-1'),
+            os.getenv('S3_PREFIX', ''),
+            shard_depth,
+            int(os.getenv('S3_URL_EXPIRES_SECONDS', '3600')),
+            int(os.getenv('S3_PART_SIZE_BYTES', str(8 * 1024 * 1024)))
+        )
+    return LocalStorage(BASE_DIR, shard_depth)
+
+
+@lru_cache(maxsize=None)
+def get_screenshot_files() -> ScreenshotFiles:
+    # Resized copies of the screenshots served on demand, only these widths
+    widths = os.getenv('SCREENSHOT_VARIANT_WIDTHS', '160,320,640,1280')
+    return ScreenshotFiles(
+        get_screenshot_storage(),
+        get_image_processor(),
+        [int(width) for width in widths.split(',') if width.strip()],
+        int(os.getenv('SCREENSHOT_VARIANT_QUALITY', '80')),
+        get_screenshot_repository()
+    )
+
+
+@lru_cache(maxsize=None)
+def get_politeness_scheduler() -> PolitenessScheduler:
+    # Shared by every crawl of the process, and through Redis by the other
+    # processes, so parallel runs on one host add up
+    robots = None
+    if os.getenv('RESPECT_ROBOTS_TXT', 'True') == 'True':
+        robots = RobotsCache(
+            get_http_client(),
+            get_logger(),
+            ttl_seconds=int(os.getenv('ROBOTS_TXT_TTL_SECONDS', '3600')),
+            cache_client=get_cache_client()
+        )
+    return PolitenessScheduler(
+        max_per_host=int(os.getenv('HOST_MAX_CONCURRENT_PAGES', '2')),
+        min_interval_seconds=int(os.getenv('HOST_MIN_INTERVAL_MS', '500')) / 1000,
+        robots=robots,
+        cache_client=get_cache_client(),
+        logger=get_logger(),
+        slot_lease_seconds=int(os.getenv('HOST_SLOT_LEASE_SECONDS', '300'))
+    )
+
+
 def get_screenshot_repository(use_mongomock: bool = False):
     db: Database = next(get_db_session(use_mongomock))
-    return ScreenshotRepository(db)
+    return AsyncScreenshotRepository(db)
 
 
-def get_crawler_service(use_mongomock: bool = False):
-    repository: ScreenshotRepository = get_screenshot_repository(use_mongomock)
+def get_schedule_repository(use_mongomock: bool = False):
+    db: Database = next(get_db_session(use_mongomock))
+    return AsyncScheduleRepository(db)
+
+
+def _build_crawler(use_mongomock: bool = False, 
+                   task_queue: Optional[CaptureTaskQueue] = None,
+                   process_pool: Optional[CrawlProcessPool] = None) -> Crawler:
+    repository: AsyncScreenshotRepository = get_screenshot_repository(use_mongomock)
     return Crawler(
         repository,
-        BASE_DIR,
-        get_logger()
+        get_screenshot_storage(),
+        get_logger(),
+        get_browser_pool(),
+        int(os.getenv('MAX_CONCURRENT_PAGES', '4')),
+        get_job_tracker(),
+        get_screenshot_cache(),
+        get_link_extractor(),
+        get_image_processor(),
+        get_run_events(),
+        get_politeness_scheduler(),
+        task_queue,
+        int(os.getenv('DISTRIBUTED_RESULT_TIMEOUT_SECONDS', '600')),
+        get_change_detector(use_mongomock),
+        process_pool,
+        int(os.getenv('REUSE_LEASE_SECONDS', '3600'))
     )
 
 
+def get_change_detector(use_mongomock: bool = False) -> Optional[ChangeDetector]:
+    # Set CHANGE_DETECTION to False to store every screenshot, even when the
+    # page looks the same as in its last capture
+    if os.getenv('CHANGE_DETECTION', 'True') != 'True':
+        return None
+    return ChangeDetector(
+        get_screenshot_repository(use_mongomock),
+        get_screenshot_storage(),
+        get_image_processor(),
+        # Unset, only identical screenshots count as unchanged
+        int(os.environ['CHANGE_DETECTION_MAX_DISTANCE']) if os.getenv('CHANGE_DETECTION_MAX_DISTANCE') else None
+    )
+
+
+def _capture_task_queue() -> Optional[CaptureTaskQueue]:
+    # With DISTRIBUTED_CAPTURE the crawls only discover the links, the pages are
+    # captured by the processes started with `python -m workers.crawler`
+    return get_capture_task_queue() if os.getenv('DISTRIBUTED_CAPTURE', 'False') == 'True' else None
+
+
+def get_crawler_service(use_mongomock: bool = False):
+    return _build_crawler(use_mongomock, _capture_task_queue(), get_crawl_process_pool())
+
+
+def get_worker_crawler() -> Crawler:
+    return _build_crawler()
+
+
+def get_process_crawler() -> Crawler:
+    return _build_crawler(task_queue=_capture_task_queue())
+
+
+@lru_cache(maxsize=None)
+def get_crawl_process_pool() -> Optional[CrawlProcessPool]:
+    # With CRAWL_PROCESSES the crawls run in that many worker processes, each
+    # with its own browsers, instead of the event loop serving the API
+    processes = int(os.getenv('CRAWL_PROCESSES', '0'))
+    if processes <= 0:
+        return None
+    return CrawlProcessPool(
+        process_crawler,
+        get_logger(),
+        processes,
+        int(os.getenv('CRAWLS_PER_PROCESS', '2')),
+        stop_timeout_seconds=float(os.getenv('CRAWL_PROCESS_STOP_TIMEOUT_SECONDS', '30')),
+        max_restarts=int(os.getenv('CRAWL_PROCESS_MAX_RESTARTS', '5'))
+    )
+
+
+@lru_cache(maxsize=None)
 def get_cache_client():
     # Use the Redis service name defined in docker-compose.yml
     REDIS_HOST = os.getenv('REDIS_HOST')  # This is the Docker Compose service name
     REDIS_PORT = os.getenv('REDIS_PORT')      # Default Redis port
 
-    redis = aioredis.from_url(f"redis://{REDIS_HOST}:{REDIS_PORT}", decode_responses=True)
+    # A single connection pool shared for the whole life of the app
+    pool = aioredis.ConnectionPool.from_url(
+        f"redis://{REDIS_HOST}:{REDIS_PORT}",
+        decode_responses=True,
+        max_connections=int(os.getenv('REDIS_MAX_CONNECTIONS', '50'))
+    )
+    redis = aioredis.Redis(connection_pool=pool)
     return redis
+
+
+@lru_cache(maxsize=None)
+def get_stream_client():
+    # The event listeners wait on Redis in blocking reads, each holding a
+    # connection, so they get a pool of their own and wait for a free one
+    pool = aioredis.BlockingConnectionPool.from_url(
+        f"redis://{os.getenv('REDIS_HOST')}:{os.getenv('REDIS_PORT')}",
+        decode_responses=True,
+        max_connections=int(os.getenv('REDIS_MAX_STREAM_CONNECTIONS', '600')),
+        timeout=None
+    )
+    return aioredis.Redis(connection_pool=pool)
+
+
+def _capped_by_retention(default: int) -> int:
+    """
+    Caps the lifetime of the cached state of the runs to the retention, so
+    Redis never answers for a run MongoDB already removed.
+    """
+    max_age = int(os.getenv('RETENTION_MAX_AGE_SECONDS', '0'))
+    return min(default, max_age) if max_age > 0 else default
+
+
+def get_run_ttl_seconds() -> Optional[int]:
+    # The TTL index is a safety net behind the garbage collection, which
+    # removes the files of the runs before their documents
+    max_age = int(os.getenv('RETENTION_MAX_AGE_SECONDS', '0'))
+    if max_age <= 0:
+        return None
+    return max_age + int(os.getenv('RETENTION_TTL_GRACE_SECONDS', '86400'))
+
+
+@lru_cache(maxsize=None)
+def get_run_cache() -> RunCache:
+    return RunCache(
+        get_cache_client(),
+        get_logger(),
+        _capped_by_retention(int(os.getenv('RUN_CACHE_TTL_SECONDS', '3600')))
+    )
+
+
+@lru_cache(maxsize=None)
+def get_retention_collector() -> RetentionCollector:
+    # Disabled until RETENTION_MAX_AGE_SECONDS or RETENTION_MAX_TOTAL_BYTES is set
+    return RetentionCollector(
+        get_screenshot_repository(),
+        get_screenshot_storage(),
+        get_run_cache(),
+        get_logger(),
+        max_age_seconds=int(os.getenv('RETENTION_MAX_AGE_SECONDS', '0')),
+        max_total_bytes=int(os.getenv('RETENTION_MAX_TOTAL_BYTES', '0')),
+        interval_seconds=int(os.getenv('RETENTION_INTERVAL_SECONDS', '3600')),
+        batch_size=int(os.getenv('RETENTION_BATCH_SIZE', '100')),
+        variant_widths=get_screenshot_files().variant_widths,
+        cache_client=get_cache_client(),
+        lease_seconds=int(os.getenv('RETENTION_LEASE_SECONDS', '3600')),
+        orphan_grace_seconds=int(os.getenv('RETENTION_ORPHAN_GRACE_SECONDS', '86400'))
+    )
+
+
+@lru_cache(maxsize=None)
+def get_crawl_scheduler() -> CrawlScheduler:
+    # Runs the stored schedules, set CRAWL_SCHEDULER to False in the API
+    # processes that should leave them to the others
+    return CrawlScheduler(
+        get_schedule_repository(),
+        get_job_runner(),
+        get_job_tracker(),
+        get_crawler_service(),
+        get_run_cache(),
+        get_logger(),
+        poll_seconds=float(os.getenv('SCHEDULER_POLL_SECONDS', '5')),
+        jitter_seconds=float(os.getenv('SCHEDULER_JITTER_SECONDS', '60')),
+        lease_seconds=float(os.getenv('SCHEDULER_LEASE_SECONDS', '60')),
+        max_run_seconds=float(os.getenv('SCHEDULER_MAX_RUN_SECONDS', '3600')),
+        coalescer=get_crawl_coalescer(),
+        cron_spread_seconds=float(os.getenv('SCHEDULER_CRON_SPREAD_SECONDS', '300'))
+    )
+
+
+@lru_cache(maxsize=None)
+def get_crawl_coalescer() -> Optional[CrawlCoalescer]:
+    # Identical crawls in flight are run once, set COALESCE_CRAWLS to False to
+    # crawl every request. COALESCE_ACROSS_PROCESSES shares them between the
+    # API processes through a Redis lock
+    if os.getenv('COALESCE_CRAWLS', 'True') != 'True':
+        return None
+    across_processes = os.getenv('COALESCE_ACROSS_PROCESSES', 'False') == 'True'
+    return CrawlCoalescer(
+        get_logger(),
+        get_run_events(),
+        get_cache_client() if across_processes else None,
+        window_seconds=float(os.getenv('COALESCE_WINDOW_SECONDS', '5')),
+        lock_ttl_seconds=int(os.getenv('COALESCE_LOCK_TTL_SECONDS', '600'))
+    )
+
+
+@lru_cache(maxsize=None)
+def get_screenshot_cache() -> ScreenshotCache:
+    # Set SCREENSHOT_CACHE_SECONDS to 0 to always render the pages again
+    return ScreenshotCache(
+        get_cache_client(),
+        get_screenshot_storage(),
+        int(os.getenv('SCREENSHOT_CACHE_SECONDS', '900'))
+    )
+
+
+@lru_cache(maxsize=None)
+def get_job_tracker() -> JobTracker:
+    return JobTracker(
+        get_cache_client(),
+        _capped_by_retention(int(os.getenv('JOB_STATE_TTL_SECONDS', '86400')))
+    )
+
+
+@lru_cache(maxsize=None)
+def get_run_events() -> RunEvents:
+    return RunEvents(
+        get_cache_client(),
+        _capped_by_retention(int(os.getenv('JOB_STATE_TTL_SECONDS', '86400'))),
+        stream_client=get_stream_client(),
+        max_streams=int(os.getenv('MAX_EVENT_STREAMS', '500'))
+    )
+
+
+@lru_cache(maxsize=None)
+def get_job_runner() -> JobRunner:
+    # Background workers running the crawls submitted in asynchronous mode
+    return JobRunner(
+        get_job_tracker(),
+        get_logger(),
+        int(os.getenv('JOB_WORKERS', '2')),
+        get_run_events(),
+        max_queued=int(os.getenv('JOB_MAX_QUEUED', '1000')),
+        heartbeat_seconds=float(os.getenv('JOB_HEARTBEAT_SECONDS', '30'))
+    )
+
+
+@lru_cache(maxsize=None)
+def get_capture_task_queue() -> CaptureTaskQueue:
+    return CaptureTaskQueue(
+        get_cache_client(),
+        lease_ms=int(os.getenv('CAPTURE_TASK_LEASE_SECONDS', '120')) * 1000,
+        max_deliveries=int(os.getenv('CAPTURE_TASK_MAX_DELIVERIES', '3')),
+        finished_ttl_seconds=int(os.getenv('CAPTURE_TASK_TOMBSTONE_SECONDS', '86400'))
+    )
@@ -0,0 +1,38 @@
+from pydantic import BaseModel, Field, model_validator
+from datetime import datetime
+from typing import List, Optional
+from dtos.screenshot import ScreenshotRequest
+from utils.cron import CronExpression
+
+
+class ScheduleRequest(BaseModel):
+    request: ScreenshotRequest = Field(..., description="The crawl started on every run, with the same fields than the body of `/screenshots`.")
+    interval_seconds: Optional[int] = Field(None, ge=60, example=3600, description="Run every this number of seconds. Either this or `cron`.")
+    cron: Optional[str] = Field(None, example="0 */6 * * *", description="Run on the minutes matching this five field cron expression, in server time. Either this or `interval_seconds`.")
+    enabled: bool = Field(True, example=True, description="Disabled schedules keep their settings but do not run.")
+
+    @model_validator(mode="after")
+    def check_one_timing(self):
+        if (self.interval_seconds is None) == (self.cron is None):
+            raise ValueError("exactly one of interval_seconds and cron must be given")
+        if self.cron is not None:
+            # Raises ValueError for invalid expressions
+            CronExpression(self.cron).next_after(datetime.now())
+        return self
+
+
+class ScheduleResponse(BaseModel):
+    schedule_id: str = Field(..., example="abc123")
+    request: ScreenshotRequest
+    interval_seconds: Optional[int] = Field(None, example=3600)
+    cron: Optional[str] = Field(None, example=None)
+    enabled: bool = Field(..., example=True)
+    next_run_at: datetime = Field(..., example="2024-08-20T10:17:42", description="When the schedule runs next, jitter included.")
+    last_run_id: Optional[str] = Field(None, example="def456", description="Run id of the last run, to follow it on `/screenshots/{run_id}/status`.")
+    last_run_at: Optional[datetime] = Field(None, example="2024-08-20T09:17:38")
+    skipped_runs: int = Field(0, example=0, description="Runs not started because the previous one was still going.")
+
+
+class ScheduleListResponse(BaseModel):
+    schedules: List[ScheduleResponse]
+    next_cursor: Optional[str] = Field(None, description="Pass it as `cursor` to get the next page, null on the last page.")
@@ -1,11 +1,76 @@
 from pydantic import BaseModel, Field
-from typing import List
+from datetime import datetime
+from typing import List, Optional
+from models.capture_options import CaptureOptions
+from services.link_extractor import DiscoveryMode
 
 class ScreenshotRequest(BaseModel):
     start_url: str = Field(..., example="https://www.example.com", description="The starting URL for the web crawling process.")
     number_of_links_to_follow: int = Field(..., example=5, description="The number of links to follow and capture screenshots of after the initial page.")
+    max_depth: int = Field(1, ge=1, le=10, example=2, description="How many links away from the initial page the crawl may go. 1 only follows the links of the initial page.")
+    same_origin: bool = Field(False, example=True, description="Only follow links with the same scheme, host and port than the initial page.")
+    allowed_domains: List[str] = Field([], example=["example.com"], description="Only follow links to these domains and their subdomains, besides the domain of the initial page.")
+    capture: CaptureOptions = Field(default_factory=CaptureOptions, description="Encoding and region of the screenshots.")
+    discovery_mode: DiscoveryMode = Field(DiscoveryMode.AUTO, example="auto", description="How the links are found: `http` reads the raw HTML, `browser` renders the page, `auto` reads the HTML and renders the page only when it has too few links.")
+
+    def crawl_arguments(self, run_id: str) -> dict:
+        """
+        Arguments of `Crawler.crawl_website` for the run `run_id` of this request.
+        """
+        return {
+            "start_url": self.start_url,
+            "number_of_links": self.number_of_links_to_follow,
+            "run_id": run_id,
+            "max_depth": self.max_depth,
+            "same_origin": self.same_origin,
+            "allowed_domains": self.allowed_domains,
+            "discovery_mode": self.discovery_mode,
+            "capture": self.capture,
+        }
+
+
+class ScreenshotBatchRequest(BaseModel):
+    items: List[ScreenshotRequest] = Field(..., min_length=1, max_length=500, description="The crawls to run, each one gets its own run id.")
+
+
+class BatchRunResult(BaseModel):
+    run_id: str = Field(..., example="abc123")
+    start_url: str = Field(..., example="https://www.example.com")
+    status: str = Field(..., example="done", description="queued when the batch runs in background, else done or failed.")
+    screenshots: List[str] = Field([], example=["abc123_screenshot_0.png"])
+    error: Optional[str] = Field(None, example=None, description="Reason of the failure when the status is failed.")
+
+
+class ScreenshotBatchResponse(BaseModel):
+    runs: List[BatchRunResult] = Field(..., description="One result per item, in the order of the request.")
 
 
 class ScreenshotResponse(BaseModel):
     run_id: str = Field(..., example="abc123")
-    screenshots: List[str] = Field(..., example=["abc123_screenshot_0.png", "abc123_screenshot_1.png"])
\ No newline at end of file
+    screenshots: List[str] = Field(..., example=["abc123_screenshot_0.png", "abc123_screenshot_1.png"])
+    offset: int = Field(0, example=0, description="Position of the first returned screenshot in the run.")
+    total: Optional[int] = Field(None, example=2, description="Number of screenshots of the whole run.")
+
+
+class RunSummary(BaseModel):
+    run_id: str = Field(..., example="abc123")
+    start_url: str = Field(..., example="https://www.example.com/")
+    timestamp: datetime = Field(..., example="2024-08-20T10:00:00")
+
+
+class RunListResponse(BaseModel):
+    runs: List[RunSummary]
+    next_cursor: Optional[str] = Field(None, description="Pass it as `cursor` to get the next page, null on the last page.")
+
+
+class PinResponse(BaseModel):
+    run_id: str = Field(..., example="abc123")
+    pinned: bool = Field(..., example=True, description="Pinned runs are never removed by the retention policy.")
+
+
+class JobStatusResponse(BaseModel):
+    run_id: str = Field(..., example="abc123")
+    status: str = Field(..., example="running", description="One of queued, running, done or failed.")
+    pages_done: int = Field(..., example=3, description="Number of pages already visited.")
+    pages_total: int = Field(..., example=6, description="Number of pages to visit, known once the links are extracted.")
+    error: Optional[str] = Field(None, example=None, description="Reason of the failure when the status is failed.")
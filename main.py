@@ -1,19 +1,78 @@
+from contextlib import asynccontextmanager
 from fastapi import FastAPI
-from fastapi.staticfiles import StaticFiles
 from fastapi.middleware.cors import CORSMiddleware
 from dotenv import load_dotenv
 import os
 
 # Import routers from controllers
+from controllers.files import router as files_router
 from controllers.health import router as health_router
+from controllers.schedules import router as schedules_router
 from controllers.screenshots import router as screenshots_router
 from controllers.metrics import router as metrics_router
 
 # Import middlewares
 from middlewares.prometheus_middleware import prometheus_middleware
 
+from dep_container import (
+    get_browser_pool, 
+    get_cache_client, 
+    get_crawl_process_pool,
+    get_crawl_scheduler,
+    get_http_client, 
+    get_image_processor, 
+    get_job_runner, 
+    get_mongo_client, 
+    get_retention_collector,
+    get_run_cache,
+    get_run_ttl_seconds,
+    get_schedule_repository,
+    get_screenshot_repository,
+    get_stream_client
+)
+
 load_dotenv()
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # Create the shared clients and warm up the browsers before serving the first request
+    mongo_client = get_mongo_client()
+    browser_pool = get_browser_pool()
+    job_runner = get_job_runner()
+    image_processor = get_image_processor()
+    crawl_process_pool = get_crawl_process_pool()
+    await get_run_cache().configure_memory_budget(os.getenv('REDIS_MAX_MEMORY'))
+    await get_screenshot_repository().ensure_indexes(get_run_ttl_seconds())
+    await get_schedule_repository().ensure_indexes()
+    if crawl_process_pool is None:
+        await browser_pool.start()
+    else:
+        # The browsers live in the crawl processes
+        crawl_process_pool.start()
+    await job_runner.start()
+    image_processor.start()
+    retention_collector = get_retention_collector()
+    retention_collector.start()
+    crawl_scheduler = get_crawl_scheduler()
+    if os.getenv('CRAWL_SCHEDULER', 'True') == 'True':
+        crawl_scheduler.start()
+    yield
+    await crawl_scheduler.close()
+    await retention_collector.close()
+    await job_runner.close()
+    if crawl_process_pool is not None:
+        await crawl_process_pool.close()
+    await browser_pool.close()
+    image_processor.close()
+    await get_http_client().aclose()
+    await get_cache_client().aclose()
+    await get_stream_client().aclose()
+    mongo_client.close()
+
+
 app = FastAPI(
+    lifespan=lifespan,
     title="My Screenshot API",
     description="This API allows you to take screenshots of web pages and store them.",
     version="1.0.0",
@@ -28,13 +87,14 @@ app = FastAPI(
     }
 )
 
+# Registered once, the metrics are only served when exposed
+app.middleware("http")(prometheus_middleware)
+
 need_expose_metrics = os.getenv('IS_EXPOSE_METRICS')
 if need_expose_metrics == 'True':
-    app.middleware("http")(prometheus_middleware)
     app.include_router(metrics_router)
 
 
-app.middleware("http")(prometheus_middleware)
 app.add_middleware(
     CORSMiddleware,
     allow_origins=["http://localhost:5500"],  # Specify the exact origin here
@@ -47,10 +107,9 @@ app.add_middleware(
 # Register the routers
 app.include_router(health_router)
 app.include_router(screenshots_router)
+app.include_router(schedules_router)
 
 
-# Serve static files (e.g., screenshots)
+# Serve the screenshots, with caching headers, ranges and resized copies
 scsh_path = os.getenv('SCREENSHOT_FOLDER')
-app.mount(f"/{scsh_path}", 
-          StaticFiles(directory=scsh_path), 
-          name=scsh_path)
+app.include_router(files_router, prefix=f"/{scsh_path}")
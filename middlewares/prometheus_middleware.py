@@ -1,10 +1,22 @@
+import time
 from prometheus_client import Counter, Histogram
 
-REQUEST_COUNT = Counter('request_count', 'Total number of requests')
-REQUEST_LATENCY = Histogram('request_latency_seconds', 'Latency of requests in seconds')
+REQUEST_COUNT = Counter('request_count', 'Total number of requests', ['method', 'route', 'status'])
+REQUEST_LATENCY = Histogram('request_latency_seconds', 'Latency of requests in seconds', ['method', 'route'])
+
+def _route_of(request) -> str:
+    # The path template keeps the number of label values bounded, ids included
+    route = request.scope.get("route")
+    return getattr(route, "path", None) or "unmatched"
 
 async def prometheus_middleware(request, call_next):
-    REQUEST_COUNT.inc()  # Increment the request count
-    with REQUEST_LATENCY.time():
+    start = time.perf_counter()
+    status = 500
+    try:
         response = await call_next(request)
-    return response
+        status = response.status_code
+        return response
+    finally:
+        route = _route_of(request)
+        REQUEST_COUNT.labels(request.method, route, str(status)).inc()
+        REQUEST_LATENCY.labels(request.method, route).observe(time.perf_counter() - start)
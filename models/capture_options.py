@@ -0,0 +1,176 @@
+from enum import Enum
+from typing import List, Optional, Union
+from pydantic import BaseModel, Field, field_validator, model_validator
+
+class ImageFormat(str, Enum):
+    PNG = "png"
+    JPEG = "jpeg"
+    WEBP = "webp"
+
+    @property
+    def extension(self) -> str:
+        return "jpg" if self == ImageFormat.JPEG else self.value
+
+
+class ClipRegion(BaseModel):
+    x: int = Field(..., ge=0, example=0)
+    y: int = Field(..., ge=0, example=0)
+    width: int = Field(..., gt=0, example=800)
+    height: int = Field(..., gt=0, example=600)
+
+
+class WaitUntil(str, Enum):
+    DOMCONTENTLOADED = "domcontentloaded"
+    LOAD = "load"
+    NETWORKIDLE0 = "networkidle0"
+    NETWORKIDLE2 = "networkidle2"
+
+
+class ResourceType(str, Enum):
+    STYLESHEET = "stylesheet"
+    IMAGE = "image"
+    MEDIA = "media"
+    FONT = "font"
+    SCRIPT = "script"
+    TEXTTRACK = "texttrack"
+    XHR = "xhr"
+    FETCH = "fetch"
+    EVENTSOURCE = "eventsource"
+    WEBSOCKET = "websocket"
+    MANIFEST = "manifest"
+    OTHER = "other"
+
+
+class CaptureProfile(BaseModel):
+    blocked_resource_types: List[ResourceType] = Field([], example=["media", "font"], description="Requests of these types are aborted.")
+    blocked_url_patterns: List[str] = Field([], example=["*doubleclick.net*"], description="Requests whose URL matches one of these glob patterns are aborted.")
+    wait_until: WaitUntil = Field(WaitUntil.LOAD, example="domcontentloaded", description="Navigation event after which the page is captured.")
+    wait_for_selector: Optional[str] = Field(None, example="#content", description="Also wait for this element before capturing the page.")
+    navigation_timeout_ms: int = Field(30000, ge=1000, le=120000, description="Time budget of the navigation, and of the selector wait.")
+    screenshot_timeout_ms: int = Field(30000, ge=1000, le=120000, description="Time budget of the screenshot itself.")
+
+    @property
+    def intercepts_requests(self) -> bool:
+        return bool(self.blocked_resource_types or self.blocked_url_patterns)
+
+
+# Profiles that can be asked for by name
+CAPTURE_PROFILES = {
+    "default": CaptureProfile(),
+    # Skips what rarely changes the look of the page and waits for the DOM only
+    "fast": CaptureProfile(
+        blocked_resource_types=[ResourceType.MEDIA, ResourceType.FONT],
+        blocked_url_patterns=[
+            "*google-analytics.com*",
+            "*googletagmanager.com*",
+            "*doubleclick.net*",
+            "*googlesyndication.com*",
+            "*connect.facebook.net*",
+            "*hotjar.com*",
+        ],
+        wait_until=WaitUntil.DOMCONTENTLOADED,
+        navigation_timeout_ms=15000,
+        screenshot_timeout_ms=15000,
+    ),
+    # Waits for every late request, for pages rendered by JavaScript
+    "complete": CaptureProfile(
+        wait_until=WaitUntil.NETWORKIDLE0,
+        navigation_timeout_ms=60000,
+    ),
+}
+
+
+class Viewport(BaseModel):
+    name: str = Field(..., pattern=r"^[A-Za-z0-9_-]{1,32}$", example="tablet", description="Name of the viewport, part of the file names of its screenshots.")
+    width: int = Field(..., ge=100, le=4096, example=768)
+    height: int = Field(..., ge=100, le=4096, example=1024)
+    device_scale_factor: float = Field(1, ge=1, le=4, example=2, description="Device pixels per CSS pixel, the screenshots are this many times bigger.")
+    is_mobile: bool = Field(False, example=True, description="Emulate a mobile device, which honors the meta viewport tag of the page.")
+    has_touch: bool = Field(False, example=True, description="Emulate a touch screen.")
+
+    def browser_options(self) -> dict:
+        return {
+            "width": self.width,
+            "height": self.height,
+            "deviceScaleFactor": self.device_scale_factor,
+            "isMobile": self.is_mobile,
+            "hasTouch": self.has_touch,
+        }
+
+    def cache_settings(self) -> dict:
+        settings = {"width": self.width, "height": self.height}
+        # Only when set, so a plain size shares the captures of the browser default
+        if self.device_scale_factor != 1:
+            settings["device_scale_factor"] = self.device_scale_factor
+        if self.is_mobile:
+            settings["is_mobile"] = True
+        if self.has_touch:
+            settings["has_touch"] = True
+        return settings
+
+
+# Viewport of the browser when none is asked for
+DEFAULT_VIEWPORT = Viewport(name="default", width=800, height=600)
+
+# Viewports that can be asked for by name
+VIEWPORTS = {
+    "desktop": Viewport(name="desktop", width=1280, height=800),
+    "tablet": Viewport(name="tablet", width=768, height=1024, device_scale_factor=2, is_mobile=True, has_touch=True),
+    "mobile": Viewport(name="mobile", width=390, height=844, device_scale_factor=3, is_mobile=True, has_touch=True),
+}
+
+
+class CaptureOptions(BaseModel):
+    image_format: ImageFormat = Field(ImageFormat.PNG, example="jpeg", description="Encoding of the screenshots.")
+    quality: Optional[int] = Field(None, ge=1, le=100, example=80, description="Quality of the jpeg and webp screenshots.")
+    full_page: bool = Field(False, example=False, description="Capture the whole scrollable page instead of the viewport.")
+    clip: Optional[ClipRegion] = Field(None, description="Only capture this region of the page.")
+    thumbnail_width: Optional[int] = Field(None, ge=16, le=2048, example=320, description="Also write a thumbnail of this width next to every screenshot.")
+    profile: Union[str, CaptureProfile] = Field("default", validate_default=True, example="fast", description=f"How the pages are loaded: one of {', '.join(CAPTURE_PROFILES)} or a custom profile.")
+    viewports: List[Union[str, Viewport]] = Field([], max_length=5, example=["desktop", "mobile"], description=f"Capture every page in each of these viewports, one of {', '.join(VIEWPORTS)} or a custom one, after loading it once. The browser default of 800x600 when empty.")
+
+    @field_validator("profile")
+    @classmethod
+    def resolve_profile(cls, profile):
+        if isinstance(profile, CaptureProfile):
+            return profile
+        if profile not in CAPTURE_PROFILES:
+            raise ValueError(f"unknown capture profile {profile}, expected one of {', '.join(CAPTURE_PROFILES)}")
+        return CAPTURE_PROFILES[profile].model_copy()
+
+    @field_validator("viewports")
+    @classmethod
+    def resolve_viewports(cls, viewports):
+        resolved = []
+        for viewport in viewports:
+            if not isinstance(viewport, Viewport):
+                if viewport not in VIEWPORTS:
+                    raise ValueError(f"unknown viewport {viewport}, expected one of {', '.join(VIEWPORTS)}")
+                viewport = VIEWPORTS[viewport].model_copy()
+            resolved.append(viewport)
+        if len({viewport.name for viewport in resolved}) != len(resolved):
+            raise ValueError("the names of the viewports must be different")
+        return resolved
+
+    @model_validator(mode="after")
+    def check_compatible_options(self):
+        if self.quality is not None and self.image_format == ImageFormat.PNG:
+            raise ValueError("quality is only supported for the jpeg and webp formats")
+        if self.full_page and self.clip is not None:
+            raise ValueError("full_page and clip can not be used together")
+        return self
+
+    def cache_settings(self, viewport: Optional[Viewport] = None) -> dict:
+        """
+        Settings that change the captured image, part of the screenshot cache
+        key, in `viewport` or else in the default one. The time budgets and
+        the thumbnail, made from the image, are left out.
+        """
+        return {
+            "viewport": (viewport or DEFAULT_VIEWPORT).cache_settings(),
+            "format": self.image_format.value,
+            "quality": self.quality,
+            "full_page": self.full_page,
+            "clip": self.clip.model_dump() if self.clip else None,
+            "profile": self.profile.model_dump(mode="json", exclude={"navigation_timeout_ms", "screenshot_timeout_ms"}),
+        }
@@ -0,0 +1,22 @@
+import uuid
+from datetime import datetime
+from typing import Optional
+from pydantic import BaseModel, Field
+
+
+class ScheduleDocument(BaseModel):
+    id: str = Field(default_factory=lambda: str(uuid.uuid4()), alias="_id")
+    # Body of a POST /screenshots, crawled on every run of the schedule
+    request: dict
+    interval_seconds: Optional[int] = None
+    cron: Optional[str] = None
+    enabled: bool = True
+    next_run_at: datetime
+    last_run_id: Optional[str] = None
+    last_run_at: Optional[datetime] = None
+    # Runs not started because the previous one was still going
+    skipped_runs: int = 0
+    created_at: datetime
+
+    class Config:
+        populate_by_name = True
@@ -1,15 +1,78 @@
 import uuid
 from pydantic import BaseModel, Field, HttpUrl, AfterValidator
-from typing import List, Annotated
+from typing import List, Annotated, Optional
 from datetime import datetime
+from enum import Enum
 from bson import ObjectId
 
 HttpUrlString = Annotated[HttpUrl, AfterValidator(lambda v: str(v))]
+
+class CaptureSource(str, Enum):
+    FRESH = "fresh"
+    CACHE = "cache"
+
+
+class PageChange(str, Enum):
+    # First capture of the URL with these settings
+    NEW = "new"
+    CHANGED = "changed"
+    # Looks like the last capture, whose file is reused
+    UNCHANGED = "unchanged"
+
+
+class PageCapture(BaseModel):
+    url: str
+    # Storage keys of the files, relative to the storage root
+    path: str
+    thumbnail: Optional[str] = None
+    # Whether the page was rendered for this run or reused from a previous one
+    source: CaptureSource = CaptureSource.FRESH
+    # Compared with the last capture of the URL, when change detection is on
+    change: Optional[PageChange] = None
+    content_hash: Optional[str] = None
+    perceptual_hash: Optional[str] = None
+    # With many viewports the page holds the capture of each, and its own
+    # fields are those of the first one
+    viewport: Optional[str] = None
+    viewports: Optional[List["PageCapture"]] = None
+
+    def captures(self) -> List["PageCapture"]:
+        """
+        The capture of every viewport of the page.
+        """
+        return self.viewports or [self]
+
+    class Config:
+        # Store the plain string in MongoDB
+        use_enum_values = True
+        validate_default = True
+
+
+class ChangeSummary(BaseModel):
+    new: int = 0
+    changed: int = 0
+    unchanged: int = 0
+
+    @classmethod
+    def of(cls, pages: List[PageCapture]) -> Optional["ChangeSummary"]:
+        """
+        Counts the pages by change, None when none of them was compared.
+        """
+        changes = [capture.change for page in pages for capture in page.captures() if capture.change is not None]
+        if not changes:
+            return None
+        return cls(**{change.value: changes.count(change) for change in PageChange})
+
+
 class ScreenshotDocument(BaseModel):
     id: str = Field(default_factory=lambda: str(uuid.uuid4()), alias="_id")
     start_url: HttpUrlString
     screenshots: List[str]
+    pages: List[PageCapture] = Field(default_factory=list)
     timestamp: datetime
+    # Pinned runs are never removed by the retention policy
+    pinned: bool = False
+    changes: Optional[ChangeSummary] = None
 
     class Config:
         # Automatically use alias (like _id) when generating the model
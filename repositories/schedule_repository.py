@@ -0,0 +1,101 @@
+import asyncio
+from datetime import datetime
+from typing import List, Optional
+from pymongo import ASCENDING, ReturnDocument
+from pymongo.database import Database
+
+from models.schedule_document import ScheduleDocument
+
+
+class ScheduleRepository:
+    def __init__(self, db: Database):
+        self.db = db
+        self.collection = self.db['schedules']
+
+    def ensure_indexes(self):
+        # The scheduler looks for the enabled schedules that are due
+        self.collection.create_index([("enabled", ASCENDING), ("next_run_at", ASCENDING)])
+
+    def insert_schedule(self, schedule: ScheduleDocument):
+        self.collection.insert_one(schedule.model_dump(by_alias=True))
+
+    def get_schedule(self, schedule_id: str) -> Optional[dict]:
+        return self.collection.find_one({"_id": schedule_id})
+
+    def list_schedules(self, after: Optional[str] = None, limit: int = 100) -> List[dict]:
+        query = {"_id": {"$gt": after}} if after else {}
+        return list(self.collection.find(query).sort("_id", ASCENDING).limit(limit))
+
+    def update_schedule(self, schedule_id: str, fields: dict) -> Optional[dict]:
+        """
+        Sets `fields` on the schedule and returns it, None if there is no such schedule.
+        """
+        return self.collection.find_one_and_update(
+            {"_id": schedule_id}, {"$set": fields}, return_document=ReturnDocument.AFTER
+        )
+
+    def delete_schedule(self, schedule_id: str) -> bool:
+        return self.collection.delete_one({"_id": schedule_id}).deleted_count > 0
+
+    def claim_due_schedule(self, now: datetime, lease_until: datetime) -> Optional[dict]:
+        """
+        Takes the enabled schedule that is due the longest, moving its next run
+        to `lease_until`, so no other process takes it meanwhile. A schedule
+        whose process died before starting its run is due again after the lease.
+        """
+        return self.collection.find_one_and_update(
+            {"enabled": True, "next_run_at": {"$lte": now}},
+            {"$set": {"next_run_at": lease_until}},
+            sort=[("next_run_at", ASCENDING)],
+        )
+
+    def record_run(self, schedule_id: str, run_id: str, started_at: datetime, next_run_at: datetime):
+        self.collection.update_one(
+            {"_id": schedule_id},
+            {"$set": {"last_run_id": run_id, "last_run_at": started_at, "next_run_at": next_run_at}}
+        )
+
+    def record_skipped_run(self, schedule_id: str, next_run_at: datetime):
+        self.collection.update_one(
+            {"_id": schedule_id},
+            {"$set": {"next_run_at": next_run_at}, "$inc": {"skipped_runs": 1}}
+        )
+
+
+class AsyncScheduleRepository:
+    """
+    Same interface than `ScheduleRepository`, with every call to the database
+    in a worker thread.
+    """
+
+    def __init__(self, db: Database):
+        self._repository = ScheduleRepository(db)
+        self.db = db
+        self.collection = self._repository.collection
+
+    async def ensure_indexes(self):
+        await asyncio.to_thread(self._repository.ensure_indexes)
+
+    async def insert_schedule(self, schedule: ScheduleDocument):
+        await asyncio.to_thread(self._repository.insert_schedule, schedule)
+
+    async def get_schedule(self, schedule_id: str) -> Optional[dict]:
+        return await asyncio.to_thread(self._repository.get_schedule, schedule_id)
+
+    async def list_schedules(self, after: Optional[str] = None, limit: int = 100) -> List[dict]:
+        return await asyncio.to_thread(self._repository.list_schedules, after, limit)
+
+    async def update_schedule(self, schedule_id: str, fields: dict) -> Optional[dict]:
+        return await asyncio.to_thread(self._repository.update_schedule, schedule_id, fields)
+
+    async def delete_schedule(self, schedule_id: str) -> bool:
+        return await asyncio.to_thread(self._repository.delete_schedule, schedule_id)
+
+    async def claim_due_schedule(self, now: datetime, lease_until: datetime) -> Optional[dict]:
+        return await asyncio.to_thread(self._repository.claim_due_schedule, now, lease_until)
+
+    async def record_run(self, schedule_id: str, run_id: str, started_at: datetime, next_run_at: datetime):
+        await asyncio.to_thread(self._repository.record_run, schedule_id, run_id, started_at, next_run_at)
+
+    async def record_skipped_run(self, schedule_id: str, next_run_at: datetime):
+        await asyncio.to_thread(self._repository.record_skipped_run, schedule_id, next_run_at)
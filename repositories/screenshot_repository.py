@@ -1,24 +1,405 @@
-from typing import List
+import asyncio
+from typing import Dict, Iterable, List, Optional, Set, Tuple
 from datetime import datetime
+from pymongo import ASCENDING, DESCENDING, UpdateOne
 from pymongo.database import Database
+from pymongo.errors import BulkWriteError
+
+from models.screenshot_document import ChangeSummary, PageCapture, ScreenshotDocument
+from utils.metrics import Stage, time_stage
+
+TTL_INDEX = "timestamp_ttl"
+# What the garbage collection needs to know of a run
+RUN_FILES_PROJECTION = {"timestamp": 1, "screenshots": 1, "pages": 1, "size_bytes": 1, "sized_files": 1}
 
-from models.screenshot_document import ScreenshotDocument
 
 class ScreenshotRepository:
     def __init__(self, db: Database):
         self.db = db
         self.collection = self.db['screenshots']
+        # Pages captured by the crawl workers, until their run is stored
+        self.page_collection = self.db['page_captures']
+        # Last capture of every URL and capture settings, for change detection
+        self.last_capture_collection = self.db['last_captures']
+        # Files reused by runs still in progress, kept by the garbage collection
+        self.file_lease_collection = self.db['file_leases']
 
-    def insert_screenshot_data(self, run_id: str, start_url: str, screenshots: List[str]):
+    def insert_screenshot_data(self, 
+                               run_id: str, 
+                               start_url: str, 
+                               screenshots: List[str], 
+                               pages: Optional[List[PageCapture]] = None):
         screenshot_doc = ScreenshotDocument(
             _id=run_id,
             start_url=start_url,
             screenshots=screenshots,
-            timestamp=datetime.now()
+            pages=pages or [],
+            timestamp=datetime.now(),
+            changes=ChangeSummary.of(pages or [])
         )
 
         # Insert the document into MongoDB
-        self.collection.insert_one(screenshot_doc.model_dump(by_alias=True))   
+        with time_stage(Stage.MONGO_INSERT):
+            self.collection.insert_one(screenshot_doc.model_dump(by_alias=True))   
+
+    def insert_many_screenshot_data(self, runs: List[dict]) -> List[str]:
+        """
+        Inserts many runs with one bulk write. `runs` holds the arguments of
+        `insert_screenshot_data` for every run. The write goes on after a
+        failed document; the ids of the runs that were not inserted are returned.
+        """
+        timestamp = datetime.now()
+        documents = []
+        not_inserted = []
+        for run in runs:
+            try:
+                screenshot_doc = ScreenshotDocument(
+                    _id=run["run_id"],
+                    start_url=run["start_url"],
+                    screenshots=run["screenshots"],
+                    pages=run.get("pages") or [],
+                    timestamp=timestamp,
+                    changes=ChangeSummary.of(run.get("pages") or [])
+                )
+            except ValueError:
+                not_inserted.append(run["run_id"])
+                continue
+            documents.append(screenshot_doc.model_dump(by_alias=True))
+        if not documents:
+            return not_inserted
+
+        try:
+            with time_stage(Stage.MONGO_INSERT):
+                self.collection.insert_many(documents, ordered=False)
+        except BulkWriteError as e:
+            not_inserted += [documents[error["index"]]["_id"] for error in e.details.get("writeErrors", [])]
+        return not_inserted
 
     def get_screenshots_by_run_id(self, run_id: str):
         return self.collection.find_one({"_id": run_id})
+
+    def ensure_indexes(self, ttl_seconds: Optional[int] = None):
+        """
+        Creates the indexes of the queries. With `ttl_seconds` MongoDB also
+        removes the runs that are not pinned once they are that old.
+        """
+        # Listing by start URL and by time, newest first, without scanning the collection
+        self.collection.create_index([("start_url", ASCENDING), ("timestamp", DESCENDING), ("_id", DESCENDING)])
+        self.collection.create_index([("timestamp", DESCENDING), ("_id", DESCENDING)])
+        # Files still used by other runs are kept by the garbage collection
+        self.collection.create_index([("screenshots", ASCENDING)])
+        self.collection.create_index([("pages.thumbnail", ASCENDING)], sparse=True)
+        self.collection.create_index([("pages.viewports.path", ASCENDING)], sparse=True)
+        self.collection.create_index([("pages.viewports.thumbnail", ASCENDING)], sparse=True)
+        self.page_collection.create_index([("run_id", ASCENDING), ("index", ASCENDING)])
+        self.last_capture_collection.create_index([("path", ASCENDING)])
+        self.file_lease_collection.create_index([("until", ASCENDING)], expireAfterSeconds=0)
+        self.collection.create_index([("sized_files", ASCENDING)], sparse=True)
+        self._ensure_ttl_index(ttl_seconds)
+
+    def _ensure_ttl_index(self, ttl_seconds: Optional[int]):
+        existing = self.collection.index_information().get(TTL_INDEX)
+        if existing and existing.get("expireAfterSeconds") == ttl_seconds:
+            return
+        if existing:
+            # The options of an index can not be changed in place
+            self.collection.drop_index(TTL_INDEX)
+        if ttl_seconds:
+            self.collection.create_index(
+                [("timestamp", ASCENDING)],
+                name=TTL_INDEX,
+                expireAfterSeconds=ttl_seconds,
+                partialFilterExpression={"pinned": False}
+            )
+
+    def get_screenshots_page(self, run_id: str, offset: int = 0, limit: Optional[int] = None) -> Optional[dict]:
+        """
+        Returns the run with only `limit` screenshots and pages from `offset`,
+        and the `total` number of screenshots. The slicing happens in MongoDB.
+        """
+        count = limit if limit is not None else 2 ** 31 - 1
+        documents = list(self.collection.aggregate([
+            {"$match": {"_id": run_id}},
+            {"$project": {
+                "start_url": 1,
+                "timestamp": 1,
+                "total": {"$size": "$screenshots"},
+                "screenshots": {"$slice": ["$screenshots", offset, count]},
+                "pages": {"$slice": [{"$ifNull": ["$pages", []]}, offset, count]},
+            }},
+        ]))
+        return documents[0] if documents else None
+
+    def list_runs(self,
+                  start_url: Optional[str] = None,
+                  since: Optional[datetime] = None,
+                  until: Optional[datetime] = None,
+                  after: Optional[Tuple[datetime, str]] = None,
+                  limit: int = 20) -> List[dict]:
+        """
+        Returns the runs newest first, without their screenshots. `after` is
+        the `(timestamp, _id)` of the last run of the previous page: the next
+        page starts right after it, through the index.
+        """
+        query = {}
+        if start_url:
+            query["start_url"] = start_url
+        if since or until:
+            query["timestamp"] = {}
+            if since:
+                query["timestamp"]["$gte"] = since
+            if until:
+                query["timestamp"]["$lt"] = until
+        if after:
+            timestamp, run_id = after
+            query["$or"] = [
+                {"timestamp": {"$lt": timestamp}},
+                {"timestamp": timestamp, "_id": {"$lt": run_id}},
+            ]
+        cursor = self.collection.find(query, {"start_url": 1, "timestamp": 1}) \
+            .sort([("timestamp", DESCENDING), ("_id", DESCENDING)]) \
+            .limit(limit)
+        return list(cursor)
+
+    def set_pinned(self, run_id: str, pinned: bool) -> bool:
+        """
+        Pins or unpins the run, a pinned run is never removed. Returns False
+        when there is no such run.
+        """
+        result = self.collection.update_one({"_id": run_id}, {"$set": {"pinned": pinned}})
+        return result.matched_count > 0
+
+    def list_unpinned_runs(self, before: Optional[datetime] = None, limit: int = 100) -> List[dict]:
+        """
+        Returns the oldest runs that are not pinned, started before `before`,
+        with their files and their size when it is known.
+        """
+        query = {"pinned": {"$ne": True}}
+        if before:
+            query["timestamp"] = {"$lt": before}
+        cursor = self.collection.find(query, RUN_FILES_PROJECTION) \
+            .sort([("timestamp", ASCENDING), ("_id", ASCENDING)]) \
+            .limit(limit)
+        return list(cursor)
+
+    def list_runs_without_size(self, limit: int = 100) -> List[dict]:
+        cursor = self.collection.find({"size_bytes": {"$exists": False}}, RUN_FILES_PROJECTION) \
+            .sort([("timestamp", ASCENDING), ("_id", ASCENDING)]) \
+            .limit(limit)
+        return list(cursor)
+
+    def total_size(self) -> int:
+        """
+        Bytes of the files of all the runs whose size is known.
+        """
+        documents = list(self.collection.aggregate([
+            {"$group": {"_id": None, "size_bytes": {"$sum": "$size_bytes"}}}
+        ]))
+        return documents[0]["size_bytes"] if documents else 0
+
+    def set_run_size(self, run_id: str, size_bytes: int, files: Iterable[str] = ()):
+        """
+        Stores the size of the run, and the files counted in it.
+        """
+        self.collection.update_one({"_id": run_id}, {"$set": {"size_bytes": size_bytes, "sized_files": list(files)}})
+
+    def add_run_size(self, run_id: str, size_bytes: int, files: Iterable[str]):
+        """
+        Counts `files`, of `size_bytes` bytes, in the size of a measured run.
+        """
+        self.collection.update_one(
+            {"_id": run_id, "size_bytes": {"$exists": True}},
+            {"$inc": {"size_bytes": size_bytes}, "$addToSet": {"sized_files": {"$each": list(files)}}}
+        )
+
+    def add_file_size(self, key: str, size_bytes: int):
+        """
+        Counts `size_bytes` more bytes, like a resized copy of the file `key`,
+        in the measured run the file is counted in, if any.
+        """
+        self.collection.update_one({"sized_files": key, "size_bytes": {"$exists": True}}, {"$inc": {"size_bytes": size_bytes}})
+
+    def referenced_keys(self, keys: Iterable[str], excluded_run_ids: Iterable[str], measured_only: bool = False) -> Set[str]:
+        """
+        Returns the keys among `keys` used by a run that is not excluded, like
+        the screenshots of a run reused by a later one, or leased by a run in
+        progress.
+        """
+        keys = list(keys)
+        leased = self.file_lease_collection.find({"_id": {"$in": keys}, "until": {"$gt": datetime.now()}}, {"_id": 1})
+        return set(self.referencing_runs(keys, excluded_run_ids, measured_only)) | {lease["_id"] for lease in leased}
+
+    def lease_files(self, keys: Iterable[str], until: datetime):
+        """
+        Keeps the files `keys` until `until`, for a run reusing them that is
+        not stored yet.
+        """
+        operations = [UpdateOne({"_id": key}, {"$max": {"until": until}}, upsert=True) for key in keys]
+        if operations:
+            self.file_lease_collection.bulk_write(operations, ordered=False)
+
+    def referencing_runs(self, keys: Iterable[str], excluded_run_ids: Iterable[str], measured_only: bool = False) -> Dict[str, str]:
+        """
+        Returns the newest run that is not excluded using each of the keys
+        among `keys` used by one, only among the measured runs with `measured_only`.
+        """
+        keys = list(keys)
+        query = {
+            "_id": {"$nin": list(excluded_run_ids)},
+            "$or": [
+                {"screenshots": {"$in": keys}},
+                {"pages.thumbnail": {"$in": keys}},
+                {"pages.viewports.path": {"$in": keys}},
+                {"pages.viewports.thumbnail": {"$in": keys}},
+            ],
+        }
+        if measured_only:
+            query["size_bytes"] = {"$exists": True}
+        wanted = set(keys)
+        runs: Dict[str, str] = {}
+        projection = {"screenshots": 1, "pages.thumbnail": 1, "pages.viewports.path": 1, "pages.viewports.thumbnail": 1}
+        for document in self.collection.find(query, projection).sort([("timestamp", DESCENDING), ("_id", DESCENDING)]):
+            used = set(document.get("screenshots", []))
+            for page in document.get("pages", []):
+                used.add(page.get("thumbnail"))
+                for capture in page.get("viewports") or []:
+                    used.update([capture.get("path"), capture.get("thumbnail")])
+            for key in wanted.intersection(used):
+                runs.setdefault(key, document["_id"])
+        return runs
+
+    def delete_runs(self, run_ids: Iterable[str]) -> int:
+        return self.collection.delete_many({"_id": {"$in": list(run_ids)}}).deleted_count
+
+    def save_page_capture(self, run_id: str, index: int, page: PageCapture):
+        # Keyed by run and index, so a task delivered twice writes the page once
+        self.page_collection.replace_one(
+            {"_id": f"{run_id}:{index}"},
+            {"run_id": run_id, "index": index, **page.model_dump()},
+            upsert=True
+        )
+
+    def get_last_capture(self, fingerprint: str) -> Optional[dict]:
+        return self.last_capture_collection.find_one({"_id": fingerprint})
+
+    def save_last_capture(self, fingerprint: str, url: str, page: PageCapture):
+        self.last_capture_collection.replace_one(
+            {"_id": fingerprint},
+            {
+                "url": url,
+                "path": page.path,
+                "content_hash": page.content_hash,
+                "perceptual_hash": page.perceptual_hash,
+                "timestamp": datetime.now(),
+            },
+            upsert=True
+        )
+
+    def delete_last_captures(self, paths: Iterable[str]) -> int:
+        """
+        Forgets the last captures of the deleted files `paths`.
+        """
+        return self.last_capture_collection.delete_many({"path": {"$in": list(paths)}}).deleted_count
+
+    def get_page_captures(self, run_id: str) -> List[PageCapture]:
+        documents = self.page_collection.find({"run_id": run_id}).sort("index", 1)
+        return [PageCapture(**document) for document in documents]
+
+    def delete_page_captures(self, run_id: str):
+        self.page_collection.delete_many({"run_id": run_id})
+
+
+class AsyncScreenshotRepository:
+    """
+    Same interface than `ScreenshotRepository`, but every call to the database
+    runs in a worker thread so it never blocks the event loop. It works with a
+    pymongo database as well as with a mongomock one.
+    """
+
+    def __init__(self, db: Database):
+        self._repository = ScreenshotRepository(db)
+        self.db = db
+        self.collection = self._repository.collection
+        self.page_collection = self._repository.page_collection
+        self.last_capture_collection = self._repository.last_capture_collection
+        self.file_lease_collection = self._repository.file_lease_collection
+
+    async def insert_screenshot_data(self, 
+                                     run_id: str, 
+                                     start_url: str, 
+                                     screenshots: List[str], 
+                                     pages: Optional[List[PageCapture]] = None):
+        await asyncio.to_thread(
+            self._repository.insert_screenshot_data, run_id, start_url, screenshots, pages
+        )
+
+    async def insert_many_screenshot_data(self, runs: List[dict]) -> List[str]:
+        return await asyncio.to_thread(self._repository.insert_many_screenshot_data, runs)
+
+    async def get_screenshots_by_run_id(self, run_id: str):
+        return await asyncio.to_thread(self._repository.get_screenshots_by_run_id, run_id)
+
+    async def ensure_indexes(self, ttl_seconds: Optional[int] = None):
+        await asyncio.to_thread(self._repository.ensure_indexes, ttl_seconds)
+
+    async def get_screenshots_page(self, run_id: str, offset: int = 0, limit: Optional[int] = None) -> Optional[dict]:
+        return await asyncio.to_thread(self._repository.get_screenshots_page, run_id, offset, limit)
+
+    async def list_runs(self,
+                        start_url: Optional[str] = None,
+                        since: Optional[datetime] = None,
+                        until: Optional[datetime] = None,
+                        after: Optional[Tuple[datetime, str]] = None,
+                        limit: int = 20) -> List[dict]:
+        return await asyncio.to_thread(self._repository.list_runs, start_url, since, until, after, limit)
+
+    async def set_pinned(self, run_id: str, pinned: bool) -> bool:
+        return await asyncio.to_thread(self._repository.set_pinned, run_id, pinned)
+
+    async def list_unpinned_runs(self, before: Optional[datetime] = None, limit: int = 100) -> List[dict]:
+        return await asyncio.to_thread(self._repository.list_unpinned_runs, before, limit)
+
+    async def list_runs_without_size(self, limit: int = 100) -> List[dict]:
+        return await asyncio.to_thread(self._repository.list_runs_without_size, limit)
+
+    async def set_run_size(self, run_id: str, size_bytes: int, files: Iterable[str] = ()):
+        await asyncio.to_thread(self._repository.set_run_size, run_id, size_bytes, list(files))
+
+    async def total_size(self) -> int:
+        return await asyncio.to_thread(self._repository.total_size)
+
+    async def add_run_size(self, run_id: str, size_bytes: int, files: Iterable[str]):
+        await asyncio.to_thread(self._repository.add_run_size, run_id, size_bytes, list(files))
+
+    async def add_file_size(self, key: str, size_bytes: int):
+        await asyncio.to_thread(self._repository.add_file_size, key, size_bytes)
+
+    async def referenced_keys(self, keys: Iterable[str], excluded_run_ids: Iterable[str], measured_only: bool = False) -> Set[str]:
+        return await asyncio.to_thread(self._repository.referenced_keys, list(keys), list(excluded_run_ids), measured_only)
+
+    async def referencing_runs(self, keys: Iterable[str], excluded_run_ids: Iterable[str], measured_only: bool = False) -> Dict[str, str]:
+        return await asyncio.to_thread(self._repository.referencing_runs, list(keys), list(excluded_run_ids), measured_only)
+
+    async def delete_runs(self, run_ids: Iterable[str]) -> int:
+        return await asyncio.to_thread(self._repository.delete_runs, list(run_ids))
+
+    async def save_page_capture(self, run_id: str, index: int, page: PageCapture):
+        await asyncio.to_thread(self._repository.save_page_capture, run_id, index, page)
+
+    async def get_last_capture(self, fingerprint: str) -> Optional[dict]:
+        return await asyncio.to_thread(self._repository.get_last_capture, fingerprint)
+
+    async def save_last_capture(self, fingerprint: str, url: str, page: PageCapture):
+        await asyncio.to_thread(self._repository.save_last_capture, fingerprint, url, page)
+
+    async def delete_last_captures(self, paths: Iterable[str]) -> int:
+        return await asyncio.to_thread(self._repository.delete_last_captures, list(paths))
+
+    async def lease_files(self, keys: Iterable[str], until: datetime):
+        await asyncio.to_thread(self._repository.lease_files, list(keys), until)
+
+    async def get_page_captures(self, run_id: str) -> List[PageCapture]:
+        return await asyncio.to_thread(self._repository.get_page_captures, run_id)
+
+    async def delete_page_captures(self, run_id: str):
+        await asyncio.to_thread(self._repository.delete_page_captures, run_id)
@@ -0,0 +1,70 @@
+import hashlib
+import json
+from typing import Optional, Union
+from prometheus_client import Counter
+from models.screenshot_document import PageCapture, PageChange
+from repositories.screenshot_repository import AsyncScreenshotRepository, ScreenshotRepository
+from services.image_processor import ImageProcessor
+from services.storage import ScreenshotStorage
+from utils.awaitables import maybe_await
+from utils.image_processing import hash_distance
+from utils.urls import normalize_url
+
+PAGE_CHANGES = Counter('page_changes_total', 'Captured pages compared with the last capture of their URL', ['change'])
+
+
+class ChangeDetector:
+    """
+    Compares every new screenshot with the last capture of the same URL and
+    capture settings. Identical bytes make the page unchanged: the run then
+    points at the file of the last capture instead of storing a new one.
+
+    With `max_distance`, perceptual hashes at most that many bits apart make
+    it unchanged too. The hash only sees a 9x8 grayscale copy of the page, so
+    text changes like a new price are lost: the tolerance is opt-in.
+    """
+
+    def __init__(self,
+                 repository: Union[ScreenshotRepository, AsyncScreenshotRepository],
+                 storage: ScreenshotStorage,
+                 image_processor: ImageProcessor,
+                 max_distance: Optional[int] = None):
+        self._repository = repository
+        self._storage = storage
+        self._image_processor = image_processor
+        self.max_distance = max_distance
+
+    @staticmethod
+    def fingerprint(url: str, settings: dict) -> str:
+        identity = json.dumps({"url": normalize_url(url), "settings": settings}, sort_keys=True)
+        return hashlib.sha256(identity.encode()).hexdigest()
+
+    async def compare(self, url: str, settings: dict, data: bytes) -> PageCapture:
+        """
+        Returns the page with its hashes and change. An unchanged page points
+        at the file of the last capture, which is not stored again; a last
+        capture whose file was removed since counts as none.
+        """
+        content_hash, perceptual_hash = await self._image_processor.fingerprint(data)
+        change, path = PageChange.NEW, ""
+        last = await maybe_await(self._repository.get_last_capture(self.fingerprint(url, settings)))
+        if last is not None and await self._storage.exists(last["path"]):
+            if self._changed(last, content_hash, perceptual_hash):
+                change = PageChange.CHANGED
+            else:
+                change, path = PageChange.UNCHANGED, last["path"]
+        PAGE_CHANGES.labels(change.value).inc()
+        return PageCapture(url=url, path=path, change=change, content_hash=content_hash, perceptual_hash=perceptual_hash)
+
+    def _changed(self, last: dict, content_hash: str, perceptual_hash: str) -> bool:
+        if last.get("content_hash") == content_hash:
+            return False
+        if self.max_distance is None or not last.get("perceptual_hash"):
+            return True
+        return hash_distance(last["perceptual_hash"], perceptual_hash) > self.max_distance
+
+    async def remember(self, settings: dict, page: PageCapture):
+        """
+        Makes `page` the capture the next ones of its URL are compared with.
+        """
+        await maybe_await(self._repository.save_last_capture(self.fingerprint(page.url, settings), page.url, page))
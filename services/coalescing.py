@@ -0,0 +1,190 @@
+import asyncio
+import hashlib
+import json
+from functools import partial
+from logging import Logger
+from typing import Dict, List, Optional, Tuple
+from prometheus_client import Counter
+from redis.exceptions import WatchError
+from dtos.screenshot import ScreenshotRequest
+from services.crawler import Crawler
+from services.run_events import RunEvents, RunEventType
+from utils.urls import normalize_url
+
+COALESCED_RUNS = Counter('coalesced_runs_total', 'Runs that shared the crawl of an identical request', ['scope'])
+
+
+class CoalescedCrawlError(Exception):
+    """
+    The shared crawl failed, so did every run attached to it.
+    """
+
+
+class CrawlCoalescer:
+    """
+    Single flight for the crawls: an identical request arriving while a crawl
+    is in progress, or up to `window_seconds` after it finished, attaches to
+    it instead of crawling again. Every request keeps its own run id, stored
+    with the screenshots of the shared crawl.
+
+    Within a process the requests share the crawl task. With a Redis client
+    the first process takes a lock on the request, and the others wait for the
+    events of its run; when that run can not be followed they crawl by
+    themselves.
+    """
+
+    KEY_PREFIX = "coalesce:"
+
+    def __init__(self,
+                 logger: Logger,
+                 run_events: Optional[RunEvents] = None,
+                 cache_client=None,
+                 window_seconds: float = 5,
+                 lock_ttl_seconds: int = 600):
+        self.logger = logger
+        self._run_events = run_events
+        self._cache_client = cache_client
+        self.window_seconds = window_seconds
+        # Also the longest a process waits for the crawl of another one
+        self.lock_ttl_seconds = lock_ttl_seconds
+        self._flights: Dict[str, asyncio.Future] = {}
+        # The run each flight was started for
+        self._leaders: Dict[str, str] = {}
+
+    @staticmethod
+    def key_for(request: ScreenshotRequest) -> str:
+        identity = request.model_dump(mode="json")
+        identity["start_url"] = normalize_url(request.start_url)
+        return hashlib.sha256(json.dumps(identity, sort_keys=True).encode()).hexdigest()
+
+    async def crawl(self, crawler: Crawler, request: ScreenshotRequest, run_id: str) -> List[str]:
+        """
+        Crawls `request` as the run `run_id`, or shares the crawl of an
+        identical request, and returns the screenshots.
+        """
+        key = self.key_for(request)
+        flight = self._flights.get(key)
+        if flight is None:
+            flight = asyncio.ensure_future(self._lead(key, crawler, request, run_id))
+            self._flights[key] = flight
+            self._leaders[key] = run_id
+            flight.add_done_callback(partial(self._land, key))
+        else:
+            COALESCED_RUNS.labels("process").inc()
+            log_dict = {"run_id": run_id, "start_url": request.start_url}
+            self.logger.info(f"Run attached to an identical crawl in progress {log_dict}")
+            await self._follow(run_id, self._leaders[key])
+
+        # Shielded, so a request that goes away does not cancel the crawl of the others
+        leader_run_id, screenshots = await asyncio.shield(flight)
+        if leader_run_id == run_id:
+            return screenshots
+        return await crawler.copy_run(leader_run_id, run_id)
+
+    def _land(self, key: str, flight: asyncio.Future):
+        # The late requests of a burst still share a finished crawl during the
+        # window, a failed one is tried again by the next request
+        if flight.cancelled() or flight.exception() is not None or self.window_seconds <= 0:
+            self._forget(key, flight)
+        else:
+            asyncio.get_running_loop().call_later(self.window_seconds, self._forget, key, flight)
+
+    def _forget(self, key: str, flight: asyncio.Future):
+        if self._flights.get(key) is flight:
+            del self._flights[key]
+            del self._leaders[key]
+
+    async def _lead(self, key: str, crawler: Crawler, request: ScreenshotRequest, run_id: str) -> Tuple[str, List[str]]:
+        owner = await self._acquire(key, run_id)
+        if owner != run_id:
+            await self._follow(run_id, owner)
+            screenshots = await self._wait_for(owner)
+            if screenshots is not None:
+                COALESCED_RUNS.labels("cluster").inc()
+                return owner, screenshots
+            await self._follow(run_id, None)
+        try:
+            screenshots = await crawler.crawl_website(**request.crawl_arguments(run_id))
+        except BaseException:
+            await self._release(key, run_id, 0)
+            raise
+        await self._release(key, run_id, self.window_seconds)
+        return run_id, screenshots
+
+    async def _follow(self, run_id: str, leader_run_id: Optional[str]):
+        """
+        Points the events and the progress of `run_id` at the crawl of
+        `leader_run_id`, or back at its own with None.
+        """
+        if self._run_events is None:
+            return
+        try:
+            await self._run_events.follow(run_id, leader_run_id)
+        except Exception as e:
+            self.logger.warn(f"Could not record the followed crawl 'run_id': {run_id} 'exception': {e}")
+
+    async def _acquire(self, key: str, run_id: str) -> str:
+        """
+        Returns `run_id` when this process crawls the request, else the run
+        id of the process crawling it.
+        """
+        if self._cache_client is None:
+            return run_id
+        try:
+            if await self._cache_client.set(f"{self.KEY_PREFIX}{key}", run_id, nx=True, ex=self.lock_ttl_seconds):
+                return run_id
+            return await self._cache_client.get(f"{self.KEY_PREFIX}{key}") or run_id
+        except Exception as e:
+            self.logger.warn(f"Could not take the crawl lock 'run_id': {run_id} 'exception': {e}")
+            return run_id
+
+    async def _release(self, key: str, run_id: str, keep_seconds: float):
+        """
+        Keeps the lock `keep_seconds` longer, for the window, or removes it,
+        only when it is still the one of `run_id`.
+        """
+        if self._cache_client is None:
+            return
+        lock = f"{self.KEY_PREFIX}{key}"
+        try:
+            async with self._cache_client.pipeline(transaction=True) as pipe:
+                await pipe.watch(lock)
+                if await pipe.get(lock) != run_id:
+                    return
+                pipe.multi()
+                if keep_seconds > 0:
+                    pipe.pexpire(lock, int(keep_seconds * 1000))
+                else:
+                    pipe.delete(lock)
+                await pipe.execute()
+        except WatchError:
+            # Taken by another run meanwhile
+            pass
+        except Exception as e:
+            self.logger.warn(f"Could not release the crawl lock 'run_id': {run_id} 'exception': {e}")
+
+    async def _wait_for(self, leader_run_id: str) -> Optional[List[str]]:
+        """
+        Screenshots of the run crawled by another process once it is done,
+        None when it can not be followed.
+        """
+        if self._run_events is None:
+            return None
+        try:
+            return await asyncio.wait_for(self._outcome(leader_run_id), self.lock_ttl_seconds)
+        except CoalescedCrawlError:
+            raise
+        except Exception as e:
+            self.logger.warn(f"Could not follow the identical crawl 'run_id': {leader_run_id} 'exception': {e!r}")
+            return None
+
+    async def _outcome(self, leader_run_id: str) -> Optional[List[str]]:
+        async for event in self._run_events.listen(leader_run_id):
+            if event is None:
+                continue
+            _, event_type, data = event
+            if event_type == RunEventType.DONE.value:
+                return data.get("screenshots", [])
+            if event_type == RunEventType.FAILED.value:
+                raise CoalescedCrawlError(f"The shared crawl of run {leader_run_id} failed: {data.get('error')}")
+        return None
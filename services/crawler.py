@@ -1,23 +1,201 @@
-from pathlib import Path, PosixPath
-from typing import List
+import asyncio
+from contextlib import nullcontext
+from datetime import datetime, timedelta
+from typing import List, Optional, Union
 from pyppeteer.browser import Browser
 from logging import Logger
-from repositories.screenshot_repository import ScreenshotRepository
-from utils.context_managers import BrowserContextManager, PageContextManager
+from models.capture_options import CaptureOptions, CaptureProfile, ImageFormat, Viewport
+from models.screenshot_document import CaptureSource, PageCapture, PageChange
+from repositories.screenshot_repository import AsyncScreenshotRepository, ScreenshotRepository
+from services.change_detection import ChangeDetector
+from services.image_processor import ImageProcessor
+from services.jobs import JobTracker
+from services.link_extractor import DiscoveryMode, HttpLinkExtractor
+from services.politeness import PageDisallowedError, PolitenessScheduler, interleave_by_host
+from services.process_pool import CrawlProcessPool
+from services.run_events import RunEvents, RunEventType
+from services.screenshot_cache import ScreenshotCache
+from services.storage import ScreenshotStorage
+from services.task_queue import CaptureTaskQueue
+from utils.awaitables import maybe_await
+from utils.browser_pool import BrowserPool
+from utils.frontier import CrawlFrontier
+from utils.image_processing import thumbnail_path
+from utils.metrics import RUNS_IN_FLIGHT, Stage, time_stage
+from utils.page_loading import emulate_viewport, load_page, reload_page
+from utils.context_managers import BrowserContextManager, LazyBrowserSession, PageContextManager
 
 class Crawler:
     def __init__(self, 
-                repository: ScreenshotRepository, 
-                base_dir: Path, 
-                logger: Logger):
+                repository: Union[ScreenshotRepository, AsyncScreenshotRepository], 
+                storage: ScreenshotStorage, 
+                logger: Logger,
+                browser_pool: Optional[BrowserPool] = None,
+                max_concurrent_pages: int = 1,
+                job_tracker: Optional[JobTracker] = None,
+                screenshot_cache: Optional[ScreenshotCache] = None,
+                link_extractor: Optional[HttpLinkExtractor] = None,
+                image_processor: Optional[ImageProcessor] = None,
+                run_events: Optional[RunEvents] = None,
+                scheduler: Optional[PolitenessScheduler] = None,
+                task_queue: Optional[CaptureTaskQueue] = None,
+                remote_timeout_seconds: float = 600,
+                change_detector: Optional[ChangeDetector] = None,
+                process_pool: Optional[CrawlProcessPool] = None,
+                reuse_lease_seconds: float = 3600):
         self._repository = repository
-        self.base_dir = base_dir
+        self.storage = storage
         self.logger = logger
+        self._browser_pool = browser_pool
+        self.max_concurrent_pages = max(1, max_concurrent_pages)
+        self._job_tracker = job_tracker
+        self._screenshot_cache = screenshot_cache
+        self._link_extractor = link_extractor
+        self._image_processor = image_processor or ImageProcessor(workers=0)
+        self._run_events = run_events
+        self._scheduler = scheduler
+        # With a task queue the pages are captured by the crawl workers, which
+        # report every page on the events of the run
+        if task_queue is not None and run_events is None:
+            raise ValueError("capturing on the crawl workers needs the run events")
+        self._task_queue = task_queue
+        self.remote_timeout_seconds = remote_timeout_seconds
+        self._change_detector = change_detector
+        # With a process pool the crawls run in its worker processes, each with
+        # a crawler of its own, and this one only reads and copies the runs
+        self._process_pool = process_pool
+        # The files a run reuses are leased until it is stored, so the
+        # garbage collection does not remove them in the meantime
+        self.reuse_lease_seconds = reuse_lease_seconds
 
-    async def crawl_website(self, start_url: str, number_of_links: int, run_id: str):
+    async def crawl_website(self, 
+                            start_url: str, 
+                            number_of_links: int, 
+                            run_id: str,
+                            max_depth: int = 1,
+                            same_origin: bool = False,
+                            allowed_domains: Optional[List[str]] = None,
+                            discovery_mode: DiscoveryMode = DiscoveryMode.AUTO,
+                            capture: Optional[CaptureOptions] = None):
         """
-        
+        Discovers up to `number_of_links` pages breadth first from `start_url`,
+        following links until `max_depth`, takes a screenshot of the start page
+        and every discovered page, and stores the run.
+
+        With the `http` and `auto` discovery modes the links are read from the
+        raw HTML, and the browser is only opened for the screenshots.
+        `capture` sets the encoding and the region of the screenshots.
+        """
+        if self._process_pool is not None:
+            return await self._process_pool.run("crawl_website", {
+                "start_url": start_url,
+                "number_of_links": number_of_links,
+                "run_id": run_id,
+                "max_depth": max_depth,
+                "same_origin": same_origin,
+                "allowed_domains": allowed_domains,
+                "discovery_mode": discovery_mode,
+                "capture": capture,
+            })
+
+        with RUNS_IN_FLIGHT.track_inprogress():
+            async with LazyBrowserSession(self._browser_session) as browser_session:
+                pages = await self._crawl_pages(
+                    browser_session, 
+                    start_url, 
+                    number_of_links, 
+                    run_id, 
+                    max_depth=max_depth, 
+                    same_origin=same_origin, 
+                    allowed_domains=allowed_domains, 
+                    discovery_mode=discovery_mode, 
+                    capture=capture
+                )
+                screenshots: List[str] = [page.path for page in pages]
+
+                # Insert the document into MongoDB
+                log_dict = {"run_id": run_id, "start_url": start_url}
+                self.logger.info(f"Inserting screenshot in database {log_dict}")
+                await maybe_await(
+                    self._repository.insert_screenshot_data(run_id, start_url, screenshots, pages)
+                )
+                self.logger.info(f"Screenshot inserted {log_dict}")
+                return screenshots
+
+    async def crawl_batch(self, runs: List[dict]) -> List[Union[List[str], Exception]]:
+        """
+        Crawls many start URLs on one browser session, whose `max_concurrent_pages`
+        tabs are shared by all the runs, and stores the runs with one bulk write.
+
+        `runs` holds the arguments of `crawl_website` for every run. Returns the
+        screenshots of every run, or the exception that made it fail, in order.
+        """
+        if self._process_pool is not None:
+            return await self._process_pool.run("crawl_batch", runs)
+
+        # Shared by every run of the batch
+        semaphore = asyncio.Semaphore(self.max_concurrent_pages)
+        # Bounds the runs discovering links at the same time
+        run_slots = asyncio.Semaphore(self.max_concurrent_pages)
+
+        async def crawl(browser_session: LazyBrowserSession, run: dict) -> List[PageCapture]:
+            async with run_slots:
+                return await self._crawl_pages(browser_session, semaphore=semaphore, **run)
+
+        RUNS_IN_FLIGHT.inc(len(runs))
+        try:
+            async with LazyBrowserSession(self._browser_session) as browser_session:
+                results = await asyncio.gather(
+                    *(crawl(browser_session, run) for run in runs), return_exceptions=True
+                )
+        finally:
+            RUNS_IN_FLIGHT.dec(len(runs))
+
+        documents = [
+            {
+                "run_id": run["run_id"],
+                "start_url": run["start_url"],
+                "screenshots": [page.path for page in pages],
+                "pages": pages,
+            }
+            for run, pages in zip(runs, results) if not isinstance(pages, BaseException)
+        ]
+        failed_inserts = {}
+        if documents:
+            log_dict = {"runs": len(documents)}
+            self.logger.info(f"Inserting screenshots of the batch in database {log_dict}")
+            try:
+                not_inserted = await maybe_await(self._repository.insert_many_screenshot_data(documents))
+                failed_inserts = {run_id: Exception("the run could not be stored") for run_id in not_inserted}
+            except Exception as e:
+                self.logger.error(f"Could not insert the batch 'exception': {e}")
+                failed_inserts = {document["run_id"]: e for document in documents}
+
+        outcomes: List[Union[List[str], Exception]] = []
+        for run, pages in zip(runs, results):
+            if isinstance(pages, BaseException):
+                outcomes.append(pages)
+            elif run["run_id"] in failed_inserts:
+                outcomes.append(failed_inserts[run["run_id"]])
+            else:
+                outcomes.append([page.path for page in pages])
+        return outcomes
+
+    async def _crawl_pages(self, 
+                           browser_session: LazyBrowserSession, 
+                           start_url: str, 
+                           number_of_links: int, 
+                           run_id: str,
+                           max_depth: int = 1,
+                           same_origin: bool = False,
+                           allowed_domains: Optional[List[str]] = None,
+                           discovery_mode: DiscoveryMode = DiscoveryMode.AUTO,
+                           capture: Optional[CaptureOptions] = None,
+                           semaphore: Optional[asyncio.Semaphore] = None) -> List[PageCapture]:
+        """
+        Discovers the links of the run and captures them, without storing the run.
         """
+        capture = capture or CaptureOptions()
 
         log_dict = {
             "run_id": run_id,
@@ -26,81 +204,532 @@ class Crawler:
         }
         self.logger.info(
             f"Starting the crawl process {log_dict}")
-        
-        async with BrowserContextManager() as browser:
-            links = [start_url]
-            async with PageContextManager(browser) as page:
-                await page.goto(start_url)
-                links += await page.evaluate(f"""
-                    () => Array.from(document.querySelectorAll('a'))
-                    .slice(0, {number_of_links})
-                    .map(link => link.href)
-                """)
 
-            log_dict.update({"links": links})
-            self.logger.info(f"Links extracted from start url {log_dict}")
-            if len(links) < number_of_links:
-                extra = {"no_links_found": len(links)}
-                extra.update(log_dict)
-                self.logger.warn(
-                    f"Number of links in the page are less than the input {extra}"
-                )
+        frontier = CrawlFrontier(
+            start_url, 
+            max_depth=max_depth, 
+            same_origin=same_origin, 
+            allowed_domains=allowed_domains
+        )
+        links = [start_url] + await self._discover_links(
+            browser_session, frontier, number_of_links, discovery_mode, capture.profile
+        )
 
-            screenshots: List[str] = await self.take_screenshots(links, browser, run_id, log_dict)
+        log_dict.update({"links": links})
+        self.logger.info(f"Links extracted from start url {log_dict}")
+        if len(links) - 1 < number_of_links:
+            extra = {"no_links_found": len(links)}
+            extra.update(log_dict)
+            self.logger.warn(
+                f"Number of links in the page are less than the input {extra}"
+            )
 
-            # Insert the document into MongoDB
-            self.logger.info(f"Inserting screenshot in database {log_dict}")
-            self._repository.insert_screenshot_data(run_id, start_url, screenshots)
-            self.logger.info(f"Screenshot inserted {log_dict}")
-            return screenshots
+        await self._report_progress(run_id, pages_total=len(links))
+        await self._publish_event(run_id, RunEventType.LINKS, {"pages_total": len(links), "links": links})
+        if self._task_queue is not None:
+            return await self._capture_on_workers(links, run_id, log_dict, capture)
+        browser = await browser_session.get()
+        return await self.take_screenshots(links, browser, run_id, log_dict, capture, semaphore)
         
+    async def _discover_links(self, 
+                              browser_session: LazyBrowserSession, 
+                              frontier: CrawlFrontier, 
+                              number_of_links: int,
+                              discovery_mode: DiscoveryMode = DiscoveryMode.BROWSER,
+                              profile: Optional[CaptureProfile] = None) -> List[str]:
+        """
+        Walks the frontier breadth first, extracting the links of every queued
+        page, until `number_of_links` new pages are found or nothing is left.
+        """
+        links: List[str] = []
+        while len(links) < number_of_links:
+            next_page = frontier.pop()
+            if next_page is None:
+                break
+            url, depth = next_page
+            try:
+                hrefs = await self._extract_links(browser_session, url, discovery_mode, profile=profile)
+            except Exception as e:
+                if depth == 0:
+                    raise
+                self.logger.warn(f"Could not extract links 'url': {url} 'exception': {e}")
+                continue
+
+            for href in hrefs:
+                link = frontier.push(href, depth + 1)
+                if link is None:
+                    continue
+                links.append(link)
+                if len(links) >= number_of_links:
+                    break
+
+        log_dict = {"start_url": frontier.start_url, "max_depth": frontier.max_depth, "seen": len(frontier)}
+        self.logger.info(f"Links discovered {log_dict}")
+        return links
+
+    async def _extract_links(self, 
+                             browser_session: LazyBrowserSession, 
+                             url: str, 
+                             discovery_mode: DiscoveryMode = DiscoveryMode.BROWSER,
+                             profile: Optional[CaptureProfile] = None) -> List[str]:
+        if discovery_mode != DiscoveryMode.BROWSER and self._link_extractor is not None:
+            try:
+                hrefs = await self._link_extractor.extract(url)
+            except Exception as e:
+                if discovery_mode == DiscoveryMode.HTTP:
+                    raise
+                self.logger.warn(f"Could not fetch the page, using the browser 'url': {url} 'exception': {e}")
+                hrefs = None
+
+            if discovery_mode == DiscoveryMode.HTTP:
+                return hrefs or []
+            if hrefs is not None and len(hrefs) >= self._link_extractor.min_links:
+                return hrefs
+            log_dict = {"url": url, "links_in_html": len(hrefs or [])}
+            self.logger.info(f"Too few links in the HTML, using the browser {log_dict}")
+
+        browser = await browser_session.get()
+        async with PageContextManager(browser) as page:
+            await load_page(page, url, profile or CaptureProfile())
+            with time_stage(Stage.LINK_EVALUATION):
+                return await page.evaluate("""
+                    () => Array.from(document.querySelectorAll('a[href]'))
+                    .map(link => link.href)
+                """)
+
     async def take_screenshots(self, 
                                links_to_pages: List[str], 
                                browser: Browser,
                                run_id: str,
-                               log_dict: dict):
+                               log_dict: dict,
+                               capture: Optional[CaptureOptions] = None,
+                               semaphore: Optional[asyncio.Semaphore] = None) -> List[PageCapture]:
+        """
+        Captures every link, reusing the fresh enough captures of previous runs.
+        The pages that could not be captured are left out of the result.
+        """
         extra = {
             "run_id": run_id,
         }
         extra.update(log_dict)
         self.logger.info(f"Starting screenshot of images {extra}")
 
-        screenshot_paths: List[str] = []
+        # Bounds the number of tabs open at the same time in the browser
+        semaphore = semaphore or asyncio.Semaphore(self.max_concurrent_pages)
+
+        capture = capture or CaptureOptions()
 
-        for i, link in enumerate(links_to_pages):
+        async def capture_and_report(i: int, link: str) -> Optional[PageCapture]:
             try:
-                path = self.base_dir / f"{run_id}_screenshot_{i}.png" 
-                path_str = await self._take_screenshot(
-                    browser, 
-                    link, 
-                    path
-                )
-                screenshot_paths.append(path_str)
+                page = await self.capture_page(browser, run_id, i, link, capture, semaphore)
+            except PageDisallowedError as e:
+                self.logger.info(f"Skipping page disallowed by robots.txt 'url': {link}")
+                await self.report_page(run_id, i, link, error=str(e))
+                return None
             except Exception as e:
-                self.logger.warn(f"Could not do screenshot for path 'path': {path}")
+                self.logger.warn(f"Could not do screenshot for page 'index': {i} 'run_id': {run_id}")
                 self.logger.error(f"Error taking screenshot 'url': {link} 'exception': {e}")
+                await self.report_page(run_id, i, link, error=str(e))
+                return None
+            await self.report_page(run_id, i, link, page)
+            return page
+
+
+        # The pages are started alternating between hosts, and put back in
+        # the order of the links afterwards
+        order = interleave_by_host(links_to_pages) if self._scheduler else range(len(links_to_pages))
+        results = await asyncio.gather(
+            *(capture_and_report(i, links_to_pages[i]) for i in order)
+        )
+        by_index = dict(zip(order, results))
+        pages: List[PageCapture] = [
+            by_index[i] for i in range(len(links_to_pages)) if by_index[i] is not None
+        ]
 
         self.logger.info(f"Screenshot of images finished {log_dict}")
 
-        return screenshot_paths
+        return pages
+
+
+    async def _capture_on_workers(self,
+                                  links_to_pages: List[str],
+                                  run_id: str,
+                                  log_dict: dict,
+                                  capture: CaptureOptions) -> List[PageCapture]:
+        """
+        Queues one capture task per link, waits until the workers reported
+        every page, or until `remote_timeout_seconds` or the end of the
+        events of the run, when the tasks left are cancelled and their pages
+        reported as failed, and collects the pages they stored.
+        """
+        self.logger.info(f"Queueing screenshot of images {log_dict}")
+        capture_dict = capture.model_dump(mode="json")
+        task_ids = [
+            await self._task_queue.enqueue(run_id, i, links_to_pages[i], capture_dict)
+            for i in interleave_by_host(links_to_pages)
+        ]
 
+        pending = set(range(len(links_to_pages)))
+        error = None
+        try:
+            async with asyncio.timeout(self.remote_timeout_seconds):
+                async for event in self._run_events.listen(run_id):
+                    if event is None:
+                        continue
+                    _, event_type, data = event
+                    if event_type == RunEventType.PAGE.value:
+                        pending.discard(data["index"])
+                    if not pending:
+                        break
+            # The stream expired, or was removed, before every page was reported
+            error = "the events of the run ended before the page was captured"
+        except TimeoutError:
+            error = "timed out waiting for the crawl workers"
+
+        if pending:
+            extra = {"pages_missing": len(pending), "reason": error}
+            extra.update(log_dict)
+            self.logger.warn(f"Gave up waiting for the crawl workers {extra}")
+            # The pages still to come would be stored after the run
+            try:
+                await self._task_queue.cancel(run_id, task_ids)
+            except Exception as e:
+                self.logger.warn(f"Could not cancel the capture tasks {extra} 'exception': {e}")
+            for i in sorted(pending):
+                await self.report_page(run_id, i, links_to_pages[i], error=error)
+
+        pages = await maybe_await(self._repository.get_page_captures(run_id))
+        await maybe_await(self._repository.delete_page_captures(run_id))
+        self.logger.info(f"Screenshot of images finished {log_dict}")
+        return pages
+
+    async def capture_page(self,
+                           browser: Browser,
+                           run_id: str,
+                           index: int,
+                           link: str,
+                           capture: Optional[CaptureOptions] = None,
+                           semaphore: Optional[asyncio.Semaphore] = None) -> PageCapture:
+        """
+        Captures one link, in every viewport of `capture` after a single
+        load, or reuses the fresh enough captures of a previous run. Raises
+        when the page can not be captured.
+        """
+        capture = capture or CaptureOptions()
+        # Checked first, a page disallowed since it was cached is not reused either
+        if not await self._allowed_by_robots(link):
+            raise PageDisallowedError("disallowed by robots.txt")
+
+        # None stands for the default viewport of the browser
+        viewports: List[Optional[Viewport]] = capture.viewports or [None]
+        pages: List[Optional[PageCapture]] = [
+            await self._cached_capture(link, capture, capture.cache_settings(viewport)) for viewport in viewports
+        ]
+        missing = [i for i, page in enumerate(pages) if page is None]
+
+        if missing:
+            # The host slot is taken first, so a page waiting for its host does
+            # not hold one of the tabs needed by the pages of other hosts
+            async with self._host_slot(link), semaphore or nullcontext():
+                if capture.viewports:
+                    images = await self._take_screenshots(browser, link, capture, [viewports[i] for i in missing])
+                else:
+                    images = [await self._take_screenshot(browser, link, capture)]
+
+            # The writes and the resizing run outside of the semaphore, the tab is already closed
+            for i, data in zip(missing, images):
+                viewport = viewports[i]
+                settings = capture.cache_settings(viewport)
+                suffix = f"_{viewport.name}" if viewport else ""
+                key = self.storage.key_for(f"{run_id}_screenshot_{index}{suffix}.{capture.image_format.extension}")
+                pages[i] = await self._store_screenshot(link, key, data, capture, settings)
+                await self._cache_screenshot(link, settings, pages[i].path)
+
+        if not capture.viewports:
+            return pages[0]
+        for viewport, page in zip(viewports, pages):
+            page.viewport = viewport.name
+        return pages[0].model_copy(update={"viewports": pages})
+
+    async def _cached_capture(self, url: str, capture: CaptureOptions, settings: dict) -> Optional[PageCapture]:
+        cached_key = await self._cached_screenshot(url, settings)
+        if not cached_key or not await self._lease_file(cached_key, capture):
+            return None
+        cached_thumbnail = thumbnail_path(cached_key, capture.thumbnail_width) if capture.thumbnail_width else None
+        if cached_thumbnail and not await self.storage.exists(cached_thumbnail):
+            cached_thumbnail = await self._write_thumbnail(cached_key, capture)
+        return PageCapture(url=url, path=cached_key, thumbnail=cached_thumbnail, source=CaptureSource.CACHE)
+
+    async def _store_screenshot(self, 
+                                url: str, 
+                                key: str, 
+                                data: bytes, 
+                                capture: CaptureOptions, 
+                                settings: dict) -> PageCapture:
+        """
+        Stores the screenshot under `key` and its thumbnail, unless the page
+        did not change since its last capture: the page then points at the
+        files of that capture and nothing is written.
+        """
+        page = await self._compare_with_last_capture(url, settings, data)
+        if page.change == PageChange.UNCHANGED and not await self._lease_file(page.path, capture):
+            # Removed since the comparison, stored again
+            page.change, page.path = PageChange.NEW, ""
+        if page.change == PageChange.UNCHANGED:
+            thumbnail = thumbnail_path(page.path, capture.thumbnail_width) if capture.thumbnail_width else None
+            if thumbnail and not await self.storage.exists(thumbnail):
+                thumbnail = await self._write_thumbnail(page.path, capture, data)
+            page.thumbnail = thumbnail
+            await self._remember_capture(settings, page)
+            return page
+
+        # Written once the tab is closed, and outside of the event loop
+        with time_stage(Stage.FILE_WRITE):
+            page.path = await self.storage.write(key, data)
+        page.thumbnail = await self._write_thumbnail(key, capture, data)
+        await self._remember_capture(settings, page)
+        return page
+
+    def _browser_session(self):
+        """
+        Borrows a warm browser from the pool, or launches a dedicated one
+        when the crawler was built without a pool.
+        """
+        if self._browser_pool is not None:
+            return self._browser_pool.acquire()
+        return BrowserContextManager()
+
+    async def _write_thumbnail(self, key: str, capture: CaptureOptions, data: Optional[bytes] = None) -> Optional[str]:
+        """
+        Stores the downscaled copy of the screenshot when it was asked for,
+        next to it, from `data` or else from the stored file. A failure here
+        keeps the screenshot, without thumbnail.
+        """
+        if not capture.thumbnail_width:
+            return None
+        try:
+            if data is None:
+                data = await self.storage.read(key)
+            thumbnail = await self._image_processor.thumbnail(
+                data, 
+                capture.thumbnail_width, 
+                capture.image_format.value, 
+                capture.quality
+            )
+            return await self.storage.write(thumbnail_path(key, capture.thumbnail_width), thumbnail)
+        except Exception as e:
+            self.logger.warn(f"Could not write the thumbnail 'key': {key} 'exception': {e}")
+            return None
+
+    def _host_slot(self, url: str):
+        if self._scheduler is None:
+            return nullcontext()
+        return self._scheduler.slot(url)
+
+    async def _allowed_by_robots(self, url: str) -> bool:
+        """
+        Asks the scheduler for the robots.txt rules of the host. The page is
+        captured when they can not be read.
+        """
+        if self._scheduler is None:
+            return True
+        try:
+            return await self._scheduler.allowed(url)
+        except Exception as e:
+            self.logger.warn(f"Could not check robots.txt 'url': {url} 'exception': {e}")
+            return True
+
+    async def _lease_file(self, key: str, capture: CaptureOptions) -> bool:
+        """
+        Leases a file the run reuses, and its thumbnail, and tells whether it
+        is still there. A failure to lease it still reuses it.
+        """
+        keys = [key, thumbnail_path(key, capture.thumbnail_width)] if capture.thumbnail_width else [key]
+        try:
+            until = datetime.now() + timedelta(seconds=self.reuse_lease_seconds)
+            await maybe_await(self._repository.lease_files(keys, until))
+        except Exception as e:
+            self.logger.warn(f"Could not lease the reused file 'key': {key} 'exception': {e}")
+        return await self.storage.exists(key)
+
+    async def _cached_screenshot(self, url: str, settings: dict) -> Optional[str]:
+        if self._screenshot_cache is None:
+            return None
+        try:
+            return await self._screenshot_cache.get(url, settings)
+        except Exception as e:
+            self.logger.warn(f"Could not read the screenshot cache 'url': {url} 'exception': {e}")
+            return None
+
+    async def _compare_with_last_capture(self, url: str, settings: dict, data: bytes) -> PageCapture:
+        """
+        The page of a fresh screenshot, with its change since the last capture
+        when change detection is on. A failure here stores the screenshot.
+        """
+        if self._change_detector is not None:
+            try:
+                return await self._change_detector.compare(url, settings, data)
+            except Exception as e:
+                self.logger.warn(f"Could not compare with the last capture 'url': {url} 'exception': {e}")
+        return PageCapture(url=url, path="")
+
+    async def _remember_capture(self, settings: dict, page: PageCapture):
+        if self._change_detector is None or page.content_hash is None:
+            return
+        try:
+            await self._change_detector.remember(settings, page)
+        except Exception as e:
+            self.logger.warn(f"Could not save the last capture 'url': {page.url} 'exception': {e}")
+
+    async def _cache_screenshot(self, url: str, settings: dict, path: str):
+        if self._screenshot_cache is None:
+            return
+        try:
+            await self._screenshot_cache.put(url, settings, path)
+        except Exception as e:
+            self.logger.warn(f"Could not write the screenshot cache 'url': {url} 'exception': {e}")
+
+    async def _report_progress(self, run_id: str, pages_total: Optional[int] = None, page_done: bool = False):
+        """
+        Updates the job state of the run, a failure here never stops the crawl.
+        """
+        if self._job_tracker is None:
+            return
+        try:
+            if pages_total is not None:
+                await self._job_tracker.set_pages_total(run_id, pages_total)
+            if page_done:
+                await self._job_tracker.page_done(run_id)
+        except Exception as e:
+            self.logger.warn(f"Could not report progress 'run_id': {run_id} 'exception': {e}")
+
+    async def report_page(self, 
+                           run_id: str, 
+                           index: int, 
+                           url: str, 
+                           page: Optional[PageCapture] = None, 
+                           error: Optional[str] = None):
+        """
+        Counts the page as done and streams its outcome to the listeners of the run.
+        """
+        await self._report_progress(run_id, page_done=True)
+        data = {"index": index, "url": url, "status": "captured" if page else "failed"}
+        if page:
+            data.update(page.model_dump(exclude={"url"}))
+        if error:
+            data["error"] = error
+        await self._publish_event(run_id, RunEventType.PAGE, data)
+
+    async def _publish_event(self, run_id: str, event_type: RunEventType, data: dict):
+        if self._run_events is None:
+            return
+        try:
+            await self._run_events.publish(run_id, event_type, data)
+        except Exception as e:
+            self.logger.warn(f"Could not publish event 'run_id': {run_id} 'event': {event_type.value} 'exception': {e}")
+
+    async def copy_run(self, source_run_id: str, run_id: str) -> List[str]:
+        """
+        Stores the run `run_id` with the screenshots of `source_run_id`, for a
+        request that shared its crawl, and returns them. The pages count as
+        reused from that run, whose files they are.
+        """
+        document = await maybe_await(self._repository.get_screenshots_by_run_id(source_run_id))
+        if not document:
+            raise LookupError(f"Run {source_run_id} not found")
+        pages = []
+        for page in document.get("pages", []):
+            viewports = [{**capture, "source": CaptureSource.CACHE} for capture in page.get("viewports") or []]
+            pages.append(PageCapture(**{**page, "source": CaptureSource.CACHE, "viewports": viewports or None}))
+        await maybe_await(
+            self._repository.insert_screenshot_data(run_id, document["start_url"], document["screenshots"], pages)
+        )
+        return document["screenshots"]
 
     def get_screenshots_by_run_id(self, run_id: str):
-        """"""
+        """
+        Returns the run document, or an awaitable of it when the repository is asynchronous.
+        """
         return self._repository.get_screenshots_by_run_id(run_id)
 
-    async def _take_screenshot(self, browser: Browser, url: str, screenshot_path: PosixPath):
+    async def _take_screenshot(self, 
+                               browser: Browser, 
+                               url: str, 
+                               capture: Optional[CaptureOptions] = None) -> bytes:
         """
-        Navigates to the given URL, waits for the page to load, and takes a screenshot.
+        Navigates to the given URL, waits for the page to load as the capture
+        profile says, and takes a screenshot within the profile time budget.
 
         Args:
-            page: The Pyppeteer page object.
+            browser: The Pyppeteer browser, or browser context, to open the page in.
             url (str): The URL to navigate to.
-            screenshot_path (Path): The path where the screenshot will be saved.
+            capture (CaptureOptions): Encoding and region of the screenshot.
+
+        Returns:
+            bytes: The encoded screenshot.
         """
+        [data] = await self._take_screenshots(browser, url, capture, [None])
+        return data
 
+    async def _take_screenshots(self, 
+                                browser: Browser, 
+                                url: str, 
+                                capture: Optional[CaptureOptions],
+                                viewports: List[Optional[Viewport]]) -> List[bytes]:
+        """
+        Loads the page once and takes a screenshot in every viewport, resizing
+        the page in place between them, None keeping the current one.
+
+        Returns:
+            List[bytes]: The encoded screenshots, in the order of `viewports`.
+        """
+        capture = capture or CaptureOptions()
+        options = self._screenshot_options(capture)
+
+        timeout = capture.profile.screenshot_timeout_ms / 1000
+
+        # Turning the mobile or touch emulation on or off needs a reload, so
+        # the viewports are taken grouped by it, starting with the first one
+        def emulation(i: int) -> tuple:
+            viewport = viewports[i]
+            return (viewport.is_mobile, viewport.has_touch) if viewport else (False, False)
+        first = emulation(0)
+        order = sorted(range(len(viewports)), key=lambda i: (emulation(i) != first, emulation(i)))
+
+        images: List[Optional[bytes]] = [None] * len(viewports)
         async with PageContextManager(browser) as current_page:
-            await current_page.goto(url)  # Navigate to the URL
-            await current_page.screenshot(path=str(screenshot_path))  # Take the screenshot
-            return screenshot_path._str
-    
\ No newline at end of file
+            if viewports[order[0]] is not None:
+                # Nothing to reload before the navigation
+                await emulate_viewport(current_page, viewports[order[0]].browser_options())
+            await load_page(current_page, url, capture.profile)  # Navigate to the URL
+            for i in order:
+                if i != order[0] and viewports[i] is not None:
+                    if await emulate_viewport(current_page, viewports[i].browser_options()):
+                        await reload_page(current_page, capture.profile)
+                # Take the screenshot
+                with time_stage(Stage.SCREENSHOT_ENCODE):
+                    images[i] = await asyncio.wait_for(current_page.screenshot(**options), timeout)
+
+        # The browser only encodes png and jpeg, webp is encoded afterwards
+        if capture.image_format == ImageFormat.WEBP:
+            with time_stage(Stage.IMAGE_ENCODE):
+                images = await asyncio.gather(
+                    *(self._image_processor.encode(data, capture.image_format.value, capture.quality) for data in images)
+                )
+        return list(images)
+
+    @staticmethod
+    def _screenshot_options(capture: CaptureOptions) -> dict:
+        options = {}
+        if capture.image_format == ImageFormat.JPEG:
+            options["type"] = "jpeg"
+            if capture.quality is not None:
+                options["quality"] = capture.quality
+        elif capture.image_format == ImageFormat.WEBP:
+            # Lossless source for the re-encoding
+            options["type"] = "png"
+        if capture.full_page:
+            options["fullPage"] = True
+        if capture.clip is not None:
+            options["clip"] = capture.clip.model_dump()
+        return options
@@ -0,0 +1,41 @@
+import asyncio
+from concurrent.futures import ProcessPoolExecutor
+from functools import partial
+from typing import Optional, Tuple
+from utils.image_processing import encode_image, fingerprint, make_thumbnail
+
+class ImageProcessor:
+    """
+    Runs the re-encoding and resizing of the screenshots in a pool of worker
+    processes, so the CPU bound work never stalls the event loop. With zero
+    workers the work runs in a thread of the current process instead.
+    """
+
+    def __init__(self, workers: int = 2):
+        self.workers = workers
+        self._executor: Optional[ProcessPoolExecutor] = None
+
+    def start(self):
+        if self._executor is None and self.workers > 0:
+            self._executor = ProcessPoolExecutor(max_workers=self.workers)
+
+    def close(self):
+        if self._executor is not None:
+            self._executor.shutdown(wait=True, cancel_futures=True)
+            self._executor = None
+
+    async def _run(self, function, *args):
+        if self.workers <= 0:
+            return await asyncio.to_thread(function, *args)
+        self.start()
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self._executor, partial(function, *args))
+
+    async def encode(self, data: bytes, image_format: str, quality: Optional[int] = None) -> bytes:
+        return await self._run(encode_image, data, image_format, quality)
+
+    async def thumbnail(self, data: bytes, width: int, image_format: str, quality: Optional[int] = None) -> bytes:
+        return await self._run(make_thumbnail, data, width, image_format, quality)
+
+    async def fingerprint(self, data: bytes) -> Tuple[str, str]:
+        return await self._run(fingerprint, data)
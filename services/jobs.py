@@ -0,0 +1,289 @@
+import asyncio
+import time
+from enum import Enum
+from logging import Logger
+from typing import Awaitable, Callable, Iterable, List, Optional, Set
+from services.run_events import RunEvents, RunEventType
+
+class JobStatus(str, Enum):
+    QUEUED = "queued"
+    RUNNING = "running"
+    DONE = "done"
+    FAILED = "failed"
+
+
+class JobQueueFull(Exception):
+    """
+    Too many jobs wait for a worker already, the job was not queued.
+    """
+
+
+class JobTracker:
+    """
+    Records the state of the screenshot runs in Redis, so it can be read from
+    any API process while the crawl is still in progress.
+    """
+
+    KEY_PREFIX = "job:"
+    # The jobs queued or running, scored by the time their process last
+    # vouched for them
+    ACTIVE_KEY = "jobs:active"
+
+    def __init__(self, cache_client, ttl_seconds: int = 3600):
+        self._cache_client = cache_client
+        self.ttl_seconds = ttl_seconds
+
+    def _key(self, run_id: str) -> str:
+        return f"{self.KEY_PREFIX}{run_id}"
+
+    async def _write(self, run_id: str, mapping: dict = None, increment: str = None):
+        # The expiry goes in the same transaction than the write so a job
+        # record never outlives its TTL
+        async with self._cache_client.pipeline(transaction=True) as pipe:
+            if mapping:
+                pipe.hset(self._key(run_id), mapping=mapping)
+            if increment:
+                pipe.hincrby(self._key(run_id), increment, 1)
+            pipe.expire(self._key(run_id), self.ttl_seconds)
+            await pipe.execute()
+
+    async def create(self, run_id: str, status: JobStatus = JobStatus.QUEUED):
+        await self._write(run_id, {
+            "status": status.value,
+            "pages_done": 0,
+            "pages_total": 0,
+            "error": "",
+        })
+
+    async def set_status(self, run_id: str, status: JobStatus, error: Optional[str] = None):
+        mapping = {"status": status.value}
+        if error is not None:
+            mapping["error"] = error
+        await self._write(run_id, mapping)
+
+    async def set_pages_total(self, run_id: str, pages_total: int):
+        await self._write(run_id, {"pages_total": pages_total})
+
+    async def page_done(self, run_id: str):
+        await self._write(run_id, increment="pages_done")
+
+    async def keep_alive(self, run_ids: Iterable[str], seconds: float):
+        """
+        Records that the jobs are still queued or running, for `seconds`.
+        """
+        until = time.time() + seconds
+        mapping = {run_id: until for run_id in run_ids}
+        if mapping:
+            await self._cache_client.zadd(self.ACTIVE_KEY, mapping)
+
+    async def forget(self, run_id: str):
+        await self._cache_client.zrem(self.ACTIVE_KEY, run_id)
+
+    async def abandoned(self) -> List[str]:
+        """
+        The jobs queued or running in a process that stopped vouching for them.
+        """
+        return await self._cache_client.zrangebyscore(self.ACTIVE_KEY, "-inf", time.time())
+
+    async def get(self, run_id: str) -> Optional[dict]:
+        record = await self._cache_client.hgetall(self._key(run_id))
+        if not record:
+            return None
+        return {
+            "run_id": run_id,
+            "status": record.get("status"),
+            "pages_done": int(record.get("pages_done", 0)),
+            "pages_total": int(record.get("pages_total", 0)),
+            "error": record.get("error") or None,
+        }
+
+
+class JobRunner:
+    """
+    Runs the submitted crawls on a fixed number of background workers, outside
+    of the HTTP request that created them. At most `max_queued` jobs wait for
+    a worker, the next ones are refused with JobQueueFull.
+
+    The jobs queued or running in this process are vouched for every
+    `heartbeat_seconds`. The jobs of a process that stopped, or crashed,
+    without finishing them are recorded as failed, by the process itself
+    when it closes, else by any other process once they are not vouched for.
+    """
+
+    def __init__(self, 
+                 tracker: JobTracker, 
+                 logger: Logger, 
+                 workers: int = 2, 
+                 run_events: Optional[RunEvents] = None,
+                 max_queued: int = 1000,
+                 heartbeat_seconds: float = 30):
+        self.tracker = tracker
+        self.logger = logger
+        self.workers = max(1, workers)
+        self.run_events = run_events
+        self.max_queued = max_queued
+        self.heartbeat_seconds = heartbeat_seconds
+        self._queue: Optional[asyncio.Queue] = None
+        self._tasks: List[asyncio.Task] = []
+        self._active: Set[str] = set()
+
+    @property
+    def started(self) -> bool:
+        return self._queue is not None
+
+    async def start(self):
+        if self.started:
+            return
+        self._queue = asyncio.Queue(maxsize=self.max_queued)
+        self._tasks = [asyncio.create_task(self._worker()) for _ in range(self.workers)]
+        self._tasks.append(asyncio.create_task(self._heartbeat()))
+
+    async def close(self):
+        tasks, self._tasks = self._tasks, []
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        self._queue = None
+        # Nothing runs them anymore
+        for run_id in list(self._active):
+            try:
+                await self._fail_run(run_id, RuntimeError("The API process stopped before the job finished"))
+            except Exception as e:
+                self.logger.warn(f"Could not record the end of the job 'run_id': {run_id} 'exception': {e}")
+
+    async def join(self):
+        """
+        Waits until every submitted job is finished.
+        """
+        if self.started:
+            await self._queue.join()
+
+    async def submit(self, run_id: str, job: Callable[[], Awaitable]):
+        await self._enqueue([run_id], lambda: self.run(run_id, job))
+
+    async def submit_batch(self, run_ids: List[str], job: Callable[[], Awaitable[List]]):
+        await self._enqueue(run_ids, lambda: self.run_batch(run_ids, job))
+
+    async def _enqueue(self, run_ids: List[str], task: Callable[[], Awaitable]):
+        if not self.started:
+            await self.start()
+        if self._queue.full():
+            raise JobQueueFull(f"{self._queue.qsize()} jobs are waiting for a worker already")
+        # Taken before the first await, so the jobs submitted meanwhile see it
+        self._queue.put_nowait(task)
+        self._active.update(run_ids)
+        for run_id in run_ids:
+            await self.tracker.create(run_id, JobStatus.QUEUED)
+            await self._publish(run_id, RunEventType.STATUS, {"status": JobStatus.QUEUED.value})
+        await self._keep_alive(run_ids)
+
+    async def run(self, run_id: str, job: Callable[[], Awaitable]):
+        """
+        Runs a job in the current task while keeping its state up to date.
+        """
+        await self._start_run(run_id)
+        try:
+            result = await job()
+        except Exception as e:
+            await self._fail_run(run_id, e)
+            raise
+        try:
+            await self._finish_run(run_id, result)
+        except Exception as e:
+            # The crawl is done and stored, only its state is stale
+            self.logger.warn(f"Could not record the end of the job 'run_id': {run_id} 'exception': {e}")
+        return result
+
+    async def run_batch(self, run_ids: List[str], job: Callable[[], Awaitable[List]]) -> List:
+        """
+        Runs a job doing many runs at once. The job returns one result per run,
+        or the exception of the runs that failed, and every run is recorded as
+        done or failed on its own.
+        """
+        for run_id in run_ids:
+            await self._start_run(run_id)
+        try:
+            results = await job()
+        except Exception as e:
+            results = [e] * len(run_ids)
+        for run_id, result in zip(run_ids, results):
+            try:
+                if isinstance(result, Exception):
+                    await self._fail_run(run_id, result)
+                else:
+                    await self._finish_run(run_id, result)
+            except Exception as e:
+                self.logger.warn(f"Could not record the end of the job 'run_id': {run_id} 'exception': {e}")
+        return results
+
+    async def _start_run(self, run_id: str):
+        if run_id not in self._active:
+            self._active.add(run_id)
+            await self._keep_alive([run_id])
+        await self.tracker.set_status(run_id, JobStatus.RUNNING)
+        await self._publish(run_id, RunEventType.STATUS, {"status": JobStatus.RUNNING.value})
+
+    async def _fail_run(self, run_id: str, e: Exception):
+        log_dict = {"run_id": run_id, "exception": e}
+        self.logger.error(f"Job failed {log_dict}")
+        self._active.discard(run_id)
+        await self.tracker.set_status(run_id, JobStatus.FAILED, error=str(e))
+        await self._publish(run_id, RunEventType.FAILED, {"error": str(e)})
+        await self._forget(run_id)
+
+    async def _finish_run(self, run_id: str, result):
+        self._active.discard(run_id)
+        await self.tracker.set_status(run_id, JobStatus.DONE)
+        await self._publish(run_id, RunEventType.DONE, {"screenshots": result if isinstance(result, list) else []})
+        await self._forget(run_id)
+
+    async def _keep_alive(self, run_ids: Iterable[str]):
+        try:
+            # Three beats, a late one does not fail the jobs
+            await self.tracker.keep_alive(run_ids, 3 * self.heartbeat_seconds)
+        except Exception as e:
+            self.logger.warn(f"Could not vouch for the jobs 'exception': {e}")
+
+    async def _forget(self, run_id: str):
+        try:
+            await self.tracker.forget(run_id)
+        except Exception as e:
+            self.logger.warn(f"Could not forget the job 'run_id': {run_id} 'exception': {e}")
+
+    async def _heartbeat(self):
+        while True:
+            try:
+                await self._keep_alive(list(self._active))
+                for run_id in await self.tracker.abandoned():
+                    if run_id in self._active:
+                        continue
+                    job = await self.tracker.get(run_id)
+                    if job is not None and job["status"] in (JobStatus.QUEUED.value, JobStatus.RUNNING.value):
+                        await self._fail_run(run_id, RuntimeError("The API process running the job stopped"))
+                    else:
+                        # Finished, or expired, but not forgotten
+                        await self._forget(run_id)
+            except Exception as e:
+                self.logger.warn(f"Could not check the abandoned jobs 'exception': {e}")
+            await asyncio.sleep(self.heartbeat_seconds)
+
+    async def _publish(self, run_id: str, event_type: RunEventType, data: dict):
+        if self.run_events is None:
+            return
+        try:
+            await self.run_events.publish(run_id, event_type, data)
+        except Exception as e:
+            self.logger.warn(f"Could not publish event 'run_id': {run_id} 'event': {event_type.value} 'exception': {e}")
+
+    async def _worker(self):
+        queue = self._queue
+        while True:
+            task = await queue.get()
+            try:
+                await task()
+            except Exception as e:
+                # Raised while recording the state of the job, which may be stale
+                log_dict = {"exception": e}
+                self.logger.error(f"Background job raised {log_dict}")
+            finally:
+                queue.task_done()
@@ -0,0 +1,74 @@
+from enum import Enum
+from html.parser import HTMLParser
+from typing import List, Optional
+from urllib.parse import urljoin
+import httpx
+
+class DiscoveryMode(str, Enum):
+    # Fetch the HTML, fall back to the browser when it has too few links
+    AUTO = "auto"
+    HTTP = "http"
+    BROWSER = "browser"
+
+
+class _AnchorParser(HTMLParser):
+    def __init__(self, base_url: str):
+        super().__init__(convert_charrefs=True)
+        self.base_url = base_url
+        self.links: List[str] = []
+        self._base_seen = False
+
+    def handle_starttag(self, tag, attrs):
+        if tag == "base" and not self._base_seen:
+            href = dict(attrs).get("href")
+            if href:
+                self.base_url = urljoin(self.base_url, href.strip())
+                self._base_seen = True
+        elif tag == "a":
+            href = dict(attrs).get("href")
+            if href:
+                self.links.append(urljoin(self.base_url, href.strip()))
+
+
+class HttpLinkExtractor:
+    """
+    Extracts the links of a page from its raw HTML, with a pooled HTTP client
+    instead of a browser. Cheap, but blind to the links added by JavaScript.
+    """
+
+    def __init__(self,
+                 http_client: httpx.AsyncClient,
+                 min_links: int = 3,
+                 max_bytes: int = 2 * 1024 * 1024):
+        self._http_client = http_client
+        # Below this number of links the auto mode asks the browser instead
+        self.min_links = min_links
+        self.max_bytes = max_bytes
+
+    async def extract(self, url: str) -> Optional[List[str]]:
+        """
+        Returns the absolute hrefs of the anchors of the page, or None when the
+        response is not HTML. Network and HTTP errors are raised.
+        """
+        async with self._http_client.stream("GET", url) as response:
+            response.raise_for_status()
+            content_type = response.headers.get("content-type", "")
+            if "html" not in content_type:
+                return None
+
+            body = bytearray()
+            async for chunk in response.aiter_bytes():
+                body += chunk
+                if len(body) >= self.max_bytes:
+                    break
+            html = body.decode(response.encoding or "utf-8", errors="replace")
+            final_url = str(response.url)
+
+        return self.parse_links(html, final_url)
+
+    @staticmethod
+    def parse_links(html: str, base_url: str) -> List[str]:
+        parser = _AnchorParser(base_url)
+        parser.feed(html)
+        parser.close()
+        return parser.links
@@ -0,0 +1,319 @@
+import asyncio
+import json
+import time
+import uuid
+from collections import OrderedDict, defaultdict, deque
+from contextlib import asynccontextmanager
+from logging import Logger
+from typing import AsyncIterator, Dict, List, Optional, Tuple
+from urllib.parse import urlsplit
+from urllib.robotparser import RobotFileParser
+import httpx
+from redis.exceptions import WatchError
+
+class PageDisallowedError(Exception):
+    pass
+
+
+def host_of(url: str) -> str:
+    return (urlsplit(url).hostname or "").lower()
+
+
+def interleave_by_host(links: List[str]) -> List[int]:
+    """
+    Indexes of the links in round robin order over their hosts, so the pages of
+    one host are spread over the whole run instead of following each other.
+    """
+    queues: Dict[str, deque] = OrderedDict()
+    for i, link in enumerate(links):
+        queues.setdefault(host_of(link), deque()).append(i)
+    order: List[int] = []
+    while queues:
+        for host in list(queues):
+            order.append(queues[host].popleft())
+            if not queues[host]:
+                del queues[host]
+    return order
+
+
+class RobotsCache:
+    """
+    Parsed robots.txt files by origin, fetched once and kept `ttl_seconds`.
+    A missing file allows everything, an unreachable one too. With a
+    `cache_client` the fetched files are shared with the other processes
+    through Redis.
+    """
+
+    KEY_PREFIX = "robots:"
+
+    def __init__(self,
+                 http_client: httpx.AsyncClient,
+                 logger: Logger,
+                 user_agent: str = "ScreenshotService",
+                 ttl_seconds: int = 3600,
+                 max_entries: int = 10_000,
+                 cache_client=None):
+        self._http_client = http_client
+        self.logger = logger
+        self._cache_client = cache_client
+        self.user_agent = user_agent
+        self.ttl_seconds = ttl_seconds
+        self.max_entries = max_entries
+        self._parsers: "OrderedDict[str, Tuple[float, RobotFileParser]]" = OrderedDict()
+        self._locks: Dict[str, asyncio.Lock] = defaultdict(asyncio.Lock)
+
+    async def allowed(self, url: str) -> bool:
+        parts = urlsplit(url)
+        if parts.scheme not in ("http", "https"):
+            return True
+        parser = await self._parser(f"{parts.scheme}://{parts.netloc}")
+        return parser.can_fetch(self.user_agent, url)
+
+    async def _parser(self, origin: str) -> RobotFileParser:
+        # One fetch per origin even when many pages ask at the same time
+        async with self._locks[origin]:
+            cached = self._parsers.get(origin)
+            if cached and cached[0] > time.monotonic():
+                self._parsers.move_to_end(origin)
+                return cached[1]
+            parser = await self._fetch(origin)
+            self._parsers[origin] = (time.monotonic() + self.ttl_seconds, parser)
+            self._parsers.move_to_end(origin)
+            while len(self._parsers) > self.max_entries:
+                oldest, _ = self._parsers.popitem(last=False)
+                self._locks.pop(oldest, None)
+            return parser
+
+    async def _fetch(self, origin: str) -> RobotFileParser:
+        shared = await self._shared(origin)
+        if shared is not None:
+            return self._parse(origin, *shared)
+        try:
+            response = await self._http_client.get(f"{origin}/robots.txt")
+        except httpx.HTTPError as e:
+            self.logger.warn(f"Could not fetch robots.txt 'origin': {origin} 'exception': {e}")
+            return self._parse(origin, 200, "")
+        await self._share(origin, response.status_code, response.text)
+        return self._parse(origin, response.status_code, response.text)
+
+    @staticmethod
+    def _parse(origin: str, status_code: int, text: str) -> RobotFileParser:
+        parser = RobotFileParser(f"{origin}/robots.txt")
+        if status_code in (401, 403):
+            parser.disallow_all = True
+        elif status_code >= 400:
+            parser.allow_all = True
+        else:
+            parser.parse(text.splitlines())
+        return parser
+
+    async def _shared(self, origin: str) -> Optional[Tuple[int, str]]:
+        """
+        The robots.txt of the origin fetched by another process, if any.
+        """
+        if self._cache_client is None:
+            return None
+        try:
+            cached = await self._cache_client.get(f"{self.KEY_PREFIX}{origin}")
+        except Exception as e:
+            self.logger.warn(f"Could not read the shared robots.txt 'origin': {origin} 'exception': {e}")
+            return None
+        if cached is None:
+            return None
+        document = json.loads(cached)
+        return document["status_code"], document["text"]
+
+    async def _share(self, origin: str, status_code: int, text: str):
+        if self._cache_client is None:
+            return
+        try:
+            document = json.dumps({"status_code": status_code, "text": text})
+            await self._cache_client.set(f"{self.KEY_PREFIX}{origin}", document, ex=self.ttl_seconds)
+        except Exception as e:
+            self.logger.warn(f"Could not share the robots.txt 'origin': {origin} 'exception': {e}")
+
+
+class _HostState:
+    def __init__(self, max_concurrency: int):
+        self.semaphore = asyncio.Semaphore(max_concurrency)
+        self.lock = asyncio.Lock()
+        self.next_start = 0.0
+        self.active = 0
+
+
+class PolitenessScheduler:
+    """
+    Shared by every crawl of the process: caps the number of pages open at the
+    same time on one host, and spaces the navigations to one host by at least
+    `min_interval_seconds`. Pages of other hosts are never held back.
+
+    With a `cache_client` the slots and the spacing of a host are kept in
+    Redis, so the limits hold over all the processes, API nodes, crawl
+    processes and crawl workers alike. A slot is leased for
+    `slot_lease_seconds`, in case its process dies with it, and the lease is
+    renewed every third of it while the page is open. When Redis can not be
+    reached the limits only hold within the process.
+    """
+
+    KEY_PREFIX = "politeness:"
+
+    def __init__(self,
+                 max_per_host: int = 2,
+                 min_interval_seconds: float = 0.5,
+                 robots: Optional[RobotsCache] = None,
+                 max_hosts: int = 10_000,
+                 cache_client=None,
+                 logger: Optional[Logger] = None,
+                 slot_lease_seconds: float = 300,
+                 poll_seconds: float = 0.05):
+        self.max_per_host = max(1, max_per_host)
+        self.min_interval_seconds = min_interval_seconds
+        self.robots = robots
+        self.max_hosts = max_hosts
+        self._cache_client = cache_client
+        self.logger = logger
+        self.slot_lease_seconds = slot_lease_seconds
+        self.poll_seconds = poll_seconds
+        self._hosts: "OrderedDict[str, _HostState]" = OrderedDict()
+
+    async def allowed(self, url: str) -> bool:
+        if self.robots is None:
+            return True
+        return await self.robots.allowed(url)
+
+    def _host_state(self, host: str) -> _HostState:
+        state = self._hosts.get(host)
+        if state is None:
+            state = self._hosts[host] = _HostState(self.max_per_host)
+            self._forget_idle_hosts()
+        self._hosts.move_to_end(host)
+        return state
+
+    def _forget_idle_hosts(self):
+        now = time.monotonic()
+        for host in list(self._hosts):
+            if len(self._hosts) <= self.max_hosts:
+                break
+            state = self._hosts[host]
+            if state.active == 0 and state.next_start <= now:
+                del self._hosts[host]
+
+    @asynccontextmanager
+    async def slot(self, url: str) -> AsyncIterator[None]:
+        host = host_of(url)
+        state = self._host_state(host)
+        state.active += 1
+        try:
+            async with state.semaphore:
+                token = await self._acquire_shared(host)
+                released = asyncio.Event()
+                renewal = asyncio.create_task(self._renew_shared(host, token, released)) if token else None
+                try:
+                    wait = await self._reserve_start(host, state)
+                    if wait > 0:
+                        await asyncio.sleep(wait)
+                    yield
+                finally:
+                    # Stopped between two renewals rather than cancelled in one
+                    released.set()
+                    if renewal is not None:
+                        await renewal
+                    await self._release_shared(host, token)
+        finally:
+            state.active -= 1
+
+    async def _reserve_start(self, host: str, state: _HostState) -> float:
+        """
+        Books the next navigation to the host, and returns how long to wait
+        for it.
+        """
+        if self._cache_client is not None:
+            try:
+                return await self._reserve_shared_start(host)
+            except Exception as e:
+                self._warn(f"Could not space the page loads through Redis 'host': {host} 'exception': {e}")
+        async with state.lock:
+            now = time.monotonic()
+            wait = state.next_start - now
+            state.next_start = max(now, state.next_start) + self.min_interval_seconds
+        return wait
+
+    async def _reserve_shared_start(self, host: str) -> float:
+        key = f"{self.KEY_PREFIX}next:{host}"
+        while True:
+            try:
+                async with self._cache_client.pipeline(transaction=True) as pipe:
+                    await pipe.watch(key)
+                    # Wall clock, shared by the processes
+                    now = time.time()
+                    next_start = float(await pipe.get(key) or 0)
+                    start = max(now, next_start)
+                    pipe.multi()
+                    pipe.set(key, start + self.min_interval_seconds, px=int((start - now + self.min_interval_seconds) * 1000) + 1000)
+                    await pipe.execute()
+                    return start - now
+            except WatchError:
+                # Booked by another process meanwhile
+                continue
+
+    async def _acquire_shared(self, host: str) -> Optional[str]:
+        """
+        Waits for one of the slots of the host shared by all the processes,
+        and returns its token. None when Redis can not be reached.
+        """
+        if self._cache_client is None:
+            return None
+        key = f"{self.KEY_PREFIX}slots:{host}"
+        token = uuid.uuid4().hex
+        try:
+            while True:
+                try:
+                    async with self._cache_client.pipeline(transaction=True) as pipe:
+                        await pipe.watch(key)
+                        now = time.time()
+                        if await pipe.zcount(key, now, "+inf") < self.max_per_host:
+                            pipe.multi()
+                            # The slots of dead processes expire
+                            pipe.zremrangebyscore(key, "-inf", now)
+                            pipe.zadd(key, {token: now + self.slot_lease_seconds})
+                            pipe.expire(key, int(self.slot_lease_seconds) + 1)
+                            await pipe.execute()
+                            return token
+                except WatchError:
+                    continue
+                await asyncio.sleep(self.poll_seconds)
+        except Exception as e:
+            self._warn(f"Could not take a host slot in Redis 'host': {host} 'exception': {e}")
+            return None
+
+    async def _renew_shared(self, host: str, token: str, released: asyncio.Event):
+        """
+        Extends the lease of the slot `token` until it is released, so a page
+        open longer than the lease keeps its slot.
+        """
+        key = f"{self.KEY_PREFIX}slots:{host}"
+        while True:
+            try:
+                await asyncio.wait_for(released.wait(), self.slot_lease_seconds / 3)
+                return
+            except TimeoutError:
+                pass
+            try:
+                async with self._cache_client.pipeline(transaction=True) as pipe:
+                    pipe.zadd(key, {token: time.time() + self.slot_lease_seconds}, xx=True)
+                    pipe.expire(key, int(self.slot_lease_seconds) + 1)
+                    await pipe.execute()
+            except Exception as e:
+                self._warn(f"Could not renew a host slot in Redis 'host': {host} 'exception': {e}")
+
+    async def _release_shared(self, host: str, token: Optional[str]):
+        if token is None:
+            return
+        try:
+            await self._cache_client.zrem(f"{self.KEY_PREFIX}slots:{host}", token)
+        except Exception as e:
+            self._warn(f"Could not release a host slot in Redis 'host': {host} 'exception': {e}")
+
+    def _warn(self, message: str):
+        if self.logger is not None:
+            self.logger.warn(message)
@@ -0,0 +1,279 @@
+import asyncio
+import multiprocessing
+import signal
+import threading
+import time
+import uuid
+from logging import Logger
+from typing import Any, AsyncContextManager, Callable, Dict, List, Optional, Set
+from prometheus_client import Gauge
+from utils.metrics import mark_process_dead
+
+CRAWL_PROCESS_JOBS = Gauge('crawl_process_jobs', 'Crawls sent to the crawl processes and not finished yet', multiprocess_mode='livesum')
+
+
+class CrawlProcessError(Exception):
+    """
+    The crawl failed in its worker process, or the process died running it.
+    """
+
+
+def serve(connection, setup: Callable[[], AsyncContextManager]):
+    """
+    Entry point of a crawl process: runs the jobs received on `connection` on
+    the crawler given by `setup`, and sends back their outcome, until it gets
+    None.
+    """
+    # Ctrl+C reaches the whole process group, the API stops its processes itself
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    asyncio.run(_serve(connection, setup))
+
+
+async def _serve(connection, setup: Callable[[], AsyncContextManager]):
+    jobs = set()
+    async with setup() as crawler:
+        while True:
+            try:
+                message = await asyncio.to_thread(connection.recv)
+            except EOFError:
+                # The API is gone
+                break
+            if message is None:
+                break
+            job = asyncio.create_task(_run_job(crawler, connection, *message))
+            jobs.add(job)
+            job.add_done_callback(jobs.discard)
+        await asyncio.gather(*jobs, return_exceptions=True)
+
+
+async def _run_job(crawler, connection, job_id: str, method: str, arguments):
+    try:
+        if method == "crawl_batch":
+            results = await crawler.crawl_batch(arguments)
+            # The exceptions of the crawl may not be picklable
+            value = [CrawlProcessError(str(result)) if isinstance(result, BaseException) else result for result in results]
+        else:
+            value = await crawler.crawl_website(**arguments)
+        connection.send(("done", job_id, value))
+    except Exception as e:
+        connection.send(("failed", job_id, str(e)))
+
+
+class _CrawlProcess:
+    """
+    A crawl process, the API end of its pipe and the jobs it is running.
+    `failures` counts the processes of its slot that died one after the
+    other shortly after starting.
+    """
+
+    def __init__(self, process: multiprocessing.Process, connection, failures: int = 0):
+        self.process = process
+        self.connection = connection
+        self.jobs: Set[str] = set()
+        self.failures = failures
+        self.started_at = time.monotonic()
+
+
+class CrawlProcessPool:
+    """
+    Runs the crawls in `processes` worker processes, each with its own event
+    loop and browsers, so driving Chromium and handling the screenshots never
+    competes with the requests served by the API loop.
+
+    Every process has its own pipe to the API, which sends each job to the
+    process running the fewest, up to `crawls_per_process`, and reads the
+    results in a thread per process. A process that dies is started again, and
+    the crawls it was running fail. A process dying within
+    `restart_window_seconds` of its start is started again after a delay
+    doubling from `restart_backoff_seconds`, and after `max_restarts` such
+    deaths in a row its slot is given up.
+    """
+
+    def __init__(self,
+                 setup: Callable[[], AsyncContextManager],
+                 logger: Logger,
+                 processes: int = 2,
+                 crawls_per_process: int = 2,
+                 stop_timeout_seconds: float = 30,
+                 restart_backoff_seconds: float = 1,
+                 max_restart_backoff_seconds: float = 60,
+                 restart_window_seconds: float = 60,
+                 max_restarts: int = 5):
+        if processes < 1:
+            raise ValueError("The crawl process pool needs at least one process")
+        # Module level callable opening the crawler of a process, it is
+        # pickled to the processes
+        self._setup = setup
+        self.logger = logger
+        self.processes = processes
+        self.crawls_per_process = max(1, crawls_per_process)
+        self.stop_timeout_seconds = stop_timeout_seconds
+        self.restart_backoff_seconds = restart_backoff_seconds
+        self.max_restart_backoff_seconds = max_restart_backoff_seconds
+        self.restart_window_seconds = restart_window_seconds
+        self.max_restarts = max_restarts
+        self._context = multiprocessing.get_context("spawn")
+        self._workers: List[_CrawlProcess] = []
+        self._readers: List[threading.Thread] = []
+        self._jobs: Dict[str, asyncio.Future] = {}
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._slots: Optional[asyncio.Semaphore] = None
+        # Processes waiting for their restart, and slots given up
+        self._restarts: Set[asyncio.TimerHandle] = set()
+        self._given_up = 0
+        self._available: Optional[asyncio.Event] = None
+        self._started = False
+        self._closing = False
+
+    @property
+    def started(self) -> bool:
+        return self._started
+
+    def start(self):
+        if self.started:
+            return
+        self._loop = asyncio.get_running_loop()
+        self._slots = asyncio.Semaphore(self.processes * self.crawls_per_process)
+        self._available = asyncio.Event()
+        self._given_up = 0
+        self._closing = False
+        self._started = True
+        self._workers = [self._spawn() for _ in range(self.processes)]
+
+    async def close(self):
+        if not self.started:
+            return
+        self._closing = True
+        for restart in self._restarts:
+            restart.cancel()
+        self._restarts.clear()
+        self._available.set()
+        # The processes finish the crawls they have before stopping
+        for worker in self._workers:
+            try:
+                worker.connection.send(None)
+            except OSError:
+                pass
+        await asyncio.to_thread(self._join)
+        for job_id in list(self._jobs):
+            self._fail(job_id, "The crawl processes were stopped")
+        for worker in self._workers:
+            worker.connection.close()
+            mark_process_dead(worker.process.pid)
+        self._workers = []
+        self._readers = []
+        self._started = False
+
+    async def run(self, method: str, arguments: Any) -> Any:
+        """
+        Runs the crawler `method`, `crawl_website` with the keyword `arguments`
+        or `crawl_batch` with the list of runs, in a crawl process, and
+        returns its result.
+        """
+        self.start()
+        async with self._slots:
+            while not self._workers:
+                if self._closing or self._given_up >= self.processes:
+                    raise CrawlProcessError("No crawl process is running")
+                # Every process is waiting for its restart
+                self._available.clear()
+                await self._available.wait()
+            worker = min(self._workers, key=lambda worker: len(worker.jobs))
+            job_id = uuid.uuid4().hex
+            future = self._loop.create_future()
+            self._jobs[job_id] = future
+            worker.jobs.add(job_id)
+            CRAWL_PROCESS_JOBS.inc()
+            try:
+                try:
+                    worker.connection.send((job_id, method, arguments))
+                except OSError as e:
+                    raise CrawlProcessError(f"The crawl process {worker.process.pid} is gone") from e
+                # A caller going away does not stop the crawl, its result is dropped
+                return await future
+            finally:
+                CRAWL_PROCESS_JOBS.dec()
+                self._jobs.pop(job_id, None)
+                worker.jobs.discard(job_id)
+
+    def _spawn(self, failures: int = 0) -> _CrawlProcess:
+        connection, process_end = self._context.Pipe()
+        process = self._context.Process(
+            target=serve,
+            args=(process_end, self._setup),
+            name="crawl-process",
+            daemon=True
+        )
+        process.start()
+        # Only the process keeps its end, so the pipe ends with it
+        process_end.close()
+        worker = _CrawlProcess(process, connection, failures)
+        reader = threading.Thread(target=self._read, args=(worker,), name="crawl-process-results", daemon=True)
+        reader.start()
+        self._readers.append(reader)
+        return worker
+
+    def _join(self):
+        for worker in self._workers:
+            worker.process.join(self.stop_timeout_seconds)
+            if worker.process.is_alive():
+                worker.process.terminate()
+                worker.process.join()
+        for reader in self._readers:
+            reader.join()
+
+    def _read(self, worker: _CrawlProcess):
+        while True:
+            try:
+                message = worker.connection.recv()
+            except (EOFError, OSError):
+                break
+            self._loop.call_soon_threadsafe(self._receive, *message)
+        worker.process.join()
+        self._loop.call_soon_threadsafe(self._lost, worker)
+
+    def _receive(self, kind: str, job_id: str, value: Any):
+        future = self._jobs.get(job_id)
+        if future is None or future.done():
+            return
+        if kind == "done":
+            future.set_result(value)
+        else:
+            future.set_exception(CrawlProcessError(value))
+
+    def _fail(self, job_id: str, error: str):
+        future = self._jobs.get(job_id)
+        if future is not None and not future.done():
+            future.set_exception(CrawlProcessError(error))
+
+    def _lost(self, worker: _CrawlProcess):
+        if self._closing or worker not in self._workers:
+            return
+        for job_id in list(worker.jobs):
+            self._fail(job_id, f"The crawl process {worker.process.pid} exited with code {worker.process.exitcode}")
+        worker.connection.close()
+        mark_process_dead(worker.process.pid)
+        self._workers.remove(worker)
+
+        # A process dying as it starts, like with a browser that can not
+        # launch, would otherwise be started again in a loop
+        quick = time.monotonic() - worker.started_at < self.restart_window_seconds
+        failures = worker.failures + 1 if quick else 0
+        log_dict = {"pid": worker.process.pid, "exitcode": worker.process.exitcode, "failures": failures}
+        if failures > self.max_restarts:
+            self.logger.error(f"Crawl process keeps dying, giving it up {log_dict}")
+            self._given_up += 1
+            self._available.set()
+            return
+        delay = min(self.restart_backoff_seconds * 2 ** (failures - 1), self.max_restart_backoff_seconds) if failures else 0
+        log_dict["delay_seconds"] = delay
+        self.logger.warn(f"Crawl process died, starting it again {log_dict}")
+        restart = self._loop.call_later(delay, lambda: self._restart(restart, failures))
+        self._restarts.add(restart)
+
+    def _restart(self, restart: asyncio.TimerHandle, failures: int):
+        self._restarts.discard(restart)
+        if self._closing:
+            return
+        self._workers.append(self._spawn(failures))
+        self._available.set()
@@ -0,0 +1,332 @@
+import asyncio
+import uuid
+from datetime import datetime, timedelta
+from logging import Logger
+from typing import Dict, Iterable, List, Optional, Set
+from prometheus_client import Counter
+from redis import asyncio as aioredis
+from redis.exceptions import WatchError
+from repositories.screenshot_repository import AsyncScreenshotRepository
+from services.run_cache import RunCache
+from services.screenshot_files import VARIANTS_FOLDER, ScreenshotFiles
+from services.storage import ScreenshotStorage
+
+RUNS_COLLECTED = Counter('retention_runs_deleted_total', 'Runs removed by the retention policy', ['reason'])
+FILES_COLLECTED = Counter('retention_files_deleted_total', 'Screenshot files removed by the retention policy')
+
+
+class LeaseLost(Exception):
+    """
+    Another process took the retention lease of the pass in progress.
+    """
+
+
+def page_captures(run: dict) -> List[dict]:
+    """
+    The capture of every page of the run, and of every viewport of the page.
+    """
+    return [capture for page in run.get("pages", []) for capture in page.get("viewports") or [page]]
+
+
+def run_files(run: dict) -> Set[str]:
+    """
+    Every file a run points at: its screenshots and their thumbnails.
+    """
+    keys = set(run.get("screenshots", []))
+    for capture in page_captures(run):
+        keys.add(capture["path"])
+        if capture.get("thumbnail"):
+            keys.add(capture["thumbnail"])
+    return keys
+
+
+class RetentionCollector:
+    """
+    Background task removing the runs that are not pinned once they are older
+    than `max_age_seconds`, and then the oldest ones while the files of all the
+    runs take more than `max_total_bytes`. Zero disables a limit.
+
+    A run is removed in batches: its files first, keeping those still used by
+    other runs or leased by the runs in progress, then its document and its
+    cached screenshot list. A collection stopped halfway finds the same runs
+    again on the next pass.
+
+    Every file is counted in the size of a single run, the first one measured
+    with it, along with its resized copies. When that run is removed and the
+    file is kept for another one, its bytes move to the newest run still using it.
+
+    The files no run points at, left by the runs that failed before storing
+    their document, are removed once older than `orphan_grace_seconds`.
+
+    With Redis, a pass holds a lease so the API processes never collect at
+    the same time. The lease is renewed after every batch, and a process
+    that lost it stops its pass.
+    """
+
+    LEASE_KEY = "retention:lease"
+
+    def __init__(self,
+                 repository: AsyncScreenshotRepository,
+                 storage: ScreenshotStorage,
+                 run_cache: RunCache,
+                 logger: Logger,
+                 max_age_seconds: int = 0,
+                 max_total_bytes: int = 0,
+                 interval_seconds: int = 3600,
+                 batch_size: int = 100,
+                 concurrency: int = 16,
+                 variant_widths: Iterable[int] = (),
+                 cache_client: Optional[aioredis.Redis] = None,
+                 lease_seconds: int = 3600,
+                 orphan_grace_seconds: int = 86400):
+        self._repository = repository
+        self._storage = storage
+        self._run_cache = run_cache
+        self.logger = logger
+        self.max_age_seconds = max_age_seconds
+        self.max_total_bytes = max_total_bytes
+        self.interval_seconds = interval_seconds
+        self.batch_size = batch_size
+        self.concurrency = concurrency
+        self.variant_widths = list(variant_widths)
+        self._cache_client = cache_client
+        self.lease_seconds = lease_seconds
+        self.orphan_grace_seconds = orphan_grace_seconds
+        self._token: Optional[str] = None
+        self._task: Optional[asyncio.Task] = None
+
+    @property
+    def enabled(self) -> bool:
+        return self.max_age_seconds > 0 or self.max_total_bytes > 0
+
+    def start(self):
+        if self._task is None and self.enabled:
+            self._task = asyncio.create_task(self._run())
+
+    async def close(self):
+        task, self._task = self._task, None
+        if task is not None:
+            task.cancel()
+            await asyncio.gather(task, return_exceptions=True)
+
+    async def _run(self):
+        while True:
+            try:
+                await self.collect()
+            except Exception as e:
+                # Tried again on the next pass
+                self.logger.warn(f"Could not collect the old runs 'exception': {e}")
+            await asyncio.sleep(self.interval_seconds)
+
+    async def collect(self) -> int:
+        """
+        Applies the retention policy once, and returns the number of runs
+        removed, none when another process is applying it.
+        """
+        if not await self._take_lease():
+            self.logger.info("Retention pass skipped, another process holds the lease")
+            return 0
+        try:
+            removed = 0
+            if self.max_age_seconds > 0:
+                removed += await self._collect_expired()
+            if self.max_total_bytes > 0:
+                removed += await self._collect_over_budget()
+            orphans = await self._collect_orphans() if self.orphan_grace_seconds > 0 else 0
+        except LeaseLost:
+            self.logger.warn("Retention pass stopped, its lease was taken by another process")
+            return 0
+        finally:
+            await self._release_lease()
+        if removed or orphans:
+            log_dict = {"runs": removed, "orphan_files": orphans}
+            self.logger.info(f"Old runs removed {log_dict}")
+        return removed
+
+    async def _take_lease(self) -> bool:
+        if self._cache_client is None:
+            return True
+        self._token = uuid.uuid4().hex
+        try:
+            return bool(await self._cache_client.set(self.LEASE_KEY, self._token, nx=True, ex=self.lease_seconds))
+        except Exception as e:
+            # Tried again on the next pass, rather than collecting with another process
+            self.logger.warn(f"Could not take the retention lease 'exception': {e}")
+            return False
+
+    async def _renew_lease(self):
+        """
+        Extends the lease, or raises LeaseLost when it expired and another
+        process took it.
+        """
+        if self._cache_client is None:
+            return
+        try:
+            async with self._cache_client.pipeline(transaction=True) as pipe:
+                await pipe.watch(self.LEASE_KEY)
+                owner = await pipe.get(self.LEASE_KEY)
+                if owner not in (None, self._token):
+                    raise LeaseLost()
+                pipe.multi()
+                pipe.set(self.LEASE_KEY, self._token, ex=self.lease_seconds)
+                await pipe.execute()
+        except WatchError:
+            raise LeaseLost()
+
+    async def _release_lease(self):
+        if self._cache_client is None:
+            return
+        try:
+            async with self._cache_client.pipeline(transaction=True) as pipe:
+                await pipe.watch(self.LEASE_KEY)
+                if await pipe.get(self.LEASE_KEY) != self._token:
+                    return
+                pipe.multi()
+                pipe.delete(self.LEASE_KEY)
+                await pipe.execute()
+        except WatchError:
+            # Taken by another process meanwhile
+            pass
+        except Exception as e:
+            self.logger.warn(f"Could not release the retention lease 'exception': {e}")
+
+    async def _collect_expired(self) -> int:
+        cutoff = datetime.now() - timedelta(seconds=self.max_age_seconds)
+        removed = 0
+        while True:
+            runs = await self._repository.list_unpinned_runs(before=cutoff, limit=self.batch_size)
+            if not runs:
+                return removed
+            await self._remove(runs)
+            RUNS_COLLECTED.labels("age").inc(len(runs))
+            removed += len(runs)
+            await self._renew_lease()
+
+    async def _collect_over_budget(self) -> int:
+        await self._measure_runs()
+        excess = await self._repository.total_size() - self.max_total_bytes
+        removed = 0
+        while excess > 0:
+            runs = await self._repository.list_unpinned_runs(limit=self.batch_size)
+            if not runs:
+                # Only pinned runs left
+                log_dict = {"excess_bytes": excess}
+                self.logger.warn(f"Pinned runs take more than the storage budget {log_dict}")
+                return removed
+            batch = []
+            expected = excess
+            for run in runs:
+                if expected <= 0:
+                    break
+                batch.append(run)
+                expected -= run.get("size_bytes", 0)
+            # The files still used by other runs free nothing
+            excess -= await self._remove(batch)
+            RUNS_COLLECTED.labels("size").inc(len(batch))
+            removed += len(batch)
+            await self._renew_lease()
+        return removed
+
+    async def _measure_runs(self):
+        """
+        Stores the size of the runs that do not have one yet, those stored
+        since the last pass or before the policy was enabled, counting only
+        the files no measured run counts already.
+        """
+        while True:
+            runs = await self._repository.list_runs_without_size(self.batch_size)
+            if not runs:
+                return
+            for run in runs:
+                keys = run_files(run)
+                keys -= set(await self._repository.referencing_runs(keys, [run["_id"]], measured_only=True))
+                await self._repository.set_run_size(run["_id"], await self._size(keys), keys)
+            await self._renew_lease()
+
+    async def _collect_orphans(self) -> int:
+        """
+        Removes the files older than the grace period that no run points at,
+        and returns their number. The resized copies go with their image.
+        """
+        cutoff = datetime.now() - timedelta(seconds=self.orphan_grace_seconds)
+        removed = 0
+        batch = []
+        async for key in self._storage.keys(modified_before=cutoff):
+            if key.startswith(f"{VARIANTS_FOLDER}/"):
+                continue
+            batch.append(key)
+            if len(batch) >= self.batch_size:
+                removed += await self._remove_orphans(batch)
+                batch = []
+                await self._renew_lease()
+        if batch:
+            removed += await self._remove_orphans(batch)
+        return removed
+
+    async def _remove_orphans(self, keys: List[str]) -> int:
+        names = {key: {key, *self._storage.aliases(key)} for key in keys}
+        referenced = await self._repository.referenced_keys(set().union(*names.values()), [])
+        orphans = [key for key in keys if not names[key] & referenced]
+        await self._bounded(self._storage.delete, self._with_variants(orphans))
+        FILES_COLLECTED.inc(len(orphans))
+        await self._repository.delete_last_captures(set().union(*(names[key] for key in orphans)))
+        return len(orphans)
+
+    async def _remove(self, runs: List[dict]) -> int:
+        """
+        Removes the runs, and returns the bytes of the files deleted with
+        them when the size budget is enabled.
+        """
+        run_ids = [run["_id"] for run in runs]
+        keys = set().union(*(run_files(run) for run in runs))
+        kept = await self._repository.referenced_keys(keys, run_ids)
+        keys -= kept
+        freed = await self._size(keys) if self.max_total_bytes > 0 else 0
+        await self._bounded(self._storage.delete, self._with_variants(keys))
+        FILES_COLLECTED.inc(len(keys))
+        # The next captures of their pages are compared with nothing
+        await self._repository.delete_last_captures(keys)
+        # The documents go last, so the files of a run are never left without one
+        await self._repository.delete_runs(run_ids)
+        if self.max_total_bytes > 0:
+            await self._move_sizes(runs, kept)
+        try:
+            await self._run_cache.delete(run_ids)
+        except Exception as e:
+            self.logger.warn(f"Could not remove the cached runs 'exception': {e}")
+        return freed
+
+    async def _move_sizes(self, runs: List[dict], kept: Set[str]):
+        """
+        Counts the kept files that were counted in the removed runs in the
+        newest measured run using them. Those only used by runs not measured
+        yet are counted when they are.
+        """
+        counted = kept & set().union(*(run.get("sized_files") or [] for run in runs))
+        if not counted:
+            return
+        run_ids = [run["_id"] for run in runs]
+        owners: Dict[str, Set[str]] = {}
+        for key, run_id in (await self._repository.referencing_runs(counted, run_ids, measured_only=True)).items():
+            owners.setdefault(run_id, set()).add(key)
+        for run_id, keys in owners.items():
+            await self._repository.add_run_size(run_id, await self._size(keys), keys)
+
+    async def _size(self, keys: Iterable[str]) -> int:
+        # The files and their resized copies
+        sizes = await self._bounded(self._storage.size, self._with_variants(keys))
+        return sum(size or 0 for size in sizes)
+
+    def _with_variants(self, keys: Iterable[str]) -> List[str]:
+        keys = list(keys)
+        return [*keys, *(ScreenshotFiles.variant_key(key, width) for key in keys for width in self.variant_widths)]
+
+    async def _bounded(self, function, keys: Iterable[str]) -> list:
+        # Bounds the file operations in flight on the storage
+        semaphore = asyncio.Semaphore(self.concurrency)
+
+        async def call(key: str):
+            async with semaphore:
+                return await function(key)
+
+        return await asyncio.gather(*(call(key) for key in keys))
@@ -0,0 +1,82 @@
+from logging import Logger
+from typing import List, Optional, Tuple
+from prometheus_client import Counter, Gauge
+from utils.metrics import Stage, time_stage
+
+CACHE_HITS = Counter('run_cache_hits_total', 'Number of runs served from the cache')
+CACHE_MISSES = Counter('run_cache_misses_total', 'Number of runs not found in the cache')
+CACHE_EVICTED_KEYS = Gauge('run_cache_evicted_keys', 'Keys evicted by Redis to stay under maxmemory, as reported by the server', multiprocess_mode='mostrecent')
+CACHE_EXPIRED_KEYS = Gauge('run_cache_expired_keys', 'Keys removed by Redis after their TTL, as reported by the server', multiprocess_mode='mostrecent')
+CACHE_USED_MEMORY = Gauge('run_cache_used_memory_bytes', 'Memory used by the Redis cache, as reported by the server', multiprocess_mode='mostrecent')
+
+
+class RunCache:
+    """
+    Keeps the screenshot list of the recent runs in Redis lists that expire
+    after `ttl_seconds`.
+    """
+
+    def __init__(self, cache_client, logger: Logger, ttl_seconds: int = 3600):
+        self._cache_client = cache_client
+        self.logger = logger
+        self.ttl_seconds = ttl_seconds
+
+    async def store(self, run_id: str, screenshots: List[str]):
+        if not screenshots:
+            return
+        # The expiry is set in the same transaction than the write, so the
+        # list can never be left without TTL
+        with time_stage(Stage.REDIS_PUSH):
+            async with self._cache_client.pipeline(transaction=True) as pipe:
+                pipe.delete(run_id)
+                pipe.rpush(run_id, *screenshots)
+                pipe.expire(run_id, self.ttl_seconds)
+                await pipe.execute()
+
+    async def delete(self, run_ids: List[str]):
+        if run_ids:
+            await self._cache_client.delete(*run_ids)
+
+    async def get_range(self, run_id: str, offset: int = 0, limit: Optional[int] = None) -> Tuple[List[str], int]:
+        """
+        Returns `limit` screenshots of the run from `offset`, and the number
+        of screenshots of the run, 0 when it is not cached.
+        """
+        end = offset + limit - 1 if limit is not None else -1
+        async with self._cache_client.pipeline(transaction=False) as pipe:
+            pipe.lrange(run_id, offset, end)
+            pipe.llen(run_id)
+            screenshots, total = await pipe.execute()
+        if total:
+            CACHE_HITS.inc()
+        else:
+            CACHE_MISSES.inc()
+        return screenshots, total
+
+    async def configure_memory_budget(self, max_memory: Optional[str], policy: str = "volatile-lru"):
+        """
+        Caps the memory of the Redis server, evicting the keys that have a TTL
+        first. Managed servers may refuse CONFIG SET, in that case the limit
+        has to be set on the server itself.
+        """
+        if not max_memory:
+            return
+        try:
+            await self._cache_client.config_set("maxmemory", max_memory)
+            await self._cache_client.config_set("maxmemory-policy", policy)
+        except Exception as e:
+            self.logger.warn(f"Could not set the cache memory budget 'max_memory': {max_memory} 'exception': {e}")
+
+    async def refresh_stats(self):
+        """
+        Copies the eviction and memory figures of the server into the metrics.
+        """
+        try:
+            stats = await self._cache_client.info("stats")
+            memory = await self._cache_client.info("memory")
+        except Exception as e:
+            self.logger.warn(f"Could not read the cache stats 'exception': {e}")
+            return
+        CACHE_EVICTED_KEYS.set(stats.get("evicted_keys", 0))
+        CACHE_EXPIRED_KEYS.set(stats.get("expired_keys", 0))
+        CACHE_USED_MEMORY.set(memory.get("used_memory", 0))
@@ -0,0 +1,161 @@
+import json
+from enum import Enum
+from typing import AsyncIterator, Optional, Tuple
+from prometheus_client import Gauge
+
+EVENT_STREAMS = Gauge('run_event_streams', 'Event streams of runs open to clients', multiprocess_mode='livesum')
+
+class RunEventType(str, Enum):
+    STATUS = "status"
+    LINKS = "links"
+    PAGE = "page"
+    DONE = "done"
+    FAILED = "failed"
+
+TERMINAL_EVENTS = (RunEventType.DONE, RunEventType.FAILED)
+
+
+class RunEvents:
+    """
+    Progress events of a run, appended to a Redis stream per run. Streams can
+    be read from the start at any time, so a client connecting late, or again
+    after a disconnection, still receives every event.
+
+    A run attached to the crawl of another one, when identical crawls are
+    coalesced, follows it: its clients get the progress of the shared crawl
+    and then the outcome of their own run.
+
+    Every listener holds a connection in a blocking read, taken from
+    `stream_client` when given so they never starve the other Redis users,
+    and at most `max_streams` of them are streamed to clients at once.
+    """
+
+    KEY_PREFIX = "events:"
+    FOLLOWS_PREFIX = "events:follows:"
+    # A run follows a run of its process, which may follow one of another process
+    MAX_FOLLOWS = 3
+
+    def __init__(self,
+                 cache_client,
+                 ttl_seconds: int = 86400,
+                 block_ms: int = 5000,
+                 stream_client=None,
+                 max_streams: int = 0):
+        self._cache_client = cache_client
+        self._stream_client = stream_client or cache_client
+        self.ttl_seconds = ttl_seconds
+        self.block_ms = block_ms
+        self.max_streams = max_streams
+        self.open_streams = 0
+
+    def _key(self, run_id: str) -> str:
+        return f"{self.KEY_PREFIX}{run_id}"
+
+    async def publish(self, run_id: str, event_type: RunEventType, data: dict):
+        async with self._cache_client.pipeline(transaction=True) as pipe:
+            pipe.xadd(self._key(run_id), {"type": event_type.value, "data": json.dumps(data)})
+            pipe.expire(self._key(run_id), self.ttl_seconds)
+            await pipe.execute()
+
+    async def follow(self, run_id: str, leader_run_id: Optional[str]):
+        """
+        Records that the pages of `run_id` are those crawled by
+        `leader_run_id`, or that they are its own again with None.
+        """
+        if leader_run_id is None:
+            await self._cache_client.delete(f"{self.FOLLOWS_PREFIX}{run_id}")
+        else:
+            await self._cache_client.set(f"{self.FOLLOWS_PREFIX}{run_id}", leader_run_id, ex=self.ttl_seconds)
+
+    async def leader_of(self, run_id: str) -> Optional[str]:
+        """
+        The run crawling the pages of `run_id`, None when it crawls them itself.
+        """
+        leader = None
+        for _ in range(self.MAX_FOLLOWS):
+            followed = await self._cache_client.get(f"{self.FOLLOWS_PREFIX}{run_id}")
+            if followed is None:
+                break
+            leader = run_id = followed
+        return leader
+
+    async def exists(self, run_id: str) -> bool:
+        return bool(await self._cache_client.exists(self._key(run_id)))
+
+    async def listen(self, run_id: str, last_id: str = "0") -> AsyncIterator[Optional[Tuple[str, str, dict]]]:
+        """
+        Yields `(event_id, event_type, data)` after `last_id` until the run is
+        done or failed, and None every `block_ms` without events so the caller
+        can keep its connection alive. Ends when the stream expired.
+        """
+        key = self._key(run_id)
+        while True:
+            response = await self._stream_client.xread({key: last_id}, block=self.block_ms, count=100)
+            if not response:
+                if not await self.exists(run_id):
+                    return
+                yield None
+                continue
+            for _, entries in response:
+                for event_id, fields in entries:
+                    last_id = event_id
+                    event_type = fields["type"]
+                    yield event_id, event_type, json.loads(fields["data"])
+                    if event_type in TERMINAL_EVENTS:
+                        return
+
+    def acquire(self) -> Optional["StreamSlot"]:
+        """
+        Reserves the place of one more client streaming the events, or
+        returns None when `max_streams` are open already, zero allowing any
+        number. Taken before the first await, so a burst of clients never
+        passes the limit.
+        """
+        if 0 < self.max_streams <= self.open_streams:
+            return None
+        self.open_streams += 1
+        EVENT_STREAMS.inc()
+        return StreamSlot(self)
+
+    def _release(self):
+        self.open_streams -= 1
+        EVENT_STREAMS.dec()
+
+    async def stream(self, run_id: str, slot: "StreamSlot", last_id: str = "0") -> AsyncIterator[Optional[Tuple[str, str, dict]]]:
+        """
+        `listen` for a client, releasing its `slot` once done. A run
+        following another one streams the events of the shared crawl but
+        its outcome, and then the outcome of the run itself.
+        """
+        try:
+            leader_run_id = await self.leader_of(run_id)
+            if leader_run_id is None:
+                async for event in self.listen(run_id, last_id):
+                    yield event
+                return
+            async for event in self.listen(leader_run_id, last_id):
+                if event is not None and event[1] in TERMINAL_EVENTS:
+                    break
+                yield event
+            async for event in self.listen(run_id):
+                if event is None or event[1] in TERMINAL_EVENTS:
+                    yield event
+        finally:
+            slot.release()
+
+
+class StreamSlot:
+    """
+    The place of a client in the open streams. Releasing it more than once
+    counts once, for a response released both when its stream ends and when
+    it is sent, or never started.
+    """
+
+    def __init__(self, run_events: RunEvents):
+        self._run_events = run_events
+        self._held = True
+
+    def release(self):
+        if self._held:
+            self._held = False
+            self._run_events._release()
@@ -0,0 +1,187 @@
+import asyncio
+import hashlib
+import random
+import uuid
+from datetime import datetime, timedelta
+from logging import Logger
+from typing import List, Optional, Tuple
+from prometheus_client import Counter
+from dtos.screenshot import ScreenshotRequest
+from repositories.schedule_repository import AsyncScheduleRepository
+from services.coalescing import CrawlCoalescer
+from services.crawler import Crawler
+from services.jobs import JobRunner, JobStatus, JobTracker
+from services.run_cache import RunCache
+from utils.cron import CronExpression
+
+SCHEDULED_RUNS = Counter('scheduled_runs_total', 'Occurrences of the crawl schedules', ['outcome'])
+# Slots of the interval schedules are counted from here
+EPOCH = datetime(2000, 1, 1)
+
+
+def _spread(schedule_id: str, seconds: float) -> float:
+    # Stable offset of the schedule, so schedules created together do not fire together
+    return int(hashlib.sha1(schedule_id.encode()).hexdigest(), 16) % max(1, int(seconds))
+
+
+def next_run_at(schedule_id: str,
+                after: datetime,
+                interval_seconds: Optional[int] = None,
+                cron: Optional[str] = None,
+                jitter_seconds: float = 0,
+                cron_spread_seconds: float = 0) -> datetime:
+    """
+    Next time the schedule fires after `after`. The runs of an interval
+    schedule fall on slots `interval_seconds` apart, shifted by an offset taken
+    from the schedule id, which spreads the schedules of the same interval over
+    it. Cron schedules fire on their minute shifted the same way, by up to
+    `cron_spread_seconds` and at most a tenth of the time to their next
+    minute. Both get up to `jitter_seconds` of random delay, at most a tenth
+    of the interval.
+    """
+    if interval_seconds:
+        offset = _spread(schedule_id, interval_seconds)
+        elapsed = (after - EPOCH).total_seconds() - offset
+        slot = EPOCH + timedelta(seconds=offset + (elapsed // interval_seconds + 1) * interval_seconds)
+        jitter = min(jitter_seconds, interval_seconds / 10)
+    else:
+        expression = CronExpression(cron)
+
+        def shifted(minute: datetime) -> Tuple[datetime, float]:
+            period = (expression.next_after(minute) - minute).total_seconds()
+            spread = min(cron_spread_seconds, period / 10)
+            return minute + timedelta(seconds=_spread(schedule_id, spread) if spread >= 1 else 0), period
+
+        # A minute before `after` may still fire after it once shifted
+        minute = expression.next_after(after - timedelta(seconds=cron_spread_seconds))
+        slot, period = shifted(minute)
+        while slot <= after:
+            minute = expression.next_after(minute)
+            slot, period = shifted(minute)
+        jitter = min(jitter_seconds, period / 10)
+    return slot + timedelta(seconds=random.uniform(0, jitter))
+
+
+class CrawlScheduler:
+    """
+    Starts the runs of the crawl schedules stored in MongoDB. Every few
+    seconds it claims the schedules that are due, one at a time, so many API
+    processes can share them, and queues their crawls on the job runner.
+
+    An occurrence is skipped while the previous run of the schedule is still
+    queued or running. The next runs are stored with the schedules, so after a
+    restart the scheduler goes on where it stopped: a schedule missed while
+    the service was down runs once, and a run lost with the process stops
+    blocking its schedule after `max_run_seconds`.
+    """
+
+    def __init__(self,
+                 repository: AsyncScheduleRepository,
+                 job_runner: JobRunner,
+                 job_tracker: JobTracker,
+                 crawler: Crawler,
+                 run_cache: RunCache,
+                 logger: Logger,
+                 poll_seconds: float = 5,
+                 jitter_seconds: float = 60,
+                 lease_seconds: float = 60,
+                 max_run_seconds: float = 3600,
+                 coalescer: Optional[CrawlCoalescer] = None,
+                 cron_spread_seconds: float = 300):
+        self._repository = repository
+        self._job_runner = job_runner
+        self._job_tracker = job_tracker
+        self._crawler = crawler
+        self._run_cache = run_cache
+        self.logger = logger
+        self.poll_seconds = poll_seconds
+        self.jitter_seconds = jitter_seconds
+        self.lease_seconds = lease_seconds
+        self.max_run_seconds = max_run_seconds
+        self._coalescer = coalescer
+        self.cron_spread_seconds = cron_spread_seconds
+        self._task: Optional[asyncio.Task] = None
+
+    def next_run_at(self, schedule: dict, after: datetime) -> datetime:
+        return next_run_at(
+            schedule["_id"],
+            after,
+            schedule.get("interval_seconds"),
+            schedule.get("cron"),
+            self.jitter_seconds,
+            self.cron_spread_seconds
+        )
+
+    def start(self):
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+
+    async def close(self):
+        task, self._task = self._task, None
+        if task is not None:
+            task.cancel()
+            await asyncio.gather(task, return_exceptions=True)
+
+    async def _run(self):
+        while True:
+            try:
+                await self.run_due_schedules()
+            except Exception as e:
+                # The claimed schedules are due again after their lease
+                self.logger.warn(f"Could not run the due schedules 'exception': {e}")
+            await asyncio.sleep(self.poll_seconds)
+
+    async def run_due_schedules(self) -> int:
+        """
+        Starts the runs of every due schedule, and returns how many were started.
+        """
+        started = 0
+        while True:
+            now = datetime.now()
+            schedule = await self._repository.claim_due_schedule(now, now + timedelta(seconds=self.lease_seconds))
+            if schedule is None:
+                return started
+            if await self._start_run(schedule, now):
+                started += 1
+
+    async def _start_run(self, schedule: dict, now: datetime) -> bool:
+        log_dict = {"schedule_id": schedule["_id"], "last_run_id": schedule.get("last_run_id")}
+        next_run = self.next_run_at(schedule, now)
+        if await self._still_running(schedule, now):
+            await self._repository.record_skipped_run(schedule["_id"], next_run)
+            SCHEDULED_RUNS.labels("skipped").inc()
+            self.logger.info(f"Scheduled run skipped, the previous one is still running {log_dict}")
+            return False
+
+        run_id = str(uuid.uuid4())
+        request = ScreenshotRequest(**schedule["request"])
+        # Recorded first, so the run is known to the next occurrence even if
+        # this process stops right after queueing it
+        await self._repository.record_run(schedule["_id"], run_id, now, next_run)
+        await self._job_runner.submit(run_id, lambda: self._crawl(request, run_id))
+        SCHEDULED_RUNS.labels("started").inc()
+        log_dict["run_id"] = run_id
+        self.logger.info(f"Scheduled run started {log_dict}")
+        return True
+
+    async def _still_running(self, schedule: dict, now: datetime) -> bool:
+        last_run_at = schedule.get("last_run_at")
+        if not schedule.get("last_run_id") or last_run_at is None:
+            return False
+        if (now - last_run_at).total_seconds() > self.max_run_seconds:
+            return False
+        try:
+            job = await self._job_tracker.get(schedule["last_run_id"])
+        except Exception as e:
+            self.logger.warn(f"Could not read the state of the last scheduled run 'run_id': {schedule['last_run_id']} 'exception': {e}")
+            return False
+        return job is not None and job["status"] in (JobStatus.QUEUED.value, JobStatus.RUNNING.value)
+
+    async def _crawl(self, request: ScreenshotRequest, run_id: str) -> List[str]:
+        if self._coalescer is not None:
+            # Shared with the identical crawls asked through the API meanwhile
+            screenshots = await self._coalescer.crawl(self._crawler, request, run_id)
+        else:
+            screenshots = await self._crawler.crawl_website(**request.crawl_arguments(run_id))
+        await self._run_cache.store(run_id, screenshots)
+        return screenshots
@@ -0,0 +1,46 @@
+import hashlib
+import json
+from typing import Optional
+from services.storage import ScreenshotStorage
+from utils.urls import normalize_url
+
+class ScreenshotCache:
+    """
+    Remembers the image captured for an URL with some capture settings, so
+    the runs sharing pages reuse it during `freshness_seconds` instead of
+    rendering the page again.
+    """
+
+    KEY_PREFIX = "shot:"
+
+    def __init__(self, cache_client, storage: ScreenshotStorage, freshness_seconds: int = 900):
+        self._cache_client = cache_client
+        self._storage = storage
+        self.freshness_seconds = freshness_seconds
+
+    @property
+    def enabled(self) -> bool:
+        return self.freshness_seconds > 0
+
+    def key(self, url: str, settings: dict) -> str:
+        fingerprint = json.dumps(
+            {"url": normalize_url(url), "settings": settings}, sort_keys=True
+        )
+        return f"{self.KEY_PREFIX}{hashlib.sha256(fingerprint.encode()).hexdigest()}"
+
+    async def get(self, url: str, settings: dict) -> Optional[str]:
+        if not self.enabled:
+            return None
+        key = await self._cache_client.get(self.key(url, settings))
+        # The file may have been removed since it was cached
+        if key and await self._storage.exists(key):
+            return key
+        return None
+
+    async def put(self, url: str, settings: dict, key: str):
+        """
+        Remembers the storage key of the screenshot of `url`.
+        """
+        if not self.enabled:
+            return
+        await self._cache_client.set(self.key(url, settings), key, ex=self.freshness_seconds)
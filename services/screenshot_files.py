@@ -0,0 +1,68 @@
+import asyncio
+from pathlib import PurePosixPath
+from typing import Dict, Iterable, Optional
+from repositories.screenshot_repository import AsyncScreenshotRepository
+from services.image_processor import ImageProcessor
+from services.storage import ScreenshotStorage
+
+VARIANTS_FOLDER = ".variants"
+IMAGE_FORMATS = {".png": "png", ".jpg": "jpeg", ".jpeg": "jpeg", ".webp": "webp"}
+
+
+class ScreenshotFiles:
+    """
+    Serves the screenshot files of the storage, and the resized copies of
+    them. A copy is made the first time its width is asked for and stored
+    in the variants folder for the next requests, and counted in the size of
+    the run the image is counted in.
+    """
+
+    def __init__(self,
+                 storage: ScreenshotStorage,
+                 image_processor: ImageProcessor,
+                 variant_widths: Iterable[int] = (),
+                 quality: int = 80,
+                 repository: Optional[AsyncScreenshotRepository] = None):
+        self.storage = storage
+        self.repository = repository
+        self.image_processor = image_processor
+        # Only a few widths, or anyone could fill the disk with copies
+        self.variant_widths = frozenset(variant_widths)
+        self.quality = quality
+        self._locks: Dict[str, asyncio.Lock] = {}
+
+    @staticmethod
+    def variant_key(key: str, width: int) -> str:
+        path = PurePosixPath(key)
+        return str(PurePosixPath(VARIANTS_FOLDER) / path.parent / f"{path.stem}_w{width}{path.suffix}")
+
+    async def variant(self, key: str, width: int) -> str:
+        """
+        Returns the key of the copy of the image `key` resized to `width`,
+        making it if it does not exist yet. Raises ValueError for widths that
+        are not offered or files that are not images, and FileNotFoundError
+        when there is no such image.
+        """
+        if width not in self.variant_widths:
+            raise ValueError(f"Width {width} is not one of {sorted(self.variant_widths)}")
+        image_format = IMAGE_FORMATS.get(PurePosixPath(key).suffix.lower())
+        if image_format is None:
+            raise ValueError(f"{key} is not an image")
+
+        destination = self.variant_key(key, width)
+        if await self.storage.exists(destination):
+            return destination
+        # The concurrent requests of a new variant wait for the one making it
+        lock = self._locks.setdefault(destination, asyncio.Lock())
+        try:
+            async with lock:
+                if not await self.storage.exists(destination):
+                    data = await self.storage.read(key)
+                    resized = await self.image_processor.thumbnail(data, width, image_format, self.quality)
+                    await self.storage.write(destination, resized)
+                    if self.repository is not None:
+                        await self.repository.add_file_size(key, len(resized))
+        finally:
+            if not lock.locked():
+                self._locks.pop(destination, None)
+        return destination
@@ -0,0 +1,340 @@
+import asyncio
+import hashlib
+import mimetypes
+import os
+import uuid
+import xml.etree.ElementTree as ElementTree
+from abc import ABC, abstractmethod
+from datetime import datetime, timezone
+from pathlib import Path
+from typing import AsyncIterable, AsyncIterator, List, Optional, Union
+from urllib.parse import quote, urlencode, urlsplit
+
+import httpx
+
+from utils.aws_signing import SigV4Signer, UNSIGNED_PAYLOAD, amz_date, payload_hash
+
+Content = Union[bytes, AsyncIterable[bytes]]
+S3_NAMESPACE = "{http://s3.amazonaws.com/doc/2006-03-01/}"
+
+
+async def _chunks(data: Content) -> AsyncIterable[bytes]:
+    if isinstance(data, (bytes, bytearray)):
+        yield bytes(data)
+        return
+    async for chunk in data:
+        yield chunk
+
+
+class ScreenshotStorage(ABC):
+    """
+    Where the screenshot files live. The files are known by their key, a
+    relative path spread over `shard_depth` levels of folders named after the
+    hash of the file name, so no folder ever holds more than a few thousand
+    files.
+    """
+
+    def __init__(self, shard_depth: int = 2):
+        self.shard_depth = shard_depth
+
+    def key_for(self, name: str) -> str:
+        digest = hashlib.sha1(name.encode()).hexdigest()
+        shards = [digest[2 * level:2 * level + 2] for level in range(self.shard_depth)]
+        return "/".join([*shards, name])
+
+    @abstractmethod
+    async def write(self, key: str, data: Content) -> str:
+        """
+        Stores `data`, bytes or an async iterable of chunks, under `key`, and
+        returns the key. Readers never see a partially written file.
+        """
+
+    @abstractmethod
+    async def read(self, key: str) -> bytes:
+        """
+        Returns the content of the file. Raises FileNotFoundError if there is none.
+        """
+
+    @abstractmethod
+    async def exists(self, key: str) -> bool:
+        pass
+
+    @abstractmethod
+    async def delete(self, key: str):
+        """
+        Removes the file, if it exists.
+        """
+
+    @abstractmethod
+    async def size(self, key: str) -> Optional[int]:
+        """
+        Bytes of the file, None if there is no such file.
+        """
+
+    @abstractmethod
+    def keys(self, modified_before: datetime) -> AsyncIterator[str]:
+        """
+        Iterates over the keys of the files last written before `modified_before`.
+        """
+
+    def aliases(self, key: str) -> List[str]:
+        """
+        The other keys the documents may know the file `key` by.
+        """
+        return []
+
+    def local_path(self, key: str) -> Optional[Path]:
+        """
+        Path of the file on this machine, to send it without reading it, or
+        None when it is not on a local disk.
+        """
+        return None
+
+    async def url(self, key: str) -> Optional[str]:
+        """
+        URL the clients can download the file from, for the storages without
+        a local path.
+        """
+        return None
+
+
+class LocalStorage(ScreenshotStorage):
+    def __init__(self, base_dir: Path, shard_depth: int = 2):
+        super().__init__(shard_depth)
+        # The runs stored before the keys point at their files by the folder
+        # as configured, like "screenshots_folder/<run_id>_screenshot_0.png"
+        self._legacy_prefix = f"{Path(base_dir).as_posix().rstrip('/')}/"
+        self.base_dir = Path(base_dir).resolve()
+
+    def local_path(self, key: str) -> Optional[Path]:
+        if key.startswith(self._legacy_prefix):
+            key = key[len(self._legacy_prefix):]
+        path = (self.base_dir / key).resolve()
+        # Keys pointing out of the folder, like "../..", have no file
+        if not path.is_relative_to(self.base_dir):
+            return None
+        return path
+
+    def _path(self, key: str) -> Path:
+        path = self.local_path(key)
+        if path is None:
+            raise ValueError(f"Key {key} is out of the storage folder")
+        return path
+
+    async def write(self, key: str, data: Content) -> str:
+        path = self._path(key)
+        await asyncio.to_thread(path.parent.mkdir, parents=True, exist_ok=True)
+        # Written aside and renamed, the rename is atomic on the same disk
+        partial = path.with_name(f".{uuid.uuid4().hex}{path.suffix}")
+        try:
+            file = await asyncio.to_thread(open, partial, "wb")
+            try:
+                async for chunk in _chunks(data):
+                    await asyncio.to_thread(file.write, chunk)
+            finally:
+                await asyncio.to_thread(file.close)
+            await asyncio.to_thread(os.replace, partial, path)
+        finally:
+            await asyncio.to_thread(partial.unlink, missing_ok=True)
+        return key
+
+    async def read(self, key: str) -> bytes:
+        path = self.local_path(key)
+        if path is None:
+            raise FileNotFoundError(key)
+        return await asyncio.to_thread(path.read_bytes)
+
+    async def exists(self, key: str) -> bool:
+        path = self.local_path(key)
+        return path is not None and await asyncio.to_thread(path.is_file)
+
+    async def delete(self, key: str):
+        path = self.local_path(key)
+        if path is not None:
+            await asyncio.to_thread(path.unlink, missing_ok=True)
+
+    async def size(self, key: str) -> Optional[int]:
+        path = self.local_path(key)
+        try:
+            return (await asyncio.to_thread(path.stat)).st_size if path is not None else None
+        except FileNotFoundError:
+            return None
+
+    async def keys(self, modified_before: datetime) -> AsyncIterator[str]:
+        # One folder at a time, the folders hold a few thousand files at most
+        folders = os.walk(self.base_dir)
+        while (folder := await asyncio.to_thread(next, folders, None)) is not None:
+            for key in await asyncio.to_thread(self._listed, Path(folder[0]), folder[2], modified_before.timestamp()):
+                yield key
+
+    def _listed(self, folder: Path, names: List[str], modified_before: float) -> List[str]:
+        keys = []
+        for name in names:
+            try:
+                if (folder / name).stat().st_mtime < modified_before:
+                    keys.append((folder / name).relative_to(self.base_dir).as_posix())
+            except FileNotFoundError:
+                # Removed meanwhile
+                pass
+        return keys
+
+    def aliases(self, key: str) -> List[str]:
+        return [f"{self._legacy_prefix}{key}"]
+
+
+class S3Storage(ScreenshotStorage):
+    """
+    Files kept in a bucket of an S3 compatible object store, addressed path
+    style (`<endpoint>/<bucket>/<key>`) as MinIO expects. The requests are
+    signed with Signature Version 4 on the shared HTTP client.
+
+    A file is sent with a single PUT, or in a multipart upload of
+    `part_size_bytes` parts when bigger, so at most one part is in memory.
+    """
+
+    def __init__(self,
+                 http_client: httpx.AsyncClient,
+                 endpoint_url: str,
+                 bucket: str,
+                 access_key: str,
+                 secret_key: str,
+                 region: str = "us-east-1",
+                 prefix: str = "",
+                 shard_depth: int = 2,
+                 url_expires_seconds: int = 3600,
+                 part_size_bytes: int = 8 * 1024 * 1024):
+        super().__init__(shard_depth)
+        self._http_client = http_client
+        self.endpoint_url = endpoint_url.rstrip("/")
+        self.bucket = bucket
+        self.prefix = prefix.strip("/")
+        self.url_expires_seconds = url_expires_seconds
+        # S3 refuses parts under 5 MiB, but the last one
+        self.part_size_bytes = max(part_size_bytes, 5 * 1024 * 1024)
+        self._host = urlsplit(self.endpoint_url).netloc
+        self._signer = SigV4Signer(access_key, secret_key, region)
+
+    def _object_path(self, key: str) -> str:
+        name = f"{self.prefix}/{key}" if self.prefix else key
+        return f"/{self.bucket}/{name}"
+
+    async def _request(self, method: str, key: str, content: bytes = b"", headers: Optional[dict] = None) -> httpx.Response:
+        return await self._send(method, self._object_path(key), content, headers)
+
+    async def _send(self, method: str, path: str, content: bytes = b"", headers: Optional[dict] = None, query: Optional[dict] = None) -> httpx.Response:
+        date = amz_date(datetime.now(timezone.utc))
+        hashed_payload = payload_hash(content) if content else UNSIGNED_PAYLOAD
+        headers = dict(headers or {}, host=self._host)
+        headers.update({"x-amz-content-sha256": hashed_payload, "x-amz-date": date})
+        headers["authorization"] = self._signer.authorization(method, path, headers, hashed_payload, date, query)
+        url = f"{self.endpoint_url}{quote(path)}"
+        if query:
+            url = f"{url}?{urlencode(query, safe='-_.~', quote_via=quote)}"
+        return await self._http_client.request(method, url, content=content or None, headers=headers)
+
+    async def write(self, key: str, data: Content) -> str:
+        content_type = mimetypes.guess_type(key)[0] or "application/octet-stream"
+        chunks = _chunks(data)
+        buffer = bytearray()
+        async for chunk in chunks:
+            buffer += chunk
+            if len(buffer) > self.part_size_bytes:
+                await self._write_parts(key, content_type, buffer, chunks)
+                return key
+        response = await self._request("PUT", key, bytes(buffer), {"content-type": content_type})
+        response.raise_for_status()
+        return key
+
+    async def _write_parts(self, key: str, content_type: str, buffer: bytearray, chunks: AsyncIterator[bytes]):
+        """
+        Sends the file in a multipart upload, from the bytes read so far in
+        `buffer` and the chunks left. The upload is aborted when it fails, so
+        no parts are left billed in the bucket.
+        """
+        path = self._object_path(key)
+        response = await self._send("POST", path, headers={"content-type": content_type}, query={"uploads": ""})
+        response.raise_for_status()
+        upload_id = ElementTree.fromstring(response.content).findtext(f"{S3_NAMESPACE}UploadId")
+        etags = []
+
+        async def send_part(part: bytes):
+            query = {"partNumber": str(len(etags) + 1), "uploadId": upload_id}
+            part_response = await self._send("PUT", path, part, query=query)
+            part_response.raise_for_status()
+            etags.append(part_response.headers["etag"])
+
+        try:
+            async for chunk in chunks:
+                buffer += chunk
+                while len(buffer) >= self.part_size_bytes:
+                    await send_part(bytes(buffer[:self.part_size_bytes]))
+                    del buffer[:self.part_size_bytes]
+            while buffer:
+                await send_part(bytes(buffer[:self.part_size_bytes]))
+                del buffer[:self.part_size_bytes]
+            parts = "".join(
+                f"<Part><PartNumber>{number}</PartNumber><ETag>{etag}</ETag></Part>"
+                for number, etag in enumerate(etags, start=1)
+            )
+            body = f"<CompleteMultipartUpload>{parts}</CompleteMultipartUpload>".encode()
+            response = await self._send("POST", path, body, query={"uploadId": upload_id})
+            response.raise_for_status()
+            # A failure after the upload started is reported in the body of a 200
+            if ElementTree.fromstring(response.content).tag.endswith("Error"):
+                raise IOError(f"Could not complete the upload of {key}: {response.text}")
+        except BaseException:
+            try:
+                await self._send("DELETE", path, query={"uploadId": upload_id})
+            except Exception:
+                # Left to the lifecycle rules of the bucket, the upload error is the one to report
+                pass
+            raise
+
+    async def read(self, key: str) -> bytes:
+        response = await self._request("GET", key)
+        if response.status_code == 404:
+            raise FileNotFoundError(key)
+        response.raise_for_status()
+        return response.content
+
+    async def exists(self, key: str) -> bool:
+        response = await self._request("HEAD", key)
+        if response.status_code == 404:
+            return False
+        response.raise_for_status()
+        return True
+
+    async def delete(self, key: str):
+        response = await self._request("DELETE", key)
+        if response.status_code != 404:
+            response.raise_for_status()
+
+    async def size(self, key: str) -> Optional[int]:
+        response = await self._request("HEAD", key)
+        if response.status_code == 404:
+            return None
+        response.raise_for_status()
+        return int(response.headers.get("content-length", 0))
+
+    async def keys(self, modified_before: datetime) -> AsyncIterator[str]:
+        # ListObjectsV2, a page of at most a thousand keys at a time
+        prefix = f"{self.prefix}/" if self.prefix else ""
+        query = {"list-type": "2", "prefix": prefix}
+        while True:
+            response = await self._send("GET", f"/{self.bucket}", query=query)
+            response.raise_for_status()
+            listing = ElementTree.fromstring(response.content)
+            for item in listing.iterfind(f"{S3_NAMESPACE}Contents"):
+                modified = datetime.fromisoformat(item.findtext(f"{S3_NAMESPACE}LastModified").replace("Z", "+00:00"))
+                if modified < modified_before.astimezone(timezone.utc):
+                    yield item.findtext(f"{S3_NAMESPACE}Key")[len(prefix):]
+            token = listing.findtext(f"{S3_NAMESPACE}NextContinuationToken")
+            if listing.findtext(f"{S3_NAMESPACE}IsTruncated") != "true" or not token:
+                return
+            query = dict(query, **{"continuation-token": token})
+
+    async def url(self, key: str) -> Optional[str]:
+        path = self._object_path(key)
+        date = amz_date(datetime.now(timezone.utc))
+        query = self._signer.presigned_query("GET", path, self._host, date, self.url_expires_seconds)
+        return f"{self.endpoint_url}{quote(path)}?{urlencode(query, safe='-_.~', quote_via=quote)}"
@@ -0,0 +1,119 @@
+import json
+from typing import List
+from pydantic import BaseModel
+from redis.exceptions import ResponseError
+
+class CaptureTask(BaseModel):
+    task_id: str
+    run_id: str
+    index: int
+    url: str
+    capture: dict
+    deliveries: int = 1
+
+
+class CaptureTaskQueue:
+    """
+    Page capture tasks shared by the crawl workers, on a Redis stream read
+    through a consumer group. A task read by a worker stays pending until the
+    worker acknowledges it; when the worker dies, or holds it longer than
+    `lease_ms` without renewing it, another worker claims it again.
+
+    A run that stops waiting for its pages cancels the tasks not taken yet,
+    and leaves a tombstone for `finished_ttl_seconds` so the workers drop
+    those already taken instead of storing them.
+    """
+
+    def __init__(self,
+                 cache_client,
+                 stream: str = "capture:tasks",
+                 group: str = "capture-workers",
+                 lease_ms: int = 120000,
+                 max_deliveries: int = 3,
+                 finished_ttl_seconds: int = 86400):
+        self._cache_client = cache_client
+        self.stream = stream
+        self.group = group
+        self.lease_ms = lease_ms
+        self.max_deliveries = max_deliveries
+        self.finished_ttl_seconds = finished_ttl_seconds
+
+    async def ensure_group(self):
+        try:
+            await self._cache_client.xgroup_create(self.stream, self.group, id="0", mkstream=True)
+        except ResponseError as e:
+            # Created by another worker or a previous run
+            if "BUSYGROUP" not in str(e):
+                raise
+
+    async def enqueue(self, run_id: str, index: int, url: str, capture: dict) -> str:
+        payload = {"run_id": run_id, "index": index, "url": url, "capture": capture}
+        return await self._cache_client.xadd(self.stream, {"task": json.dumps(payload)})
+
+    async def claim(self, consumer: str, count: int = 1, block_ms: int = 5000) -> List[CaptureTask]:
+        """
+        Returns up to `count` tasks for `consumer`: the expired leases of other
+        workers first, then new tasks, waiting up to `block_ms` for them.
+        """
+        tasks = await self._reclaim(consumer, count)
+        if tasks:
+            return tasks
+        response = await self._cache_client.xreadgroup(
+            self.group, consumer, {self.stream: ">"}, count=count, block=block_ms
+        )
+        return [
+            self._task(task_id, fields)
+            for _, entries in response or []
+            for task_id, fields in entries
+        ]
+
+    async def _reclaim(self, consumer: str, count: int) -> List[CaptureTask]:
+        response = await self._cache_client.xautoclaim(
+            self.stream, self.group, consumer, min_idle_time=self.lease_ms, start_id="0-0", count=count
+        )
+        entries = [(task_id, fields) for task_id, fields in response[1] if fields]
+        if not entries:
+            return []
+        pending = await self._cache_client.xpending_range(
+            self.stream, self.group, min=entries[0][0], max=entries[-1][0],
+            count=len(entries) * 4, consumername=consumer
+        )
+        deliveries = {entry["message_id"]: entry["times_delivered"] for entry in pending}
+        return [self._task(task_id, fields, deliveries.get(task_id, 1)) for task_id, fields in entries]
+
+    async def extend(self, consumer: str, task_id: str):
+        """
+        Renews the lease of a task still in progress.
+        """
+        await self._cache_client.xclaim(
+            self.stream, self.group, consumer, min_idle_time=0, message_ids=[task_id], justid=True
+        )
+
+    async def ack(self, task_id: str):
+        async with self._cache_client.pipeline(transaction=True) as pipe:
+            pipe.xack(self.stream, self.group, task_id)
+            pipe.xdel(self.stream, task_id)
+            await pipe.execute()
+
+    async def cancel(self, run_id: str, task_ids: List[str]):
+        """
+        Marks the run as finished and removes its tasks from the stream.
+        """
+        async with self._cache_client.pipeline(transaction=True) as pipe:
+            pipe.set(self._finished_key(run_id), 1, ex=self.finished_ttl_seconds)
+            if task_ids:
+                pipe.xack(self.stream, self.group, *task_ids)
+                pipe.xdel(self.stream, *task_ids)
+            await pipe.execute()
+
+    async def finished(self, run_id: str) -> bool:
+        return bool(await self._cache_client.exists(self._finished_key(run_id)))
+
+    @staticmethod
+    def _finished_key(run_id: str) -> str:
+        return f"capture:finished:{run_id}"
+
+    @staticmethod
+    def _task(task_id: str, fields: dict, deliveries: int = 1) -> CaptureTask:
+        payload = json.loads(fields["task"])
+        return CaptureTask(task_id=task_id, deliveries=deliveries, **payload)
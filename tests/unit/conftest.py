@@ -0,0 +1,5 @@
+import os
+import tempfile
+
+# `dep_container` reads the screenshots folder when imported, by the controllers
+os.environ.setdefault("SCREENSHOT_FOLDER", tempfile.gettempdir())
@@ -0,0 +1,42 @@
+import httpx
+import pytest
+from benchmarks.run import histogram_quantile, percentile
+from benchmarks.synthetic_site import SyntheticSite
+from services.link_extractor import HttpLinkExtractor
+
+
+def test_percentile_uses_nearest_rank():
+    # Arrange
+    values = [0.5, 0.1, 0.4, 0.2, 0.3]
+
+    # Act / Assert
+    assert percentile(values, 50) == 0.3
+    assert percentile(values, 99) == 0.5
+    assert percentile([], 50) is None
+
+
+def test_histogram_quantile_interpolates_within_the_bucket():
+    # Arrange
+    buckets = {0.1: 0, 0.5: 50, 1.0: 100, float("inf"): 100}
+
+    # Act / Assert
+    assert histogram_quantile(buckets, 0.5) == pytest.approx(0.5)
+    assert histogram_quantile(buckets, 0.75) == pytest.approx(0.75)
+    assert histogram_quantile({0.1: 0, float("inf"): 0}, 0.5) is None
+
+
+@pytest.mark.asyncio
+async def test_synthetic_site_serves_linked_pages():
+    # Arrange
+    with SyntheticSite(pages=5, links=3, asset_kb=1) as site:
+        async with httpx.AsyncClient() as client:
+            # Act
+            page = await client.get(site.page_url(4))
+            asset = await client.get(f"{site.base_url}/asset/4.bin")
+            missing = await client.get(f"{site.base_url}/nowhere")
+
+    # Assert
+    links = HttpLinkExtractor.parse_links(page.text, str(page.url))
+    assert links == [f"{site.base_url}/page/{n}" for n in (0, 1, 2)]
+    assert len(asset.content) == 1024
+    assert missing.status_code == 404
@@ -0,0 +1,98 @@
+import pytest
+from unittest.mock import AsyncMock, MagicMock, patch
+from utils.browser_pool import BrowserPool
+
+
+def make_browser_mock(alive: bool = True):
+    browser = MagicMock()
+    browser.close = AsyncMock()
+    browser.process.poll.return_value = None if alive else 1
+    browser.createIncognitoBrowserContext = AsyncMock(return_value=MagicMock(close=AsyncMock()))
+    return browser
+
+
+@pytest.mark.asyncio
+async def test_start_launches_pool_size_browsers():
+    # Arrange
+    pool = BrowserPool(size=3)
+
+    with patch("utils.browser_pool.launch_browser", AsyncMock(side_effect=lambda _: make_browser_mock())) as mock_launch:
+        # Act
+        await pool.start()
+        await pool.start()
+
+        # Assert
+        assert mock_launch.call_count == 3
+        assert pool.started
+
+
+@pytest.mark.asyncio
+async def test_acquire_reuses_browsers_without_relaunching():
+    # Arrange
+    browser = make_browser_mock()
+    pool = BrowserPool(size=1, incognito=False)
+
+    with patch("utils.browser_pool.launch_browser", AsyncMock(return_value=browser)) as mock_launch:
+        # Act
+        async with pool.acquire() as first:
+            pass
+        async with pool.acquire() as second:
+            pass
+
+        # Assert
+        assert first is browser
+        assert second is browser
+        mock_launch.assert_called_once()
+        browser.close.assert_not_called()
+
+
+@pytest.mark.asyncio
+async def test_acquire_hands_out_incognito_context():
+    # Arrange
+    browser = make_browser_mock()
+    pool = BrowserPool(size=1, incognito=True)
+
+    with patch("utils.browser_pool.launch_browser", AsyncMock(return_value=browser)):
+        # Act
+        async with pool.acquire() as context:
+            pass
+
+        # Assert
+        assert context is browser.createIncognitoBrowserContext.return_value
+        context.close.assert_awaited_once()
+
+
+@pytest.mark.asyncio
+async def test_dead_browser_is_replaced_on_release():
+    # Arrange
+    dead_browser = make_browser_mock(alive=False)
+    replacement = make_browser_mock()
+    pool = BrowserPool(size=1, incognito=False)
+
+    with patch("utils.browser_pool.launch_browser", AsyncMock(side_effect=[dead_browser, replacement])):
+        # Act
+        async with pool.acquire():
+            pass
+        async with pool.acquire() as browser:
+            pass
+
+        # Assert
+        assert browser is replacement
+
+
+@pytest.mark.asyncio
+async def test_close_closes_every_browser():
+    # Arrange
+    browsers = [make_browser_mock(), make_browser_mock()]
+    pool = BrowserPool(size=2)
+
+    with patch("utils.browser_pool.launch_browser", AsyncMock(side_effect=browsers)):
+        await pool.start()
+
+        # Act
+        await pool.close()
+
+        # Assert
+        assert not pool.started
+        for browser in browsers:
+            browser.close.assert_awaited_once()
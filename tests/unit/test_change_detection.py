@@ -0,0 +1,178 @@
+import io
+import mongomock
+import pytest
+from datetime import datetime, timedelta
+from PIL import Image, ImageDraw
+from typing import Optional
+from unittest.mock import AsyncMock, MagicMock
+from models.capture_options import CaptureOptions
+from models.screenshot_document import PageCapture, PageChange
+from repositories.screenshot_repository import AsyncScreenshotRepository
+from services.change_detection import ChangeDetector
+from services.crawler import Crawler
+from services.image_processor import ImageProcessor
+from services.retention import RetentionCollector
+from services.storage import LocalStorage
+from utils.image_processing import hash_distance
+
+
+def make_png(stripe: int = 0) -> bytes:
+    image = Image.new("RGB", (400, 200), (255, 255, 255))
+    if stripe:
+        image.paste((0, 0, 0), (0, 0, stripe, 200))
+    buffer = io.BytesIO()
+    image.save(buffer, "PNG")
+    return buffer.getvalue()
+
+
+def make_text_page(text: str) -> bytes:
+    image = Image.new("RGB", (800, 600), (255, 255, 255))
+    ImageDraw.Draw(image).text((40, 40), text, fill=(0, 0, 0))
+    buffer = io.BytesIO()
+    image.save(buffer, "PNG")
+    return buffer.getvalue()
+
+
+def make_crawler(tmp_path, max_distance: Optional[int] = None):
+    repository = AsyncScreenshotRepository(mongomock.MongoClient()['screenshots_db'])
+    storage = LocalStorage(tmp_path, shard_depth=0)
+    image_processor = ImageProcessor(workers=0)
+    change_detector = ChangeDetector(repository, storage, image_processor, max_distance)
+    return Crawler(
+            repository=repository, 
+            storage=storage, 
+            logger=MagicMock(),
+            image_processor=image_processor,
+            change_detector=change_detector)
+
+
+@pytest.mark.asyncio
+async def test_unchanged_pages_reuse_the_file_of_their_last_capture(tmp_path):
+    # Arrange
+    crawler = make_crawler(tmp_path)
+    capture = CaptureOptions(thumbnail_width=100)
+    renders = [make_png(), make_png(), make_png(stripe=200)]
+
+    async def take_screenshot(browser, url, capture):
+        return renders.pop(0)
+
+    crawler._take_screenshot = take_screenshot
+
+    # Act
+    pages = [
+        (await crawler.take_screenshots(["https://example.com/"], MagicMock(), run_id, {}, capture))[0]
+        for run_id in ("first", "second", "third")
+    ]
+
+    # Assert
+    assert [page.change for page in pages] == [PageChange.NEW, PageChange.UNCHANGED, PageChange.CHANGED]
+    assert [page.path for page in pages] == [
+        "first_screenshot_0.png", "first_screenshot_0.png", "third_screenshot_0.png"
+    ]
+    assert pages[1].thumbnail == "first_screenshot_0_thumb_w100.png"
+    assert not (tmp_path / "second_screenshot_0.png").exists()
+    assert pages[2].content_hash != pages[0].content_hash
+
+
+@pytest.mark.asyncio
+@pytest.mark.parametrize("max_distance, change", [(None, PageChange.CHANGED), (1, PageChange.UNCHANGED)])
+async def test_text_changes_are_only_ignored_with_a_perceptual_tolerance(tmp_path, max_distance, change):
+    # Arrange
+    crawler = make_crawler(tmp_path, max_distance)
+    renders = [make_text_page("Price: 10 USD - In stock"), make_text_page("Price: 99 USD - Sold out")]
+
+    async def take_screenshot(browser, url, capture):
+        return renders.pop(0)
+
+    crawler._take_screenshot = take_screenshot
+
+    # Act
+    first, second = [
+        (await crawler.take_screenshots(["https://example.com/"], MagicMock(), run_id, {}))[0]
+        for run_id in ("first", "second")
+    ]
+
+    # Assert
+    # The difference hash barely sees the text
+    assert hash_distance(first.perceptual_hash, second.perceptual_hash) <= 1
+    assert second.change == change
+
+
+@pytest.mark.asyncio
+async def test_a_removed_last_capture_is_stored_again(tmp_path):
+    # Arrange
+    crawler = make_crawler(tmp_path)
+
+    async def take_screenshot(browser, url, capture):
+        return make_png()
+
+    crawler._take_screenshot = take_screenshot
+    await crawler.take_screenshots(["https://example.com/"], MagicMock(), "first", {})
+    (tmp_path / "first_screenshot_0.png").unlink()
+
+    # Act
+    [page] = await crawler.take_screenshots(["https://example.com/"], MagicMock(), "second", {})
+
+    # Assert
+    assert page.change == PageChange.NEW
+    assert (tmp_path / "second_screenshot_0.png").read_bytes() == make_png()
+
+
+@pytest.mark.asyncio
+async def test_files_reused_by_a_run_in_progress_outlive_their_run(tmp_path):
+    # Arrange
+    crawler = make_crawler(tmp_path)
+    repository = crawler._repository
+    run_cache = MagicMock()
+    run_cache.delete = AsyncMock()
+    collector = RetentionCollector(repository, crawler.storage, run_cache, MagicMock(), max_age_seconds=86400)
+
+    async def take_screenshot(browser, url, capture):
+        return make_png()
+
+    crawler._take_screenshot = take_screenshot
+    first = await crawler.take_screenshots(["https://example.com/"], MagicMock(), "first", {})
+    await repository.insert_screenshot_data("first", "https://example.com/", [first[0].path], first)
+    repository.collection.update_one({"_id": "first"}, {"$set": {"timestamp": datetime.now() - timedelta(days=2)}})
+    remembered = repository.last_capture_collection.find_one()["timestamp"]
+
+    # Act
+    # The second run reuses the file and is not stored yet when the first one expires
+    second = await crawler.take_screenshots(["https://example.com/"], MagicMock(), "second", {})
+    moved = repository.last_capture_collection.find_one()["timestamp"]
+    await collector.collect()
+    kept = (tmp_path / "first_screenshot_0.png").exists()
+    await repository.insert_screenshot_data("second", "https://example.com/", [second[0].path], second)
+    repository.collection.update_one({"_id": "second"}, {"$set": {"timestamp": datetime.now() - timedelta(days=2)}})
+    repository.file_lease_collection.delete_many({})
+    await collector.collect()
+
+    # Assert
+    assert second[0].change == PageChange.UNCHANGED
+    assert kept
+    assert not (tmp_path / "first_screenshot_0.png").exists()
+    # The last capture moved to the second run, then went with its file
+    assert moved > remembered
+    assert repository.last_capture_collection.count_documents({}) == 0
+
+
+@pytest.mark.asyncio
+async def test_run_document_counts_the_changes():
+    # Arrange
+    repository = AsyncScreenshotRepository(mongomock.MongoClient()['screenshots_db'])
+    pages = [
+        PageCapture(url="https://example.com/", path="a.png", change=PageChange.NEW),
+        PageCapture(url="https://example.com/a", path="b.png", change=PageChange.UNCHANGED),
+        PageCapture(url="https://example.com/b", path="b.png", change=PageChange.UNCHANGED),
+    ]
+
+    # Act
+    await repository.insert_screenshot_data("with_changes", "https://example.com/", ["a.png", "b.png"], pages)
+    await repository.insert_screenshot_data("without_changes", "https://example.com/", ["c.png"], [
+        PageCapture(url="https://example.com/", path="c.png")
+    ])
+
+    # Assert
+    document = repository.collection.find_one({"_id": "with_changes"})
+    assert document["changes"] == {"new": 1, "changed": 0, "unchanged": 2}
+    assert repository.collection.find_one({"_id": "without_changes"})["changes"] is None
@@ -0,0 +1,152 @@
+import asyncio
+import fakeredis
+import mongomock
+import pytest
+from pathlib import Path
+from unittest.mock import MagicMock
+from dtos.screenshot import ScreenshotRequest
+from models.screenshot_document import PageCapture
+from repositories.screenshot_repository import AsyncScreenshotRepository
+from services.coalescing import CoalescedCrawlError, CrawlCoalescer
+from services.crawler import Crawler
+from services.run_events import RunEvents, RunEventType
+from services.storage import LocalStorage
+
+REQUEST = ScreenshotRequest(start_url="https://example.com/", number_of_links_to_follow=1)
+
+
+def make_crawler(repository, release: asyncio.Event, fail: bool = False):
+    crawler = Crawler(repository=repository, storage=LocalStorage(Path("/tmp"), shard_depth=0), logger=MagicMock())
+    crawled = []
+
+    async def crawl_website(start_url, number_of_links, run_id, **kwargs):
+        crawled.append(run_id)
+        await release.wait()
+        if fail:
+            raise Exception("Navigation failed")
+        path = f"{run_id}_screenshot_0.png"
+        await repository.insert_screenshot_data(run_id, start_url, [path], [PageCapture(url=start_url, path=path)])
+        return [path]
+
+    crawler.crawl_website = crawl_website
+    return crawler, crawled
+
+
+@pytest.mark.asyncio
+async def test_identical_requests_in_flight_share_one_crawl():
+    # Arrange
+    repository = AsyncScreenshotRepository(mongomock.MongoClient()['screenshots_db'])
+    release = asyncio.Event()
+    crawler, crawled = make_crawler(repository, release)
+    coalescer = CrawlCoalescer(MagicMock(), window_seconds=0)
+    other = ScreenshotRequest(start_url="https://example.com/", number_of_links_to_follow=2)
+
+    # Act
+    crawls = [asyncio.create_task(coalescer.crawl(crawler, REQUEST, f"run_{i}")) for i in range(3)]
+    crawls.append(asyncio.create_task(coalescer.crawl(crawler, other, "other_run")))
+    await asyncio.sleep(0)
+    release.set()
+    results = await asyncio.gather(*crawls)
+
+    # Assert
+    assert crawled == ["run_0", "other_run"]
+    assert results[:3] == [["run_0_screenshot_0.png"]] * 3
+    follower = await repository.get_screenshots_by_run_id("run_2")
+    assert follower["screenshots"] == ["run_0_screenshot_0.png"]
+    assert follower["pages"][0]["source"] == "cache"
+    # After the crawl, without window, the next request crawls again
+    await coalescer.crawl(crawler, REQUEST, "run_3")
+    assert crawled[-1] == "run_3"
+
+
+@pytest.mark.asyncio
+async def test_a_failed_crawl_fails_its_followers_and_is_not_shared_after():
+    # Arrange
+    repository = AsyncScreenshotRepository(mongomock.MongoClient()['screenshots_db'])
+    release = asyncio.Event()
+    crawler, crawled = make_crawler(repository, release, fail=True)
+    coalescer = CrawlCoalescer(MagicMock(), window_seconds=60)
+
+    # Act
+    crawls = [asyncio.create_task(coalescer.crawl(crawler, REQUEST, f"run_{i}")) for i in range(2)]
+    await asyncio.sleep(0)
+    release.set()
+    results = await asyncio.gather(*crawls, return_exceptions=True)
+    with pytest.raises(Exception):
+        await coalescer.crawl(crawler, REQUEST, "run_2")
+
+    # Assert
+    assert [str(result) for result in results] == ["Navigation failed"] * 2
+    assert crawled == ["run_0", "run_2"]
+
+
+@pytest.mark.asyncio
+async def test_processes_share_the_crawl_through_the_redis_lock():
+    # Arrange
+    repository = AsyncScreenshotRepository(mongomock.MongoClient()['screenshots_db'])
+    cache_client = fakeredis.FakeAsyncRedis(decode_responses=True)
+    run_events = RunEvents(cache_client, block_ms=10)
+    release = asyncio.Event()
+    first_crawler, crawled = make_crawler(repository, release)
+    second_crawler, second_crawled = make_crawler(repository, release)
+    first = CrawlCoalescer(MagicMock(), run_events, cache_client, window_seconds=30)
+    second = CrawlCoalescer(MagicMock(), run_events, cache_client, window_seconds=30)
+
+    # Act
+    # The job runner of the first process publishes the state of its run
+    await run_events.publish("run_a", RunEventType.STATUS, {"status": "running"})
+    leader = asyncio.create_task(first.crawl(first_crawler, REQUEST, "run_a"))
+    await asyncio.sleep(0.01)
+    follower = asyncio.create_task(second.crawl(second_crawler, REQUEST, "run_b"))
+    await asyncio.sleep(0.01)
+    release.set()
+    screenshots = await leader
+    await run_events.publish("run_a", RunEventType.DONE, {"screenshots": screenshots})
+
+    # Assert
+    assert await follower == ["run_a_screenshot_0.png"]
+    assert crawled == ["run_a"]
+    assert second_crawled == []
+    assert (await repository.get_screenshots_by_run_id("run_b"))["screenshots"] == ["run_a_screenshot_0.png"]
+    assert await run_events.leader_of("run_b") == "run_a"
+    # The lock stays for the window, for the late identical requests
+    assert 0 < await cache_client.pttl(f"coalesce:{CrawlCoalescer.key_for(REQUEST)}") <= 30000
+
+
+@pytest.mark.asyncio
+async def test_a_failed_crawl_of_another_process_fails_the_followers():
+    # Arrange
+    cache_client = fakeredis.FakeAsyncRedis(decode_responses=True)
+    run_events = RunEvents(cache_client, block_ms=10)
+    await cache_client.set(f"coalesce:{CrawlCoalescer.key_for(REQUEST)}", "run_a")
+    await run_events.publish("run_a", RunEventType.FAILED, {"error": "Timeout"})
+    crawler, crawled = make_crawler(MagicMock(), asyncio.Event())
+    coalescer = CrawlCoalescer(MagicMock(), run_events, cache_client)
+
+    # Act
+    with pytest.raises(CoalescedCrawlError):
+        await coalescer.crawl(crawler, REQUEST, "run_b")
+
+    # Assert
+    assert crawled == []
+
+
+@pytest.mark.asyncio
+async def test_followers_in_the_process_point_at_the_run_crawling():
+    # Arrange
+    repository = AsyncScreenshotRepository(mongomock.MongoClient()['screenshots_db'])
+    run_events = RunEvents(fakeredis.FakeAsyncRedis(decode_responses=True), block_ms=10)
+    release = asyncio.Event()
+    crawler, crawled = make_crawler(repository, release)
+    coalescer = CrawlCoalescer(MagicMock(), run_events, window_seconds=0)
+
+    # Act
+    crawls = [asyncio.create_task(coalescer.crawl(crawler, REQUEST, f"run_{i}")) for i in range(2)]
+    await asyncio.sleep(0.01)
+    release.set()
+    await asyncio.gather(*crawls)
+
+    # Assert
+    assert crawled == ["run_0"]
+    assert await run_events.leader_of("run_1") == "run_0"
+    assert await run_events.leader_of("run_0") is None
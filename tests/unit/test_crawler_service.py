@@ -1,7 +1,15 @@
+import asyncio
 import pytest
-from unittest.mock import AsyncMock, MagicMock, patch
+from unittest.mock import AsyncMock, MagicMock, call, patch
 from pathlib import Path
+from models.capture_options import CaptureOptions, CaptureProfile, ClipRegion, ImageFormat, Viewport
+from models.screenshot_document import CaptureSource, PageCapture
 from services.crawler import Crawler
+from services.link_extractor import DiscoveryMode
+from services.politeness import PageDisallowedError, PolitenessScheduler
+from services.run_events import RunEventType
+from services.storage import LocalStorage
+from utils.frontier import CrawlFrontier
 
 @pytest.mark.asyncio
 async def test_crawl_website():
@@ -10,7 +18,7 @@ async def test_crawl_website():
     logger_mock = MagicMock()
     crawler = Crawler(
             repository=repository_mock, 
-            base_dir=Path("/tmp"), 
+            storage=LocalStorage(Path("/tmp"), shard_depth=0), 
             logger=logger_mock)
     
     start_url = "https://example.com/"
@@ -33,7 +41,11 @@ async def test_crawl_website():
                     f"/tmp/{run_id}_screenshot_2.png",
                     f"/tmp/{run_id}_screenshot_3.png"
                     ]
-        crawler.take_screenshots = AsyncMock(return_value=mock_screenshot_paths)
+        mock_pages = [
+                    PageCapture(url=link, path=path)
+                    for link, path in zip([start_url] + mock_page.evaluate.return_value, mock_screenshot_paths)
+                    ]
+        crawler.take_screenshots = AsyncMock(return_value=mock_pages)
 
         # Act
         screenshots = await crawler.crawl_website(start_url, number_of_links, run_id)
@@ -48,38 +60,39 @@ async def test_crawl_website():
                 "start_url": start_url,
                 "number_of_links": number_of_links,
                 "links": [start_url] + mock_page.evaluate.return_value
-            }
+            },
+            CaptureOptions(),
+            None
         )
         repository_mock.insert_screenshot_data.assert_called_once_with(
-            run_id, start_url, mock_screenshot_paths
+            run_id, start_url, mock_screenshot_paths, mock_pages
         )
         assert screenshots == mock_screenshot_paths
 
 
 @pytest.mark.asyncio
-async def test_take_screenshots():
+async def test_take_screenshots(tmp_path):
     # Arrange
     repository_mock = MagicMock()
     logger_mock = MagicMock()
-    crawler = Crawler(repository=repository_mock, base_dir=Path("/tmp"), logger=logger_mock)
+    crawler = Crawler(repository=repository_mock, storage=LocalStorage(tmp_path, shard_depth=0), logger=logger_mock)
 
     links_to_pages = ["https://example.com/link1", "https://example.com/link2"]
     browser_mock = MagicMock()
     run_id = "test_run_id"
 
-    crawler._take_screenshot = AsyncMock(side_effect=[
-        "/tmp/test_run_id_screenshot_0.png",
-        "/tmp/test_run_id_screenshot_1.png"
-    ])
+    crawler._take_screenshot = AsyncMock(side_effect=[b"first png", b"second png"])
 
     # Act
     screenshot_paths = await crawler.take_screenshots(links_to_pages, browser_mock, run_id, {})
 
     # Assert
-    assert screenshot_paths == [
-        "/tmp/test_run_id_screenshot_0.png",
-        "/tmp/test_run_id_screenshot_1.png"
+    assert [page.path for page in screenshot_paths] == [
+        "test_run_id_screenshot_0.png",
+        "test_run_id_screenshot_1.png"
     ]
+    assert (tmp_path / "test_run_id_screenshot_1.png").read_bytes() == b"second png"
+    assert [page.url for page in screenshot_paths] == links_to_pages
     assert crawler._take_screenshot.call_count == 2
 
 
@@ -87,7 +100,7 @@ def test_get_screenshots_by_run_id():
     # Arrange
     repository_mock = MagicMock()
     logger_mock = MagicMock()
-    crawler = Crawler(repository=repository_mock, base_dir=Path("/tmp"), logger=logger_mock)
+    crawler = Crawler(repository=repository_mock, storage=LocalStorage(Path("/tmp"), shard_depth=0), logger=logger_mock)
 
     run_id = "test_run_id"
     expected_result = ["screenshot_1.png", "screenshot_2.png"]
@@ -106,18 +119,571 @@ async def test_take_screenshot():
     # Arrange
     repository_mock = MagicMock()
     logger_mock = MagicMock()
-    crawler = Crawler(repository=repository_mock, base_dir=Path("/tmp"), logger=logger_mock)
+    crawler = Crawler(repository=repository_mock, storage=LocalStorage(Path("/tmp"), shard_depth=0), logger=logger_mock)
 
     url = "https://example.com/"
-    screenshot_path = Path("/tmp/test_screenshot.png")
 
     with patch("services.crawler.PageContextManager") as mock_page_manager:
         mock_page = mock_page_manager.return_value.__aenter__.return_value
+        mock_page.screenshot = AsyncMock(return_value=b"png bytes")
         
         # Act
-        result = await crawler._take_screenshot(MagicMock(), url, screenshot_path)
+        result = await crawler._take_screenshot(MagicMock(), url)
 
         # Assert
         mock_page.goto.assert_called_once_with(url)
-        mock_page.screenshot.assert_called_once_with(path=str(screenshot_path))
-        assert result == str(screenshot_path)
\ No newline at end of file
+        mock_page.screenshot.assert_called_once_with()
+        assert result == b"png bytes"
+
+@pytest.mark.asyncio
+async def test_take_screenshots_keeps_order_and_isolates_errors(tmp_path):
+    # Arrange
+    repository_mock = MagicMock()
+    logger_mock = MagicMock()
+    crawler = Crawler(
+            repository=repository_mock, 
+            storage=LocalStorage(tmp_path, shard_depth=0), 
+            logger=logger_mock,
+            max_concurrent_pages=3)
+
+    links_to_pages = ["https://example.com/slow", "https://example.com/broken", "https://example.com/fast"]
+    delays = {"https://example.com/slow": 0.05, "https://example.com/fast": 0}
+
+    async def take_screenshot(browser, url, capture):
+        if url not in delays:
+            raise Exception("Navigation failed")
+        await asyncio.sleep(delays[url])
+        return b"png bytes"
+
+    crawler._take_screenshot = AsyncMock(side_effect=take_screenshot)
+
+    # Act
+    screenshot_paths = await crawler.take_screenshots(links_to_pages, MagicMock(), "test_run_id", {})
+
+    # Assert
+    assert [page.path for page in screenshot_paths] == [
+        "test_run_id_screenshot_0.png",
+        "test_run_id_screenshot_2.png"
+    ]
+    logger_mock.error.assert_called_once()
+
+
+@pytest.mark.asyncio
+async def test_take_screenshots_bounds_open_pages(tmp_path):
+    # Arrange
+    crawler = Crawler(
+            repository=MagicMock(), 
+            storage=LocalStorage(tmp_path, shard_depth=0), 
+            logger=MagicMock(),
+            max_concurrent_pages=2)
+
+    open_pages = 0
+    max_open_pages = 0
+
+    async def take_screenshot(browser, url, capture):
+        nonlocal open_pages, max_open_pages
+        open_pages += 1
+        max_open_pages = max(max_open_pages, open_pages)
+        await asyncio.sleep(0.01)
+        open_pages -= 1
+        return b"png bytes"
+
+    crawler._take_screenshot = AsyncMock(side_effect=take_screenshot)
+
+    # Act
+    screenshot_paths = await crawler.take_screenshots(
+        [f"https://example.com/link{i}" for i in range(6)], MagicMock(), "test_run_id", {})
+
+    # Assert
+    assert len(screenshot_paths) == 6
+    assert max_open_pages == 2
+
+
+@pytest.mark.asyncio
+async def test_crawl_website_awaits_async_repository():
+    # Arrange
+    repository_mock = MagicMock()
+    repository_mock.insert_screenshot_data = AsyncMock()
+    crawler = Crawler(repository=repository_mock, storage=LocalStorage(Path("/tmp"), shard_depth=0), logger=MagicMock())
+    pages = [PageCapture(url="https://example.com/", path="/tmp/test_run_id_screenshot_0.png")]
+    crawler.take_screenshots = AsyncMock(return_value=pages)
+
+    with patch("services.crawler.BrowserContextManager"), \
+         patch("services.crawler.PageContextManager") as mock_page_manager:
+        mock_page_manager.return_value.__aenter__.return_value.evaluate = AsyncMock(return_value=[])
+
+        # Act
+        await crawler.crawl_website("https://example.com/", 0, "test_run_id")
+
+    # Assert
+    repository_mock.insert_screenshot_data.assert_awaited_once_with(
+        "test_run_id", "https://example.com/", ["/tmp/test_run_id_screenshot_0.png"], pages
+    )
+
+
+@pytest.mark.asyncio
+async def test_take_screenshots_reuses_cached_captures(tmp_path):
+    # Arrange
+    screenshot_cache = MagicMock()
+    screenshot_cache.get = AsyncMock(side_effect=lambda url, settings: 
+                                     "previous_run_screenshot_0.png" if url.endswith("cached") else None)
+    screenshot_cache.put = AsyncMock()
+    storage = LocalStorage(tmp_path, shard_depth=0)
+    await storage.write("previous_run_screenshot_0.png", b"png bytes")
+    crawler = Crawler(
+            repository=MagicMock(), 
+            storage=storage, 
+            logger=MagicMock(),
+            screenshot_cache=screenshot_cache)
+    crawler._take_screenshot = AsyncMock(return_value=b"png bytes")
+
+    # Act
+    pages = await crawler.take_screenshots(
+        ["https://example.com/cached", "https://example.com/new"], MagicMock(), "test_run_id", {})
+
+    # Assert
+    assert [(page.path, page.source) for page in pages] == [
+        ("previous_run_screenshot_0.png", CaptureSource.CACHE),
+        ("test_run_id_screenshot_1.png", CaptureSource.FRESH),
+    ]
+    crawler._take_screenshot.assert_called_once()
+    screenshot_cache.put.assert_called_once_with(
+        "https://example.com/new", CaptureOptions().cache_settings(), "test_run_id_screenshot_1.png")
+
+
+@pytest.mark.asyncio
+async def test_discover_links_walks_breadth_first_until_max_depth():
+    # Arrange
+    crawler = Crawler(repository=MagicMock(), storage=LocalStorage(Path("/tmp"), shard_depth=0), logger=MagicMock())
+    site = {
+        "https://example.com/": ["https://example.com/a", "https://example.com/b", "https://example.com/a#top"],
+        "https://example.com/a": ["https://example.com/a1", "https://example.com/"],
+        "https://example.com/b": ["https://example.com/b1"],
+        "https://example.com/a1": ["https://example.com/too-deep"],
+    }
+    crawler._extract_links = AsyncMock(side_effect=lambda browser_session, url, discovery_mode, **kwargs: site[url])
+    frontier = CrawlFrontier("https://example.com/", max_depth=2)
+
+    # Act
+    links = await crawler._discover_links(MagicMock(), frontier, 10)
+
+    # Assert
+    assert links == [
+        "https://example.com/a",
+        "https://example.com/b",
+        "https://example.com/a1",
+        "https://example.com/b1",
+    ]
+    assert crawler._extract_links.call_count == 3
+
+
+@pytest.mark.asyncio
+async def test_extract_links_http_mode_never_opens_the_browser():
+    # Arrange
+    link_extractor = MagicMock(min_links=3)
+    link_extractor.extract = AsyncMock(return_value=["https://example.com/a"])
+    crawler = Crawler(
+            repository=MagicMock(), 
+            storage=LocalStorage(Path("/tmp"), shard_depth=0), 
+            logger=MagicMock(),
+            link_extractor=link_extractor)
+    browser_session = MagicMock()
+    browser_session.get = AsyncMock()
+
+    # Act
+    links = await crawler._extract_links(browser_session, "https://example.com/", DiscoveryMode.HTTP)
+
+    # Assert
+    assert links == ["https://example.com/a"]
+    browser_session.get.assert_not_called()
+
+
+@pytest.mark.asyncio
+async def test_extract_links_auto_mode_falls_back_to_browser_on_few_links():
+    # Arrange
+    link_extractor = MagicMock(min_links=3)
+    link_extractor.extract = AsyncMock(return_value=["https://example.com/a"])
+    crawler = Crawler(
+            repository=MagicMock(), 
+            storage=LocalStorage(Path("/tmp"), shard_depth=0), 
+            logger=MagicMock(),
+            link_extractor=link_extractor)
+    browser_session = MagicMock()
+    browser_session.get = AsyncMock()
+    browser_links = ["https://example.com/a", "https://example.com/b", "https://example.com/c"]
+
+    with patch("services.crawler.PageContextManager") as mock_page_manager:
+        mock_page_manager.return_value.__aenter__.return_value.evaluate = AsyncMock(return_value=browser_links)
+
+        # Act
+        links = await crawler._extract_links(browser_session, "https://example.com/", DiscoveryMode.AUTO)
+
+    # Assert
+    assert links == browser_links
+    browser_session.get.assert_awaited_once()
+
+
+@pytest.mark.asyncio
+async def test_take_screenshot_passes_capture_options_to_the_browser():
+    # Arrange
+    crawler = Crawler(repository=MagicMock(), storage=LocalStorage(Path("/tmp"), shard_depth=0), logger=MagicMock())
+    capture = CaptureOptions(image_format=ImageFormat.JPEG, quality=70, clip=ClipRegion(x=0, y=0, width=400, height=300))
+
+    with patch("services.crawler.PageContextManager") as mock_page_manager:
+        mock_page = mock_page_manager.return_value.__aenter__.return_value
+        mock_page.screenshot = AsyncMock(return_value=b"jpeg bytes")
+
+        # Act
+        result = await crawler._take_screenshot(MagicMock(), "https://example.com/", capture)
+
+    # Assert
+    mock_page.screenshot.assert_called_once_with(
+        type="jpeg", 
+        quality=70, 
+        clip={"x": 0, "y": 0, "width": 400, "height": 300}
+    )
+    assert result == b"jpeg bytes"
+
+
+@pytest.mark.asyncio
+async def test_take_screenshot_encodes_webp_off_the_event_loop():
+    # Arrange
+    image_processor = MagicMock()
+    image_processor.encode = AsyncMock(return_value=b"webp bytes")
+    crawler = Crawler(
+            repository=MagicMock(), 
+            storage=LocalStorage(Path("/tmp"), shard_depth=0), 
+            logger=MagicMock(),
+            image_processor=image_processor)
+    capture = CaptureOptions(image_format=ImageFormat.WEBP, quality=60, full_page=True)
+
+    with patch("services.crawler.PageContextManager") as mock_page_manager:
+        mock_page = mock_page_manager.return_value.__aenter__.return_value
+        mock_page.screenshot = AsyncMock(return_value=b"png bytes")
+
+        # Act
+        result = await crawler._take_screenshot(MagicMock(), "https://example.com/", capture)
+
+    # Assert
+    mock_page.screenshot.assert_called_once_with(type="png", fullPage=True)
+    image_processor.encode.assert_awaited_once_with(b"png bytes", "webp", 60)
+    assert result == b"webp bytes"
+
+
+@pytest.mark.asyncio
+async def test_take_screenshots_loads_the_page_once_for_every_viewport():
+    # Arrange
+    crawler = Crawler(repository=MagicMock(), storage=LocalStorage(Path("/tmp"), shard_depth=0), logger=MagicMock())
+    capture = CaptureOptions(
+        viewports=["desktop", "mobile", Viewport(name="touch", width=1024, height=768, has_touch=True),
+                   Viewport(name="wide", width=1920, height=1080)],
+        profile=CaptureProfile(wait_until="networkidle0")
+    )
+
+    with patch("services.crawler.PageContextManager") as mock_page_manager, \
+         patch("services.crawler.load_page", new_callable=AsyncMock) as mock_load_page:
+        mock_page = mock_page_manager.return_value.__aenter__.return_value
+        emulated = []
+
+        async def emulate(viewport):
+            changed = bool(emulated) and (viewport["isMobile"], viewport["hasTouch"]) != emulated[-1][1:]
+            emulated.append((viewport["width"], viewport["isMobile"], viewport["hasTouch"]))
+            return changed
+
+        mock_page._emulationManager.emulateViewport = AsyncMock(side_effect=emulate)
+        mock_page.reload = AsyncMock()
+        mock_page.screenshot = AsyncMock(side_effect=[b"desktop png", b"wide png", b"touch png", b"mobile png"])
+
+        # Act
+        result = await crawler._take_screenshots(MagicMock(), "https://example.com/", capture, capture.viewports)
+
+    # Assert
+    mock_load_page.assert_awaited_once()
+    mock_page.setViewport.assert_not_called()
+    # Every change of emulation comes with a single reload, waiting as the profile says
+    assert [width for width, *_ in emulated] == [1280, 1920, 1024, 390]
+    assert mock_page.reload.await_args_list == [call(waitUntil="networkidle0")] * 2
+    assert result == [b"desktop png", b"mobile png", b"touch png", b"wide png"]
+
+
+@pytest.mark.asyncio
+async def test_take_screenshots_groups_the_viewports_of_every_link(tmp_path):
+    # Arrange
+    crawler = Crawler(repository=MagicMock(), storage=LocalStorage(tmp_path, shard_depth=0), logger=MagicMock())
+    crawler._take_screenshots = AsyncMock(return_value=[b"desktop png", b"mobile png"])
+    capture = CaptureOptions(viewports=["desktop", "mobile"])
+
+    # Act
+    pages = await crawler.take_screenshots(["https://example.com/"], MagicMock(), "test_run_id", {}, capture)
+
+    # Assert
+    crawler._take_screenshots.assert_awaited_once()
+    assert pages[0].path == "test_run_id_screenshot_0_desktop.png"
+    assert [(page.viewport, page.path) for page in pages[0].viewports] == [
+        ("desktop", "test_run_id_screenshot_0_desktop.png"),
+        ("mobile", "test_run_id_screenshot_0_mobile.png"),
+    ]
+    assert (tmp_path / "test_run_id_screenshot_0_mobile.png").read_bytes() == b"mobile png"
+
+
+@pytest.mark.asyncio
+async def test_take_screenshots_writes_thumbnails():
+    # Arrange
+    image_processor = MagicMock()
+    image_processor.thumbnail = AsyncMock(return_value=b"thumbnail bytes")
+    storage = MagicMock()
+    storage.key_for = lambda name: f"ab/{name}"
+    storage.write = AsyncMock(side_effect=lambda key, data: key)
+    crawler = Crawler(
+            repository=MagicMock(), 
+            storage=storage, 
+            logger=MagicMock(),
+            image_processor=image_processor)
+    crawler._take_screenshot = AsyncMock(return_value=b"jpeg bytes")
+    capture = CaptureOptions(image_format=ImageFormat.JPEG, thumbnail_width=200)
+
+    # Act
+    pages = await crawler.take_screenshots(["https://example.com/"], MagicMock(), "test_run_id", {}, capture)
+
+    # Assert
+    assert pages[0].path == "ab/test_run_id_screenshot_0.jpg"
+    assert pages[0].thumbnail == "ab/test_run_id_screenshot_0_thumb_w200.jpg"
+    image_processor.thumbnail.assert_awaited_once_with(b"jpeg bytes", 200, "jpeg", None)
+    assert [call.args for call in storage.write.await_args_list] == [
+        ("ab/test_run_id_screenshot_0.jpg", b"jpeg bytes"),
+        ("ab/test_run_id_screenshot_0_thumb_w200.jpg", b"thumbnail bytes"),
+    ]
+
+
+@pytest.mark.asyncio
+async def test_take_screenshots_streams_every_page_outcome(tmp_path):
+    # Arrange
+    run_events = MagicMock()
+    run_events.publish = AsyncMock()
+    crawler = Crawler(
+            repository=MagicMock(), 
+            storage=LocalStorage(tmp_path, shard_depth=0), 
+            logger=MagicMock(),
+            run_events=run_events)
+    crawler._take_screenshot = AsyncMock(side_effect=[b"png bytes", Exception("Timeout")])
+
+    # Act
+    await crawler.take_screenshots(
+        ["https://example.com/", "https://example.com/broken"], MagicMock(), "test_run_id", {})
+
+    # Assert
+    # The pages report as they finish, in any order
+    events = sorted((call.args for call in run_events.publish.call_args_list), key=lambda args: args[2]["index"])
+    assert events == [
+        ("test_run_id", RunEventType.PAGE, {
+            "index": 0, 
+            "url": "https://example.com/", 
+            "status": "captured", 
+            "path": "test_run_id_screenshot_0.png", 
+            "thumbnail": None, 
+            "source": "fresh",
+            "change": None,
+            "content_hash": None,
+            "perceptual_hash": None,
+            "viewport": None,
+            "viewports": None
+        }),
+        ("test_run_id", RunEventType.PAGE, {
+            "index": 1, 
+            "url": "https://example.com/broken", 
+            "status": "failed", 
+            "error": "Timeout"
+        }),
+    ]
+
+
+@pytest.mark.asyncio
+async def test_take_screenshots_interleaves_hosts_and_skips_disallowed_pages(tmp_path):
+    # Arrange
+    scheduler = PolitenessScheduler(max_per_host=1, min_interval_seconds=0)
+    scheduler.allowed = AsyncMock(side_effect=lambda url: not url.endswith("/private"))
+    crawler = Crawler(
+            repository=MagicMock(), 
+            storage=LocalStorage(tmp_path, shard_depth=0), 
+            logger=MagicMock(),
+            max_concurrent_pages=1,
+            scheduler=scheduler)
+
+    links_to_pages = ["https://a.com/1", "https://a.com/2", "https://a.com/private", "https://b.com/1"]
+    visited = []
+
+    async def take_screenshot(browser, url, capture):
+        visited.append(url)
+        return b"png bytes"
+
+    crawler._take_screenshot = AsyncMock(side_effect=take_screenshot)
+
+    # Act
+    pages = await crawler.take_screenshots(links_to_pages, MagicMock(), "test_run_id", {})
+
+    # Assert
+    assert visited == ["https://a.com/1", "https://b.com/1", "https://a.com/2"]
+    assert [page.url for page in pages] == ["https://a.com/1", "https://a.com/2", "https://b.com/1"]
+
+
+@pytest.mark.asyncio
+async def test_capture_page_checks_robots_before_reusing_a_cached_capture(tmp_path):
+    # Arrange
+    scheduler = PolitenessScheduler(max_per_host=1, min_interval_seconds=0)
+    scheduler.allowed = AsyncMock(return_value=False)
+    screenshot_cache = MagicMock()
+    screenshot_cache.get = AsyncMock(return_value="previous_run_screenshot_0.png")
+    storage = LocalStorage(tmp_path, shard_depth=0)
+    await storage.write("previous_run_screenshot_0.png", b"png bytes")
+    crawler = Crawler(
+            repository=MagicMock(), 
+            storage=storage, 
+            logger=MagicMock(),
+            screenshot_cache=screenshot_cache,
+            scheduler=scheduler)
+
+    # Act
+    with pytest.raises(PageDisallowedError):
+        await crawler.capture_page(MagicMock(), "test_run_id", 0, "https://a.com/private")
+
+    # Assert
+    screenshot_cache.get.assert_not_awaited()
+
+
+@pytest.mark.asyncio
+async def test_crawl_website_queues_pages_for_the_workers_and_collects_them():
+    # Arrange
+    repository_mock = MagicMock()
+    stored = [PageCapture(url="https://example.com/", path="/tmp/test_run_id_screenshot_0.png")]
+    repository_mock.get_page_captures = AsyncMock(return_value=stored)
+    repository_mock.delete_page_captures = AsyncMock()
+    repository_mock.insert_screenshot_data = AsyncMock()
+    task_queue = MagicMock()
+    task_queue.enqueue = AsyncMock()
+    run_events = MagicMock()
+    run_events.publish = AsyncMock()
+
+    async def listen(run_id):
+        yield None
+        yield "1-0", "links", {"pages_total": 2}
+        yield "2-0", "page", {"index": 1, "status": "failed"}
+        yield "3-0", "page", {"index": 0, "status": "captured"}
+        raise AssertionError("listened after every page was reported")
+
+    run_events.listen = listen
+    crawler = Crawler(
+            repository=repository_mock, 
+            storage=LocalStorage(Path("/tmp"), shard_depth=0), 
+            logger=MagicMock(),
+            run_events=run_events,
+            task_queue=task_queue)
+    crawler._discover_links = AsyncMock(return_value=["https://example.com/about"])
+    crawler.take_screenshots = AsyncMock()
+
+    # Act
+    screenshots = await crawler.crawl_website("https://example.com/", 1, "test_run_id", capture=CaptureOptions(image_format=ImageFormat.JPEG))
+
+    # Assert
+    assert [call.args[:3] for call in task_queue.enqueue.await_args_list] == [
+        ("test_run_id", 0, "https://example.com/"),
+        ("test_run_id", 1, "https://example.com/about"),
+    ]
+    assert task_queue.enqueue.await_args.args[3]["image_format"] == "jpeg"
+    crawler.take_screenshots.assert_not_awaited()
+    assert screenshots == ["/tmp/test_run_id_screenshot_0.png"]
+    repository_mock.insert_screenshot_data.assert_awaited_once_with(
+        "test_run_id", "https://example.com/", screenshots, stored)
+    repository_mock.delete_page_captures.assert_awaited_once_with("test_run_id")
+
+
+@pytest.mark.asyncio
+async def test_pages_not_reported_before_the_events_end_are_failed():
+    # Arrange
+    repository_mock = MagicMock()
+    repository_mock.get_page_captures = AsyncMock(return_value=[])
+    repository_mock.delete_page_captures = AsyncMock()
+    task_queue = MagicMock()
+    task_queue.enqueue = AsyncMock(side_effect=["task-0", "task-1"])
+    task_queue.cancel = AsyncMock()
+    run_events = MagicMock()
+    run_events.publish = AsyncMock()
+
+    async def listen(run_id):
+        yield "1-0", "page", {"index": 0, "status": "captured"}
+        # The stream expired
+
+    run_events.listen = listen
+    crawler = Crawler(
+            repository=repository_mock, 
+            storage=LocalStorage(Path("/tmp"), shard_depth=0), 
+            logger=MagicMock(),
+            run_events=run_events,
+            task_queue=task_queue)
+    links = ["https://example.com/", "https://example.com/about"]
+
+    # Act
+    pages = await crawler._capture_on_workers(links, "test_run_id", {}, CaptureOptions())
+
+    # Assert
+    assert pages == []
+    task_queue.cancel.assert_awaited_once_with("test_run_id", ["task-0", "task-1"])
+    [failed] = [call.args[2] for call in run_events.publish.await_args_list if call.args[1] == RunEventType.PAGE]
+    assert failed["index"] == 1
+    assert failed["status"] == "failed"
+
+
+@pytest.mark.asyncio
+async def test_crawl_batch_shares_the_browser_and_isolates_failed_runs(tmp_path):
+    # Arrange
+    repository_mock = MagicMock()
+    repository_mock.insert_many_screenshot_data = AsyncMock(return_value=[])
+    crawler = Crawler(
+            repository=repository_mock, 
+            storage=LocalStorage(tmp_path, shard_depth=0), 
+            logger=MagicMock(),
+            max_concurrent_pages=2)
+    sessions_opened = 0
+
+    class Session:
+        async def __aenter__(self):
+            nonlocal sessions_opened
+            sessions_opened += 1
+            return MagicMock()
+
+        async def __aexit__(self, *args):
+            pass
+
+    crawler._browser_session = Session
+    async def discover_links(browser_session, frontier, *args):
+        if "broken" in frontier.start_url:
+            raise Exception("DNS failure")
+        return []
+
+    crawler._discover_links = AsyncMock(side_effect=discover_links)
+    open_pages = 0
+    max_open_pages = 0
+
+    async def take_screenshot(browser, url, capture):
+        nonlocal open_pages, max_open_pages
+        open_pages += 1
+        max_open_pages = max(max_open_pages, open_pages)
+        await asyncio.sleep(0.01)
+        open_pages -= 1
+        return b"png bytes"
+
+    crawler._take_screenshot = AsyncMock(side_effect=take_screenshot)
+    runs = [
+        {"start_url": f"https://site{i}.com/", "number_of_links": 0, "run_id": f"run_{i}"}
+        for i in range(4)
+    ] + [{"start_url": "https://broken.com/", "number_of_links": 0, "run_id": "run_broken"}]
+
+    # Act
+    results = await crawler.crawl_batch(runs)
+
+    # Assert
+    assert results[:4] == [[f"run_{i}_screenshot_0.png"] for i in range(4)]
+    assert str(results[4]) == "DNS failure"
+    assert sessions_opened == 1
+    assert max_open_pages == 2
+    [documents] = repository_mock.insert_many_screenshot_data.await_args.args
+    assert [document["run_id"] for document in documents] == [f"run_{i}" for i in range(4)]
@@ -0,0 +1,133 @@
+import mongomock
+import pytest
+from datetime import datetime, timedelta
+from pathlib import Path
+from unittest.mock import AsyncMock, MagicMock
+from fastapi import FastAPI
+from fastapi.testclient import TestClient
+from PIL import Image
+from controllers.files import router
+from dep_container import get_screenshot_files
+from repositories.screenshot_repository import AsyncScreenshotRepository
+from services.retention import RetentionCollector
+from services.image_processor import ImageProcessor
+from services.screenshot_files import ScreenshotFiles
+from services.storage import LocalStorage
+from utils.file_responses import RangeNotSatisfiable, parse_range
+
+
+@pytest.fixture
+def client(tmp_path):
+    Image.new("RGB", (800, 600), "red").save(tmp_path / "run_screenshot_0.png")
+    (tmp_path / "run_screenshot_1.png").write_bytes(bytes(range(100)))
+    screenshot_files = ScreenshotFiles(LocalStorage(tmp_path), ImageProcessor(workers=0), [320])
+    app = FastAPI()
+    app.include_router(router, prefix="/screenshots_folder")
+    app.dependency_overrides[get_screenshot_files] = lambda: screenshot_files
+    return TestClient(app)
+
+
+def test_parse_range():
+    assert parse_range(None, 100) is None
+    assert parse_range("bytes=10-19", 100) == (10, 19)
+    assert parse_range("bytes=90-", 100) == (90, 99)
+    assert parse_range("bytes=-10", 100) == (90, 99)
+    assert parse_range("bytes=50-500", 100) == (50, 99)
+    assert parse_range("bytes=0-1,5-6", 100) is None
+    assert parse_range("items=0-1", 100) is None
+    with pytest.raises(RangeNotSatisfiable):
+        parse_range("bytes=100-", 100)
+
+
+def test_file_is_served_immutable_and_revalidated_with_its_etag(client):
+    # Act
+    response = client.get("/screenshots_folder/run_screenshot_1.png")
+    revalidated = client.get(
+        "/screenshots_folder/run_screenshot_1.png", headers={"If-None-Match": response.headers["etag"]}
+    )
+
+    # Assert
+    assert response.status_code == 200
+    assert response.content == bytes(range(100))
+    assert response.headers["content-type"] == "image/png"
+    assert "immutable" in response.headers["cache-control"]
+    assert response.headers["accept-ranges"] == "bytes"
+    assert revalidated.status_code == 304
+    assert revalidated.content == b""
+    assert revalidated.headers["etag"] == response.headers["etag"]
+
+
+def test_range_requests_get_the_asked_bytes(client):
+    # Act
+    partial = client.get("/screenshots_folder/run_screenshot_1.png", headers={"Range": "bytes=10-19"})
+    stale = client.get(
+        "/screenshots_folder/run_screenshot_1.png", headers={"Range": "bytes=10-19", "If-Range": '"old"'}
+    )
+    past_the_end = client.get("/screenshots_folder/run_screenshot_1.png", headers={"Range": "bytes=200-"})
+
+    # Assert
+    assert partial.status_code == 206
+    assert partial.content == bytes(range(10, 20))
+    assert partial.headers["content-range"] == "bytes 10-19/100"
+    assert partial.headers["content-length"] == "10"
+    assert stale.status_code == 200
+    assert len(stale.content) == 100
+    assert past_the_end.status_code == 416
+    assert past_the_end.headers["content-range"] == "bytes */100"
+
+
+def test_resized_copy_is_made_once_and_cached(client, tmp_path):
+    # Act
+    first = client.get("/screenshots_folder/run_screenshot_0.png", params={"width": 320})
+    second = client.get("/screenshots_folder/run_screenshot_0.png", params={"width": 320})
+    not_offered = client.get("/screenshots_folder/run_screenshot_0.png", params={"width": 321})
+
+    # Assert
+    variant = tmp_path / ".variants" / "run_screenshot_0_w320.png"
+    assert first.status_code == 200
+    assert Image.open(variant).size == (320, 240)
+    assert first.headers["etag"] == second.headers["etag"]
+    assert not_offered.status_code == 400
+
+
+def test_paths_out_of_the_folder_are_not_served(client):
+    # Act
+    missing = client.get("/screenshots_folder/nothing.png")
+    outside = client.get("/screenshots_folder/..%2F..%2Fetc%2Fpasswd")
+
+    # Assert
+    assert missing.status_code == 404
+    assert outside.status_code == 404
+
+
+@pytest.mark.asyncio
+async def test_runs_stored_before_the_keys_are_served_and_deleted(tmp_path, monkeypatch):
+    # Arrange
+    # Their paths start with the folder, as configured
+    monkeypatch.chdir(tmp_path)
+    (tmp_path / "screenshots_folder").mkdir()
+    (tmp_path / "screenshots_folder" / "old_screenshot_0.png").write_bytes(b"old png")
+    storage = LocalStorage(Path("screenshots_folder"))
+    repository = AsyncScreenshotRepository(mongomock.MongoClient()['screenshots_db'])
+    repository.collection.insert_one({
+        "_id": "old",
+        "start_url": "https://example.com/",
+        "screenshots": ["screenshots_folder/old_screenshot_0.png"],
+        "timestamp": datetime.now() - timedelta(days=10),
+    })
+    app = FastAPI()
+    app.include_router(router, prefix="/screenshots_folder")
+    app.dependency_overrides[get_screenshot_files] = lambda: ScreenshotFiles(storage, ImageProcessor(workers=0), [320])
+    client = TestClient(app)
+    collector = RetentionCollector(repository, storage, AsyncMock(), MagicMock(), max_age_seconds=86400)
+
+    # Act
+    served = client.get("/screenshots_folder/screenshots_folder/old_screenshot_0.png")
+    size = await storage.size("screenshots_folder/old_screenshot_0.png")
+    removed = await collector.collect()
+
+    # Assert
+    assert served.content == b"old png"
+    assert size == len(b"old png")
+    assert removed == 1
+    assert not (tmp_path / "screenshots_folder" / "old_screenshot_0.png").exists()
@@ -0,0 +1,83 @@
+from utils.frontier import BloomFilter, CrawlFrontier
+
+
+def test_bloom_filter_remembers_added_items():
+    # Arrange
+    seen = BloomFilter(capacity=1000, error_rate=0.01)
+
+    # Act
+    first = seen.add("https://example.com/")
+    second = seen.add("https://example.com/")
+
+    # Assert
+    assert first is True
+    assert second is False
+    assert "https://example.com/" in seen
+    assert len(seen) == 1
+
+
+def test_bloom_filter_false_positive_rate_stays_low():
+    # Arrange
+    seen = BloomFilter(capacity=10_000, error_rate=0.01)
+    for i in range(10_000):
+        seen.add(f"https://example.com/page/{i}")
+
+    # Act
+    false_positives = sum(f"https://example.org/other/{i}" in seen for i in range(10_000))
+
+    # Assert
+    assert false_positives < 300
+
+
+def test_frontier_skips_duplicates_fragments_and_non_http_links():
+    # Arrange
+    frontier = CrawlFrontier("https://example.com/")
+
+    # Act
+    pushed = [
+        frontier.push(url, 1) for url in [
+            "https://example.com/",
+            "https://example.com/about",
+            "https://example.com/about#team",
+            "mailto:contact@example.com",
+            "javascript:void(0)",
+            "https://other.com/",
+        ]
+    ]
+
+    # Assert
+    assert pushed == [None, "https://example.com/about", None, None, None, "https://other.com/"]
+
+
+def test_frontier_same_origin_scope():
+    # Arrange
+    frontier = CrawlFrontier("https://example.com/", same_origin=True)
+
+    # Act & Assert
+    assert frontier.in_scope("https://example.com/about")
+    assert not frontier.in_scope("http://example.com/about")
+    assert not frontier.in_scope("https://blog.example.com/")
+
+
+def test_frontier_allowed_domains_scope():
+    # Arrange
+    frontier = CrawlFrontier("https://example.com/", allowed_domains=["partner.org"])
+
+    # Act & Assert
+    assert frontier.in_scope("https://example.com/about")
+    assert frontier.in_scope("https://www.partner.org/")
+    assert not frontier.in_scope("https://notpartner.org/")
+
+
+def test_frontier_only_queues_pages_above_max_depth():
+    # Arrange
+    frontier = CrawlFrontier("https://example.com/", max_depth=2)
+
+    # Act
+    frontier.push("https://example.com/depth1", 1)
+    frontier.push("https://example.com/depth2", 2)
+
+    # Assert
+    assert frontier.pop() == ("https://example.com/", 0)
+    assert frontier.pop() == ("https://example.com/depth1", 1)
+    assert frontier.pop() is None
@@ -0,0 +1,91 @@
+import io
+import pytest
+from PIL import Image
+from pydantic import ValidationError
+from models.capture_options import CaptureOptions, CaptureProfile, ClipRegion, ImageFormat
+from services.image_processor import ImageProcessor
+from utils.image_processing import fingerprint, hash_distance, thumbnail_path
+
+
+def make_png(width: int = 400, height: int = 200) -> bytes:
+    buffer = io.BytesIO()
+    Image.new("RGBA", (width, height), (255, 0, 0, 255)).save(buffer, "PNG")
+    return buffer.getvalue()
+
+
+def test_capture_options_reject_incompatible_settings():
+    with pytest.raises(ValidationError):
+        CaptureOptions(image_format=ImageFormat.PNG, quality=80)
+    with pytest.raises(ValidationError):
+        CaptureOptions(full_page=True, clip=ClipRegion(x=0, y=0, width=10, height=10))
+
+
+def test_cache_settings_only_hold_what_changes_the_image():
+    # Arrange
+    profile = CaptureProfile(navigation_timeout_ms=5000, screenshot_timeout_ms=5000)
+
+    # Act
+    plain = CaptureOptions().cache_settings()
+    other_budgets = CaptureOptions(thumbnail_width=320, profile=profile).cache_settings()
+    other_format = CaptureOptions(image_format=ImageFormat.JPEG).cache_settings()
+
+    # Assert
+    assert other_budgets == plain
+    assert other_format != plain
+
+
+def test_thumbnail_path():
+    assert thumbnail_path("ab/cd/run_screenshot_0.webp", 320) == "ab/cd/run_screenshot_0_thumb_w320.webp"
+
+
+@pytest.mark.asyncio
+@pytest.mark.parametrize("workers", [0, 1])
+async def test_encode_returns_webp(workers):
+    # Arrange
+    image_processor = ImageProcessor(workers=workers)
+
+    # Act
+    result = await image_processor.encode(make_png(), "webp", 60)
+    image_processor.close()
+
+    # Assert
+    with Image.open(io.BytesIO(result)) as image:
+        assert image.format == "WEBP"
+
+
+@pytest.mark.asyncio
+async def test_thumbnail_keeps_aspect_ratio():
+    # Arrange
+    image_processor = ImageProcessor(workers=0)
+    source = await image_processor.encode(make_png(400, 200), "jpeg", 80)
+
+    # Act
+    result = await image_processor.thumbnail(source, 100, "jpeg", 80)
+
+    # Assert
+    with Image.open(io.BytesIO(result)) as image:
+        assert image.format == "JPEG"
+        assert image.size == (100, 50)
+
+
+def test_fingerprint_tells_identical_similar_and_different_images_apart():
+    # Arrange
+    def striped(color) -> bytes:
+        image = Image.new("RGB", (400, 200), (255, 255, 255))
+        for x in range(0, 400, 100):
+            image.paste(color, (x, 0, x + 50, 200))
+        buffer = io.BytesIO()
+        image.save(buffer, "PNG")
+        return buffer.getvalue()
+
+    # Act
+    original = fingerprint(striped((0, 0, 0)))
+    same = fingerprint(striped((0, 0, 0)))
+    similar = fingerprint(striped((10, 10, 10)))
+    different = fingerprint(make_png())
+
+    # Assert
+    assert same == original
+    assert similar[0] != original[0]
+    assert hash_distance(similar[1], original[1]) == 0
+    assert hash_distance(different[1], original[1]) > 10
@@ -0,0 +1,231 @@
+import asyncio
+import fakeredis
+import pytest
+from unittest.mock import AsyncMock, MagicMock
+from services.jobs import JobQueueFull, JobRunner, JobStatus, JobTracker
+
+
+def make_tracker_mock():
+    tracker = MagicMock(spec=JobTracker)
+    tracker.create = AsyncMock()
+    tracker.set_status = AsyncMock()
+    tracker.keep_alive = AsyncMock()
+    tracker.forget = AsyncMock()
+    tracker.abandoned = AsyncMock(return_value=[])
+    return tracker
+
+
+@pytest.mark.asyncio
+async def test_run_records_running_and_done():
+    # Arrange
+    tracker = make_tracker_mock()
+    runner = JobRunner(tracker, MagicMock())
+    job = AsyncMock(return_value=["screenshot_0.png"])
+
+    # Act
+    result = await runner.run("test_run_id", job)
+
+    # Assert
+    assert result == ["screenshot_0.png"]
+    assert [call.args for call in tracker.set_status.call_args_list] == [
+        ("test_run_id", JobStatus.RUNNING),
+        ("test_run_id", JobStatus.DONE),
+    ]
+
+
+@pytest.mark.asyncio
+async def test_run_records_failure():
+    # Arrange
+    tracker = make_tracker_mock()
+    runner = JobRunner(tracker, MagicMock())
+    job = AsyncMock(side_effect=Exception("Browser crashed"))
+
+    # Act & Assert
+    with pytest.raises(Exception):
+        await runner.run("test_run_id", job)
+    tracker.set_status.assert_called_with("test_run_id", JobStatus.FAILED, error="Browser crashed")
+
+
+@pytest.mark.asyncio
+async def test_submit_runs_job_in_background():
+    # Arrange
+    tracker = make_tracker_mock()
+    runner = JobRunner(tracker, MagicMock(), workers=1)
+    finished = asyncio.Event()
+
+    async def job():
+        finished.set()
+
+    # Act
+    await runner.submit("test_run_id", job)
+    await asyncio.wait_for(finished.wait(), timeout=1)
+    await runner.close()
+
+    # Assert
+    tracker.create.assert_called_once_with("test_run_id", JobStatus.QUEUED)
+    assert not runner.started
+
+
+@pytest.mark.asyncio
+async def test_tracker_writes_state_with_expiry():
+    # Arrange
+    pipe = MagicMock()
+    pipe.execute = AsyncMock()
+    cache_client = MagicMock()
+    cache_client.pipeline.return_value.__aenter__.return_value = pipe
+    tracker = JobTracker(cache_client, ttl_seconds=60)
+
+    # Act
+    await tracker.page_done("test_run_id")
+
+    # Assert
+    cache_client.pipeline.assert_called_once_with(transaction=True)
+    pipe.hincrby.assert_called_once_with("job:test_run_id", "pages_done", 1)
+    pipe.expire.assert_called_once_with("job:test_run_id", 60)
+    pipe.execute.assert_awaited_once()
+
+
+@pytest.mark.asyncio
+async def test_run_batch_records_every_run_on_its_own():
+    # Arrange
+    tracker = make_tracker_mock()
+    runner = JobRunner(tracker, MagicMock())
+    job = AsyncMock(return_value=[["shot_0.png"], Exception("Navigation failed")])
+
+    # Act
+    results = await runner.run_batch(["run_a", "run_b"], job)
+
+    # Assert
+    assert results[0] == ["shot_0.png"]
+    tracker.set_status.assert_any_call("run_a", JobStatus.DONE)
+    tracker.set_status.assert_any_call("run_b", JobStatus.FAILED, error="Navigation failed")
+
+
+@pytest.mark.asyncio
+async def test_submit_batch_queues_every_run():
+    # Arrange
+    tracker = make_tracker_mock()
+    runner = JobRunner(tracker, MagicMock(), workers=1)
+    job = AsyncMock(side_effect=Exception("Browser crashed"))
+
+    # Act
+    await runner.submit_batch(["run_a", "run_b"], job)
+    await runner.join()
+    await runner.close()
+
+    # Assert
+    tracker.create.assert_any_call("run_a", JobStatus.QUEUED)
+    tracker.create.assert_any_call("run_b", JobStatus.QUEUED)
+    tracker.set_status.assert_any_call("run_a", JobStatus.FAILED, error="Browser crashed")
+    tracker.set_status.assert_any_call("run_b", JobStatus.FAILED, error="Browser crashed")
+
+
+@pytest.mark.asyncio
+async def test_run_returns_the_result_when_the_state_can_not_be_recorded():
+    # Arrange
+    tracker = make_tracker_mock()
+    tracker.set_status.side_effect = [None, ConnectionError("Redis is down")]
+    runner = JobRunner(tracker, MagicMock())
+    job = AsyncMock(return_value=["screenshot_0.png"])
+
+    # Act
+    result = await runner.run("test_run_id", job)
+
+    # Assert
+    assert result == ["screenshot_0.png"]
+    runner.logger.warn.assert_called_once()
+
+
+@pytest.mark.asyncio
+async def test_submit_refuses_jobs_beyond_the_queue_bound():
+    # Arrange
+    tracker = make_tracker_mock()
+    runner = JobRunner(tracker, MagicMock(), workers=1, max_queued=1)
+    started, release = asyncio.Event(), asyncio.Event()
+
+    async def job():
+        started.set()
+        await release.wait()
+
+    await runner.submit("running", job)
+    await started.wait()
+    await runner.submit("queued", job)
+
+    # Act & Assert
+    with pytest.raises(JobQueueFull):
+        await runner.submit("refused", job)
+    release.set()
+    await runner.join()
+    await runner.close()
+    assert "refused" not in [call.args[0] for call in tracker.create.call_args_list]
+
+
+@pytest.mark.asyncio
+async def test_close_fails_the_jobs_left():
+    # Arrange
+    tracker = make_tracker_mock()
+    runner = JobRunner(tracker, MagicMock(), workers=1)
+    started = asyncio.Event()
+
+    async def job():
+        started.set()
+        await asyncio.Event().wait()
+
+    await runner.submit("running", job)
+    await runner.submit("queued", job)
+    await started.wait()
+
+    # Act
+    await runner.close()
+
+    # Assert
+    failed = sorted(call.args[0] for call in tracker.set_status.call_args_list if call.args[1] == JobStatus.FAILED)
+    assert failed == ["queued", "running"]
+    assert sorted(call.args[0] for call in tracker.forget.call_args_list) == ["queued", "running"]
+
+
+@pytest.mark.asyncio
+async def test_jobs_of_a_stopped_process_are_failed_by_another():
+    # Arrange
+    cache_client = fakeredis.FakeAsyncRedis(decode_responses=True)
+    tracker = JobTracker(cache_client)
+    await tracker.create("abandoned", JobStatus.RUNNING)
+    await tracker.create("finished", JobStatus.DONE)
+    # Their process stopped vouching for them
+    await tracker.keep_alive(["abandoned", "finished"], -1)
+    runner = JobRunner(tracker, MagicMock(), heartbeat_seconds=60)
+
+    async def failed():
+        while (await tracker.get("abandoned"))["status"] != JobStatus.FAILED.value:
+            await asyncio.sleep(0.01)
+
+    # Act
+    await runner.start()
+    await asyncio.wait_for(failed(), timeout=1)
+    await asyncio.sleep(0.05)
+    await runner.close()
+
+    # Assert
+    assert (await tracker.get("finished"))["status"] == JobStatus.DONE.value
+    assert await tracker.abandoned() == []
+
+
+@pytest.mark.asyncio
+async def test_worker_logs_the_errors_of_the_jobs():
+    # Arrange
+    tracker = make_tracker_mock()
+    runner = JobRunner(tracker, MagicMock(), workers=1)
+    finished = asyncio.Event()
+
+    async def task():
+        finished.set()
+        raise ConnectionError("Redis is down")
+
+    # Act
+    await runner._enqueue([], task)
+    await asyncio.wait_for(finished.wait(), timeout=1)
+    await runner.join()
+    await runner.close()
+
+    # Assert
+    assert "Redis is down" in runner.logger.error.call_args.args[0]
@@ -0,0 +1,72 @@
+import httpx
+import pytest
+from services.link_extractor import HttpLinkExtractor
+
+
+def make_extractor(handler) -> HttpLinkExtractor:
+    http_client = httpx.AsyncClient(transport=httpx.MockTransport(handler), follow_redirects=True)
+    return HttpLinkExtractor(http_client)
+
+
+def test_parse_links_resolves_relative_hrefs_against_base():
+    # Arrange
+    html = """
+        <html><head><base href="https://cdn.example.com/docs/"></head>
+        <body>
+            <a href="intro">Intro</a>
+            <a href="/about">About</a>
+            <a href="https://other.com/">Other</a>
+            <a>No href</a>
+        </body></html>
+    """
+
+    # Act
+    links = HttpLinkExtractor.parse_links(html, "https://example.com/")
+
+    # Assert
+    assert links == [
+        "https://cdn.example.com/docs/intro",
+        "https://cdn.example.com/about",
+        "https://other.com/",
+    ]
+
+
+@pytest.mark.asyncio
+async def test_extract_fetches_html_links():
+    # Arrange
+    def handler(request: httpx.Request) -> httpx.Response:
+        return httpx.Response(
+            200, 
+            headers={"content-type": "text/html; charset=utf-8"}, 
+            text='<a href="/a">A</a><a href="b">B</a>'
+        )
+    extractor = make_extractor(handler)
+
+    # Act
+    links = await extractor.extract("https://example.com/dir/")
+
+    # Assert
+    assert links == ["https://example.com/a", "https://example.com/dir/b"]
+
+
+@pytest.mark.asyncio
+async def test_extract_ignores_non_html_responses():
+    # Arrange
+    extractor = make_extractor(lambda request: httpx.Response(
+        200, headers={"content-type": "application/pdf"}, content=b"%PDF"))
+
+    # Act
+    links = await extractor.extract("https://example.com/file.pdf")
+
+    # Assert
+    assert links is None
+
+
+@pytest.mark.asyncio
+async def test_extract_raises_http_errors():
+    # Arrange
+    extractor = make_extractor(lambda request: httpx.Response(503))
+
+    # Act & Assert
+    with pytest.raises(httpx.HTTPStatusError):
+        await extractor.extract("https://example.com/")
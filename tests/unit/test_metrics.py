@@ -0,0 +1,74 @@
+import pytest
+from fastapi import FastAPI, HTTPException
+from fastapi.testclient import TestClient
+from prometheus_client import REGISTRY
+from unittest.mock import AsyncMock, MagicMock
+from middlewares.prometheus_middleware import prometheus_middleware
+from utils.context_managers import PageContextManager
+from utils.metrics import Stage, time_stage
+
+
+def sample(name: str, labels: dict) -> float:
+    return REGISTRY.get_sample_value(name, labels) or 0
+
+
+def test_middleware_counts_requests_by_route_template_and_status():
+    # Arrange
+    app = FastAPI()
+    app.middleware("http")(prometheus_middleware)
+
+    @app.get("/items/{item_id}")
+    async def get_item(item_id: str):
+        if item_id == "missing":
+            raise HTTPException(status_code=404)
+        return {"item_id": item_id}
+
+    client = TestClient(app)
+    ok_labels = {"method": "GET", "route": "/items/{item_id}", "status": "200"}
+    missing_labels = {"method": "GET", "route": "/items/{item_id}", "status": "404"}
+    ok_before = sample("request_count_total", ok_labels)
+    missing_before = sample("request_count_total", missing_labels)
+
+    # Act
+    client.get("/items/1")
+    client.get("/items/2")
+    client.get("/items/missing")
+    client.get("/nowhere")
+
+    # Assert
+    assert sample("request_count_total", ok_labels) == ok_before + 2
+    assert sample("request_count_total", missing_labels) == missing_before + 1
+    assert sample("request_count_total", {"method": "GET", "route": "unmatched", "status": "404"}) >= 1
+    assert sample("request_latency_seconds_count", {"method": "GET", "route": "/items/{item_id}"}) >= 3
+
+
+@pytest.mark.asyncio
+async def test_page_context_manager_tracks_open_pages_and_creation_time():
+    # Arrange
+    browser = MagicMock()
+    browser.newPage = AsyncMock(return_value=AsyncMock())
+    open_before = sample("browser_open_pages", {})
+    created_before = sample("crawl_stage_seconds_count", {"stage": "page_create"})
+
+    # Act
+    async with PageContextManager(browser):
+        open_inside = sample("browser_open_pages", {})
+
+    # Assert
+    assert open_inside == open_before + 1
+    assert sample("browser_open_pages", {}) == open_before
+    assert sample("crawl_stage_seconds_count", {"stage": "page_create"}) == created_before + 1
+
+
+@pytest.mark.asyncio
+async def test_time_stage_observes_failed_stages_too():
+    # Arrange
+    before = sample("crawl_stage_seconds_count", {"stage": "goto"})
+
+    # Act
+    with pytest.raises(TimeoutError):
+        with time_stage(Stage.GOTO):
+            raise TimeoutError()
+
+    # Assert
+    assert sample("crawl_stage_seconds_count", {"stage": "goto"}) == before + 1
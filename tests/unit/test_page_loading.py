@@ -0,0 +1,64 @@
+import asyncio
+import pytest
+from unittest.mock import AsyncMock, MagicMock
+from models.capture_options import CAPTURE_PROFILES, CaptureProfile, ResourceType, WaitUntil
+from utils.page_loading import load_page, navigation_options
+
+
+def make_request_mock(resource_type: str, url: str):
+    request = MagicMock(resourceType=resource_type, url=url)
+    request.abort = AsyncMock()
+    request.continue_ = AsyncMock()
+    return request
+
+
+def test_navigation_options_only_override_pyppeteer_defaults():
+    assert navigation_options(CaptureProfile()) == {}
+    assert navigation_options(CAPTURE_PROFILES["fast"]) == {"waitUntil": "domcontentloaded", "timeout": 15000}
+
+
+@pytest.mark.asyncio
+async def test_load_page_blocks_resource_types_and_url_patterns():
+    # Arrange
+    page = MagicMock()
+    page.setRequestInterception = AsyncMock()
+    page.goto = AsyncMock()
+    profile = CaptureProfile(
+        blocked_resource_types=[ResourceType.FONT],
+        blocked_url_patterns=["*tracker.com*"],
+    )
+    requests = [
+        make_request_mock("document", "https://tracker.com/"),
+        make_request_mock("font", "https://example.com/font.woff2"),
+        make_request_mock("script", "https://cdn.tracker.com/t.js"),
+        make_request_mock("image", "https://example.com/logo.png"),
+    ]
+
+    # Act
+    await load_page(page, "https://example.com/", profile)
+    on_request = page.on.call_args.args[1]
+    for request in requests:
+        on_request(request)
+    await asyncio.sleep(0)
+
+    # Assert
+    page.setRequestInterception.assert_awaited_once_with(True)
+    assert [request.abort.await_count for request in requests] == [0, 1, 1, 0]
+    assert [request.continue_.await_count for request in requests] == [1, 0, 0, 1]
+
+
+@pytest.mark.asyncio
+async def test_load_page_waits_for_selector():
+    # Arrange
+    page = MagicMock()
+    page.goto = AsyncMock()
+    page.waitForSelector = AsyncMock()
+    profile = CaptureProfile(wait_until=WaitUntil.NETWORKIDLE2, wait_for_selector="#content")
+
+    # Act
+    await load_page(page, "https://example.com/", profile)
+
+    # Assert
+    page.setRequestInterception.assert_not_called()
+    page.goto.assert_awaited_once_with("https://example.com/", waitUntil="networkidle2")
+    page.waitForSelector.assert_awaited_once_with("#content", timeout=30000)
@@ -0,0 +1,240 @@
+import asyncio
+import time
+import fakeredis
+import httpx
+import pytest
+from unittest.mock import MagicMock
+from services.politeness import PolitenessScheduler, RobotsCache, interleave_by_host
+
+
+def make_robots_cache(handler, **kwargs) -> RobotsCache:
+    http_client = httpx.AsyncClient(transport=httpx.MockTransport(handler))
+    return RobotsCache(http_client, MagicMock(), **kwargs)
+
+
+def test_interleave_by_host_alternates_hosts_in_first_seen_order():
+    # Arrange
+    links = [
+        "https://a.com/1",
+        "https://a.com/2",
+        "https://a.com/3",
+        "https://b.com/1",
+        "https://c.com/1",
+        "https://b.com/2",
+    ]
+
+    # Act
+    order = interleave_by_host(links)
+
+    # Assert
+    assert [links[i] for i in order] == [
+        "https://a.com/1",
+        "https://b.com/1",
+        "https://c.com/1",
+        "https://a.com/2",
+        "https://b.com/2",
+        "https://a.com/3",
+    ]
+
+
+@pytest.mark.asyncio
+async def test_slot_caps_pages_open_on_one_host():
+    # Arrange
+    scheduler = PolitenessScheduler(max_per_host=2, min_interval_seconds=0)
+    open_pages = {"a.com": 0, "b.com": 0}
+    max_open_pages = {"a.com": 0, "b.com": 0}
+
+    async def visit(url: str):
+        host = url.split("/")[2]
+        async with scheduler.slot(url):
+            open_pages[host] += 1
+            max_open_pages[host] = max(max_open_pages[host], open_pages[host])
+            await asyncio.sleep(0.01)
+            open_pages[host] -= 1
+
+    # Act
+    await asyncio.gather(*(visit(f"https://{host}/{i}") for i in range(5) for host in ("a.com", "b.com")))
+
+    # Assert
+    assert max_open_pages == {"a.com": 2, "b.com": 2}
+
+
+@pytest.mark.asyncio
+async def test_slot_spaces_page_loads_on_one_host_only():
+    # Arrange
+    scheduler = PolitenessScheduler(max_per_host=10, min_interval_seconds=0.05)
+    starts = {}
+
+    async def visit(url: str):
+        async with scheduler.slot(url):
+            starts[url] = time.monotonic()
+
+    # Act
+    begin = time.monotonic()
+    await asyncio.gather(*(visit(url) for url in ("https://a.com/1", "https://a.com/2", "https://a.com/3", "https://b.com/1")))
+
+    # Assert
+    assert starts["https://b.com/1"] - begin < 0.04
+    a_starts = sorted(starts[f"https://a.com/{i}"] for i in (1, 2, 3))
+    assert a_starts[1] - a_starts[0] >= 0.045
+    assert a_starts[2] - a_starts[1] >= 0.045
+
+
+@pytest.mark.asyncio
+async def test_slots_and_spacing_hold_over_the_processes_sharing_redis():
+    # Arrange
+    server = fakeredis.FakeServer()
+    schedulers = [
+        PolitenessScheduler(
+            max_per_host=1,
+            min_interval_seconds=0.05,
+            cache_client=fakeredis.FakeAsyncRedis(server=server, decode_responses=True),
+            poll_seconds=0.01
+        )
+        for _ in range(2)
+    ]
+    open_pages = 0
+    max_open_pages = 0
+    starts = []
+
+    async def visit(scheduler: PolitenessScheduler, i: int):
+        nonlocal open_pages, max_open_pages
+        async with scheduler.slot(f"https://a.com/{i}"):
+            starts.append(time.monotonic())
+            open_pages += 1
+            max_open_pages = max(max_open_pages, open_pages)
+            await asyncio.sleep(0.01)
+            open_pages -= 1
+
+    # Act
+    await asyncio.gather(*(visit(schedulers[i % 2], i) for i in range(4)))
+
+    # Assert
+    assert max_open_pages == 1
+    starts.sort()
+    assert all(later - earlier >= 0.045 for earlier, later in zip(starts, starts[1:]))
+
+
+@pytest.mark.asyncio
+async def test_a_slot_held_longer_than_its_lease_is_renewed():
+    # Arrange
+    server = fakeredis.FakeServer()
+    holder, other = [
+        PolitenessScheduler(
+            max_per_host=1,
+            min_interval_seconds=0,
+            cache_client=fakeredis.FakeAsyncRedis(server=server, decode_responses=True),
+            slot_lease_seconds=0.3,
+            poll_seconds=0.01
+        )
+        for _ in range(2)
+    ]
+    events = []
+
+    async def hold():
+        async with holder.slot("https://a.com/slow"):
+            events.append("holder opened")
+            await asyncio.sleep(0.7)
+            events.append("holder closed")
+
+    async def wait_for_slot():
+        await asyncio.sleep(0.05)
+        async with other.slot("https://a.com/other"):
+            events.append("other opened")
+
+    # Act
+    await asyncio.gather(hold(), wait_for_slot())
+
+    # Assert
+    assert events == ["holder opened", "holder closed", "other opened"]
+
+
+@pytest.mark.asyncio
+async def test_robots_cache_shares_the_fetched_files_through_redis():
+    # Arrange
+    fetched = []
+
+    def handler(request: httpx.Request) -> httpx.Response:
+        fetched.append(str(request.url))
+        return httpx.Response(200, text="User-agent: *\nDisallow: /private")
+
+    server = fakeredis.FakeServer()
+    caches = [
+        make_robots_cache(handler, cache_client=fakeredis.FakeAsyncRedis(server=server, decode_responses=True))
+        for _ in range(2)
+    ]
+
+    # Act
+    first = await caches[0].allowed("https://example.com/private/a")
+    second = await caches[1].allowed("https://example.com/private/b")
+    public = await caches[1].allowed("https://example.com/public")
+
+    # Assert
+    assert (first, second, public) == (False, False, True)
+    assert fetched == ["https://example.com/robots.txt"]
+
+
+@pytest.mark.asyncio
+async def test_robots_cache_applies_rules_and_fetches_once_per_origin():
+    # Arrange
+    fetches = []
+
+    def handler(request: httpx.Request) -> httpx.Response:
+        fetches.append(str(request.url))
+        return httpx.Response(200, text="User-agent: *\nDisallow: /private\n")
+
+    robots = make_robots_cache(handler)
+
+    # Act
+    results = await asyncio.gather(
+        robots.allowed("https://example.com/"),
+        robots.allowed("https://example.com/private/page"),
+        robots.allowed("https://example.com/public"),
+    )
+
+    # Assert
+    assert results == [True, False, True]
+    assert fetches == ["https://example.com/robots.txt"]
+
+
+@pytest.mark.asyncio
+async def test_robots_cache_fetches_again_after_ttl():
+    # Arrange
+    fetches = []
+
+    def handler(request: httpx.Request) -> httpx.Response:
+        fetches.append(str(request.url))
+        return httpx.Response(404)
+
+    robots = make_robots_cache(handler, ttl_seconds=0)
+
+    # Act
+    first = await robots.allowed("https://example.com/page")
+    second = await robots.allowed("https://example.com/page")
+
+    # Assert
+    assert first and second
+    assert len(fetches) == 2
+
+
+@pytest.mark.asyncio
+async def test_robots_cache_status_codes():
+    # Arrange
+    statuses = {"forbidden.com": 403, "missing.com": 404}
+
+    def handler(request: httpx.Request) -> httpx.Response:
+        if request.url.host == "down.com":
+            raise httpx.ConnectError("unreachable")
+        return httpx.Response(statuses[request.url.host])
+
+    robots = make_robots_cache(handler)
+
+    # Act
+    forbidden = await robots.allowed("https://forbidden.com/page")
+    missing = await robots.allowed("https://missing.com/page")
+    down = await robots.allowed("https://down.com/page")
+
+    # Assert
+    assert not forbidden
+    assert missing
+    assert down
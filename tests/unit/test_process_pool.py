@@ -0,0 +1,166 @@
+import asyncio
+import os
+import time
+import pytest
+from contextlib import asynccontextmanager
+from pathlib import Path
+from unittest.mock import MagicMock
+from services.crawler import Crawler
+from services.process_pool import CrawlProcessError, CrawlProcessPool
+from services.storage import LocalStorage
+from utils.metrics import STAGE_LATENCY, Stage, metrics_registry, time_stage
+
+
+class BusyCrawler:
+    async def crawl_website(self, start_url, number_of_links, run_id, **kwargs):
+        if start_url == "https://crash.example.com/":
+            os._exit(3)
+        if start_url == "https://fail.example.com/":
+            raise Exception("Navigation failed")
+        # CPU bound, like decoding and encoding the screenshots
+        with time_stage(Stage.IMAGE_ENCODE):
+            deadline = time.monotonic() + 0.3
+            while time.monotonic() < deadline:
+                pass
+        return [f"{run_id}_{os.getpid()}.png"]
+
+    async def crawl_batch(self, runs):
+        return [TimeoutError("Timeout") if run["start_url"] == "https://fail.example.com/" else [run["run_id"]] for run in runs]
+
+
+@asynccontextmanager
+async def busy_crawler():
+    yield BusyCrawler()
+
+
+@asynccontextmanager
+async def crashing_crawler():
+    # Like a process whose browser can not launch
+    os._exit(4)
+    yield
+
+
+async def measure_lag(stop: asyncio.Event) -> float:
+    lag = 0
+    while not stop.is_set():
+        started = time.monotonic()
+        await asyncio.sleep(0.01)
+        lag = max(lag, time.monotonic() - started - 0.01)
+    return lag
+
+
+@pytest.mark.asyncio
+async def test_crawls_run_in_the_processes_without_blocking_the_loop():
+    # Arrange
+    pool = CrawlProcessPool(busy_crawler, MagicMock(), processes=2, crawls_per_process=1)
+    crawler = Crawler(repository=MagicMock(), storage=LocalStorage(Path("/tmp"), shard_depth=0), logger=MagicMock(), process_pool=pool)
+    pool.start()
+
+    try:
+        # Act
+        await crawler.crawl_website("https://example.com/", 0, "warm_up")
+        stop = asyncio.Event()
+        lag = asyncio.create_task(measure_lag(stop))
+        screenshots = await asyncio.gather(
+            *(crawler.crawl_website("https://example.com/", 0, f"run_{i}") for i in range(4))
+        )
+        stop.set()
+        with pytest.raises(CrawlProcessError, match="Navigation failed"):
+            await crawler.crawl_website("https://fail.example.com/", 0, "failed_run")
+        batch = await crawler.crawl_batch([
+            {"start_url": "https://example.com/", "number_of_links": 0, "run_id": "batch_0"},
+            {"start_url": "https://fail.example.com/", "number_of_links": 0, "run_id": "batch_1"},
+        ])
+    finally:
+        await pool.close()
+
+    # Assert
+    assert [paths[0].split("_")[1] for paths in screenshots] == ["0", "1", "2", "3"]
+    assert len({paths[0] for paths in screenshots}) == 4
+    assert len({paths[0].rsplit("_", 1)[1] for paths in screenshots}) == 2
+    # Four crawls of 0.3 seconds of CPU ran while the loop kept ticking
+    assert await lag < 0.2
+    assert batch[0] == ["batch_0"]
+    assert isinstance(batch[1], CrawlProcessError) and str(batch[1]) == "Timeout"
+
+
+@pytest.mark.asyncio
+async def test_a_dead_process_fails_its_crawls_and_is_started_again():
+    # Arrange
+    pool = CrawlProcessPool(busy_crawler, MagicMock(), processes=1)
+    pool.start()
+
+    try:
+        # Act
+        with pytest.raises(CrawlProcessError, match="exited with code 3"):
+            await asyncio.wait_for(
+                pool.run("crawl_website", {"start_url": "https://crash.example.com/", "number_of_links": 0, "run_id": "crashed"}),
+                30
+            )
+        screenshots = await asyncio.wait_for(
+            pool.run("crawl_website", {"start_url": "https://example.com/", "number_of_links": 0, "run_id": "next"}),
+            30
+        )
+    finally:
+        await pool.close()
+
+    # Assert
+    assert screenshots[0].startswith("next_")
+
+
+@pytest.mark.asyncio
+async def test_a_process_dying_as_it_starts_is_restarted_later_then_given_up():
+    # Arrange
+    logger = MagicMock()
+    pool = CrawlProcessPool(crashing_crawler, logger, processes=1, restart_backoff_seconds=0.2, max_restarts=2)
+    pool.start()
+    arguments = {"start_url": "https://example.com/", "number_of_links": 0, "run_id": "run"}
+
+    try:
+        # Act
+        started = time.monotonic()
+        outcomes = []
+        for _ in range(4):
+            try:
+                await asyncio.wait_for(pool.run("crawl_website", arguments), 30)
+            except CrawlProcessError as e:
+                outcomes.append(str(e))
+        elapsed = time.monotonic() - started
+    finally:
+        await pool.close()
+
+    # Assert
+    assert all(outcome.endswith("exited with code 4") for outcome in outcomes[:3])
+    assert outcomes[3] == "No crawl process is running"
+    assert [call.args[0].split(" {")[0] for call in logger.warn.call_args_list] == ["Crawl process died, starting it again"] * 2
+    logger.error.assert_called_once()
+    # Waited 0.2 then 0.4 seconds before the restarts
+    assert elapsed >= 0.6
+
+
+@pytest.mark.asyncio
+async def test_the_metrics_of_the_processes_are_exposed(tmp_path, monkeypatch):
+    # Arrange
+    monkeypatch.setenv("PROMETHEUS_MULTIPROC_DIR", str(tmp_path))
+    # Read by the processes as they import prometheus_client
+    pool = CrawlProcessPool(busy_crawler, MagicMock(), processes=1)
+    pool.start()
+
+    try:
+        # Act
+        await asyncio.wait_for(
+            pool.run("crawl_website", {"start_url": "https://example.com/", "number_of_links": 0, "run_id": "run"}), 30
+        )
+        samples = [
+            sample for metric in metrics_registry().collect() if metric.name == STAGE_LATENCY._name
+            for sample in metric.samples
+        ]
+    finally:
+        await pool.close()
+
+    # Assert
+    counts = [
+        sample.value for sample in samples
+        if sample.name == "crawl_stage_seconds_count" and sample.labels["stage"] == Stage.IMAGE_ENCODE.value
+    ]
+    assert counts == [1]
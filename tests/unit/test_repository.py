@@ -1,9 +1,12 @@
+import asyncio
+import mongomock
 import pytest
 from unittest.mock import MagicMock, patch, ANY
 from datetime import datetime
 from pymongo.collection import Collection
 from pymongo.database import Database
-from repositories.screenshot_repository import ScreenshotRepository
+from models.screenshot_document import PageCapture
+from repositories.screenshot_repository import AsyncScreenshotRepository, ScreenshotRepository
 
 @patch('repositories.screenshot_repository.ScreenshotDocument')
 def test_insert_screenshot_data(MockScreenshotDocument):
@@ -34,7 +37,9 @@ def test_insert_screenshot_data(MockScreenshotDocument):
         _id=run_id,
         start_url=start_url,
         screenshots=screenshots,
-        timestamp=ANY  # Match any datetime object
+        pages=[],
+        timestamp=ANY,  # Match any datetime object
+        changes=None
     )
     mock_collection.insert_one.assert_called_once_with(mock_screenshot_doc.model_dump(by_alias=True))
 
@@ -60,3 +65,127 @@ def test_get_screenshots_by_run_id():
     # Assert
     mock_collection.find_one.assert_called_once_with({"_id": run_id})
     assert result == expected_document
+
+
+@pytest.mark.asyncio
+async def test_async_repository_round_trip_with_mongomock():
+    # Arrange
+    db = mongomock.MongoClient()['screenshots_db']
+    repository = AsyncScreenshotRepository(db=db)
+
+    run_id = "test_run_id"
+    start_url = "https://example.com/"
+    screenshots = ["screenshot1.png", "screenshot2.png"]
+
+    # Act
+    await repository.insert_screenshot_data(run_id, start_url, screenshots)
+    result = await repository.get_screenshots_by_run_id(run_id)
+
+    # Assert
+    assert result["_id"] == run_id
+    assert result["start_url"] == start_url
+    assert result["screenshots"] == screenshots
+
+
+@pytest.mark.asyncio
+async def test_async_repository_runs_queries_off_the_event_loop():
+    # Arrange
+    mock_db = MagicMock(spec=Database)
+    mock_collection = MagicMock(spec=Collection)
+    mock_db.__getitem__.return_value = mock_collection
+    repository = AsyncScreenshotRepository(db=mock_db)
+    mock_collection.find_one.return_value = {"_id": "test_run_id"}
+
+    # Act
+    with patch("repositories.screenshot_repository.asyncio.to_thread", wraps=asyncio.to_thread) as mock_to_thread:
+        result = await repository.get_screenshots_by_run_id("test_run_id")
+
+    # Assert
+    mock_to_thread.assert_called_once()
+    mock_collection.find_one.assert_called_once_with({"_id": "test_run_id"})
+    assert result == {"_id": "test_run_id"}
+
+
+@pytest.mark.asyncio
+async def test_page_captures_are_written_once_per_index_and_read_in_order():
+    # Arrange
+    db = mongomock.MongoClient()['screenshots_db']
+    repository = AsyncScreenshotRepository(db)
+    first = PageCapture(url="https://example.com/", path="run_screenshot_0.png")
+    second = PageCapture(url="https://example.com/about", path="run_screenshot_1.png")
+
+    # Act
+    await repository.save_page_capture("test_run_id", 1, second)
+    await repository.save_page_capture("test_run_id", 0, first)
+    await repository.save_page_capture("test_run_id", 1, second)
+    pages = await repository.get_page_captures("test_run_id")
+    await repository.delete_page_captures("test_run_id")
+
+    # Assert
+    assert pages == [first, second]
+    assert await repository.get_page_captures("test_run_id") == []
+
+
+@pytest.mark.asyncio
+async def test_insert_many_goes_on_after_a_failed_document():
+    # Arrange
+    db = mongomock.MongoClient()['screenshots_db']
+    repository = AsyncScreenshotRepository(db)
+    await repository.insert_screenshot_data("run_taken", "https://example.com/", [])
+    runs = [
+        {"run_id": "run_taken", "start_url": "https://example.com/", "screenshots": []},
+        {"run_id": "run_invalid", "start_url": "not a url", "screenshots": []},
+        {"run_id": "run_new", "start_url": "https://example.com/", "screenshots": ["run_new_screenshot_0.png"]},
+    ]
+
+    # Act
+    not_inserted = await repository.insert_many_screenshot_data(runs)
+
+    # Assert
+    assert sorted(not_inserted) == ["run_invalid", "run_taken"]
+    stored = await repository.get_screenshots_by_run_id("run_new")
+    assert stored["screenshots"] == ["run_new_screenshot_0.png"]
+
+
+def test_get_screenshots_page_slices_in_the_database():
+    # Arrange
+    repository = ScreenshotRepository(mongomock.MongoClient()['screenshots_db'])
+    screenshots = [f"run_screenshot_{i}.png" for i in range(5)]
+    pages = [PageCapture(url=f"https://example.com/{i}", path=path) for i, path in enumerate(screenshots)]
+    repository.insert_screenshot_data("test_run_id", "https://example.com/", screenshots, pages)
+
+    # Act
+    record = repository.get_screenshots_page("test_run_id", offset=1, limit=2)
+    missing = repository.get_screenshots_page("unknown_run_id", 0, 2)
+
+    # Assert
+    assert record["total"] == 5
+    assert record["screenshots"] == screenshots[1:3]
+    assert [page["path"] for page in record["pages"]] == screenshots[1:3]
+    assert missing is None
+
+
+def test_list_runs_pages_newest_first_after_the_cursor():
+    # Arrange
+    repository = ScreenshotRepository(mongomock.MongoClient()['screenshots_db'])
+    repository.ensure_indexes()
+    for i in range(5):
+        repository.collection.insert_one({
+            "_id": f"run_{i}",
+            "start_url": "https://example.com/" if i % 2 == 0 else "https://other.com/",
+            "screenshots": [],
+            # Two runs at the same time, ordered by id
+            "timestamp": datetime(2024, 8, 20, 10, min(i, 3)),
+        })
+
+    # Act
+    first_page = repository.list_runs(limit=2)
+    last = first_page[-1]
+    second_page = repository.list_runs(after=(last["timestamp"], last["_id"]), limit=2)
+    filtered = repository.list_runs(start_url="https://example.com/", since=datetime(2024, 8, 20, 10, 1))
+
+    # Assert
+    assert [run["_id"] for run in first_page] == ["run_4", "run_3"]
+    assert [run["_id"] for run in second_page] == ["run_2", "run_1"]
+    assert [run["_id"] for run in filtered] == ["run_4", "run_2"]
+    assert "screenshots" not in first_page[0]
@@ -0,0 +1,223 @@
+import fakeredis
+import mongomock
+import os
+import pytest
+from datetime import datetime, timedelta
+from unittest.mock import AsyncMock, MagicMock
+from repositories.screenshot_repository import AsyncScreenshotRepository, TTL_INDEX
+from services.retention import RetentionCollector
+from services.screenshot_files import ScreenshotFiles
+from services.storage import LocalStorage
+
+
+async def store_run(repository, storage, run_id: str, age_days: int, size: int = 10, pinned: bool = False, reused: str = None):
+    key = f"{run_id}_screenshot_0.png"
+    await storage.write(key, b"x" * size)
+    pages = [{"url": "https://example.com/", "path": key, "thumbnail": None, "source": "fresh"}]
+    screenshots = [key]
+    if reused:
+        pages.append({"url": "https://example.com/a", "path": reused, "thumbnail": None, "source": "cache"})
+        screenshots.append(reused)
+    repository.collection.insert_one({
+        "_id": run_id,
+        "start_url": "https://example.com/",
+        "screenshots": screenshots,
+        "pages": pages,
+        "timestamp": datetime.now() - timedelta(days=age_days),
+        "pinned": pinned,
+    })
+    return key
+
+
+def make_collector(repository, storage, **kwargs):
+    run_cache = MagicMock()
+    run_cache.delete = AsyncMock()
+    return RetentionCollector(repository, storage, run_cache, MagicMock(), batch_size=2, **kwargs)
+
+
+@pytest.mark.asyncio
+async def test_old_runs_are_removed_but_pinned_runs_and_shared_files_stay(tmp_path):
+    # Arrange
+    repository = AsyncScreenshotRepository(mongomock.MongoClient()['screenshots_db'])
+    storage = LocalStorage(tmp_path, shard_depth=0)
+    old_keys = [await store_run(repository, storage, f"old_{i}", age_days=10) for i in range(3)]
+    pinned_key = await store_run(repository, storage, "pinned", age_days=10, pinned=True)
+    # A recent run reusing the screenshot of an old one
+    await store_run(repository, storage, "recent", age_days=0, reused=old_keys[0])
+    collector = make_collector(repository, storage, max_age_seconds=7 * 86400)
+
+    # Act
+    removed = await collector.collect()
+
+    # Assert
+    assert removed == 3
+    assert sorted(document["_id"] for document in repository.collection.find()) == ["pinned", "recent"]
+    assert await storage.exists(old_keys[0])
+    assert not await storage.exists(old_keys[1])
+    assert not await storage.exists(old_keys[2])
+    assert await storage.exists(pinned_key)
+    deleted_from_cache = [run_id for call in collector._run_cache.delete.await_args_list for run_id in call.args[0]]
+    assert sorted(deleted_from_cache) == ["old_0", "old_1", "old_2"]
+
+
+@pytest.mark.asyncio
+async def test_oldest_runs_are_removed_until_under_the_size_budget(tmp_path):
+    # Arrange
+    repository = AsyncScreenshotRepository(mongomock.MongoClient()['screenshots_db'])
+    storage = LocalStorage(tmp_path, shard_depth=0)
+    for age in range(5, 0, -1):
+        await store_run(repository, storage, f"run_{age}", age_days=age, size=100)
+    collector = make_collector(repository, storage, max_total_bytes=250)
+
+    # Act
+    removed = await collector.collect()
+
+    # Assert
+    assert removed == 3
+    assert sorted(document["_id"] for document in repository.collection.find()) == ["run_1", "run_2"]
+    assert await repository.total_size() == 200
+
+
+@pytest.mark.asyncio
+async def test_ttl_index_follows_the_retention():
+    # Arrange
+    repository = AsyncScreenshotRepository(mongomock.MongoClient()['screenshots_db'])
+
+    # Act
+    await repository.ensure_indexes(3600)
+    await repository.ensure_indexes(7200)
+    changed = repository.collection.index_information()[TTL_INDEX]
+    await repository.ensure_indexes(None)
+
+    # Assert
+    assert changed["expireAfterSeconds"] == 7200
+    assert changed["partialFilterExpression"] == {"pinned": False}
+    assert TTL_INDEX not in repository.collection.index_information()
+
+
+@pytest.mark.asyncio
+async def test_files_shared_with_newer_runs_are_counted_until_deleted(tmp_path):
+    # Arrange
+    repository = AsyncScreenshotRepository(mongomock.MongoClient()['screenshots_db'])
+    storage = LocalStorage(tmp_path, shard_depth=0)
+    old_key = await store_run(repository, storage, "old", age_days=2)
+    # The newer run reuses the screenshot from the cache, with a thumbnail of its own
+    await storage.write("new_thumb.png", b"x" * 5)
+    repository.collection.insert_one({
+        "_id": "new",
+        "screenshots": [old_key],
+        "pages": [{"url": "https://example.com/", "path": old_key, "thumbnail": "new_thumb.png", "source": "cache"}],
+        "timestamp": datetime.now() - timedelta(days=1),
+        "pinned": False,
+    })
+    collector = make_collector(repository, storage, max_total_bytes=12)
+
+    # Act
+    removed = await collector.collect()
+
+    # Assert
+    assert removed == 2
+    assert repository.collection.count_documents({}) == 0
+    assert not await storage.exists(old_key)
+    assert not await storage.exists("new_thumb.png")
+
+
+@pytest.mark.asyncio
+async def test_the_size_of_a_kept_file_moves_to_the_run_using_it(tmp_path):
+    # Arrange
+    repository = AsyncScreenshotRepository(mongomock.MongoClient()['screenshots_db'])
+    storage = LocalStorage(tmp_path, shard_depth=0)
+    old_key = await store_run(repository, storage, "old", age_days=10)
+    recent_key = await store_run(repository, storage, "recent", age_days=0)
+    # The recent run captured the page of the old one again, unchanged, in a second viewport
+    capture = {"url": "https://example.com/", "path": recent_key, "thumbnail": None, "source": "fresh", "viewport": "desktop"}
+    unchanged = {"url": "https://example.com/", "path": old_key, "source": "fresh", "change": "unchanged", "viewport": "mobile"}
+    repository.collection.update_one({"_id": "recent"}, {"$set": {"pages": [{**capture, "viewports": [capture, unchanged]}]}})
+    collector = make_collector(repository, storage, max_age_seconds=7 * 86400, max_total_bytes=1000)
+    await collector._measure_runs()
+
+    # Act
+    removed = await collector.collect()
+
+    # Assert
+    assert removed == 1
+    assert await storage.exists(old_key)
+    assert repository.collection.find_one({"_id": "recent"})["size_bytes"] == 20
+    assert await repository.total_size() == 20
+
+
+@pytest.mark.asyncio
+async def test_resized_copies_count_in_the_size_of_their_run(tmp_path):
+    # Arrange
+    repository = AsyncScreenshotRepository(mongomock.MongoClient()['screenshots_db'])
+    storage = LocalStorage(tmp_path, shard_depth=0)
+    key = await store_run(repository, storage, "run", age_days=1, size=100)
+    await storage.write(ScreenshotFiles.variant_key(key, 320), b"x" * 30)
+    collector = make_collector(repository, storage, max_total_bytes=1000, variant_widths=[320, 640])
+    await collector._measure_runs()
+    # A copy made after the run was measured
+    await storage.write(ScreenshotFiles.variant_key(key, 640), b"x" * 50)
+    await repository.add_file_size(key, 50)
+    collector.max_total_bytes = 100
+
+    # Act
+    removed = await collector.collect()
+
+    # Assert
+    assert removed == 1
+    assert not await storage.exists(ScreenshotFiles.variant_key(key, 320))
+    assert not await storage.exists(ScreenshotFiles.variant_key(key, 640))
+    assert await repository.total_size() == 0
+
+
+@pytest.mark.asyncio
+async def test_old_files_of_no_run_are_removed(tmp_path):
+    # Arrange
+    repository = AsyncScreenshotRepository(mongomock.MongoClient()['screenshots_db'])
+    storage = LocalStorage(tmp_path, shard_depth=0)
+    kept = await store_run(repository, storage, "run", age_days=3)
+    # Left by a run that failed before storing its document
+    await storage.write("failed_screenshot_0.png", b"x")
+    await storage.write(ScreenshotFiles.variant_key("failed_screenshot_0.png", 320), b"x")
+    await storage.write("recent_screenshot_0.png", b"x")
+    two_days_ago = (datetime.now() - timedelta(days=2)).timestamp()
+    for key in [kept, "failed_screenshot_0.png"]:
+        os.utime(storage.local_path(key), (two_days_ago, two_days_ago))
+    collector = make_collector(repository, storage, max_age_seconds=7 * 86400, variant_widths=[320])
+
+    # Act
+    removed = await collector.collect()
+
+    # Assert
+    assert removed == 0
+    assert await storage.exists(kept)
+    assert not await storage.exists("failed_screenshot_0.png")
+    assert not await storage.exists(ScreenshotFiles.variant_key("failed_screenshot_0.png", 320))
+    # Maybe still written by a run in progress
+    assert await storage.exists("recent_screenshot_0.png")
+
+
+@pytest.mark.asyncio
+async def test_a_single_process_collects_at_a_time(tmp_path):
+    # Arrange
+    repository = AsyncScreenshotRepository(mongomock.MongoClient()['screenshots_db'])
+    storage = LocalStorage(tmp_path, shard_depth=0)
+    for i in range(3):
+        await store_run(repository, storage, f"old_{i}", age_days=10)
+    server = fakeredis.FakeServer()
+    first, second = [
+        make_collector(repository, storage, max_age_seconds=7 * 86400,
+                       cache_client=fakeredis.FakeAsyncRedis(server=server, decode_responses=True))
+        for _ in range(2)
+    ]
+    await first._take_lease()
+
+    # Act
+    skipped = await second.collect()
+    await first._release_lease()
+    removed = await second.collect()
+
+    # Assert
+    assert skipped == 0
+    assert removed == 3
+    assert await second._cache_client.get(RetentionCollector.LEASE_KEY) is None
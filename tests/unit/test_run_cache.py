@@ -0,0 +1,91 @@
+import pytest
+from unittest.mock import AsyncMock, MagicMock
+from services.run_cache import CACHE_EVICTED_KEYS, CACHE_HITS, RunCache
+
+
+def make_cache_client_mock():
+    pipe = MagicMock()
+    pipe.execute = AsyncMock()
+    cache_client = MagicMock()
+    cache_client.pipeline.return_value.__aenter__.return_value = pipe
+    return cache_client, pipe
+
+
+@pytest.mark.asyncio
+async def test_store_sets_expiry_in_the_same_transaction():
+    # Arrange
+    cache_client, pipe = make_cache_client_mock()
+    run_cache = RunCache(cache_client, MagicMock(), ttl_seconds=120)
+
+    # Act
+    await run_cache.store("test_run_id", ["screenshot_0.png", "screenshot_1.png"])
+
+    # Assert
+    cache_client.pipeline.assert_called_once_with(transaction=True)
+    pipe.rpush.assert_called_once_with("test_run_id", "screenshot_0.png", "screenshot_1.png")
+    pipe.expire.assert_called_once_with("test_run_id", 120)
+    pipe.execute.assert_awaited_once()
+
+
+@pytest.mark.asyncio
+async def test_store_skips_empty_runs():
+    # Arrange
+    cache_client, pipe = make_cache_client_mock()
+    run_cache = RunCache(cache_client, MagicMock())
+
+    # Act
+    await run_cache.store("test_run_id", [])
+
+    # Assert
+    cache_client.pipeline.assert_not_called()
+
+
+@pytest.mark.asyncio
+async def test_configure_memory_budget_survives_refused_config():
+    # Arrange
+    cache_client = MagicMock()
+    cache_client.config_set = AsyncMock(side_effect=Exception("unknown command 'CONFIG'"))
+    logger_mock = MagicMock()
+    run_cache = RunCache(cache_client, logger_mock)
+
+    # Act
+    await run_cache.configure_memory_budget("256mb")
+
+    # Assert
+    logger_mock.warn.assert_called_once()
+
+
+@pytest.mark.asyncio
+async def test_refresh_stats_copies_server_evictions():
+    # Arrange
+    cache_client = MagicMock()
+    cache_client.info = AsyncMock(side_effect=[
+        {"evicted_keys": 7, "expired_keys": 3},
+        {"used_memory": 1024},
+    ])
+    run_cache = RunCache(cache_client, MagicMock())
+
+    # Act
+    await run_cache.refresh_stats()
+
+    # Assert
+    assert CACHE_EVICTED_KEYS._value.get() == 7
+
+
+@pytest.mark.asyncio
+async def test_get_range_reads_only_the_asked_slice():
+    # Arrange
+    cache_client, pipe = make_cache_client_mock()
+    pipe.execute.return_value = [["screenshot_2.png", "screenshot_3.png"], 10]
+    run_cache = RunCache(cache_client, MagicMock())
+    hits = CACHE_HITS._value.get()
+
+    # Act
+    screenshots, total = await run_cache.get_range("test_run_id", offset=2, limit=2)
+
+    # Assert
+    pipe.lrange.assert_called_once_with("test_run_id", 2, 3)
+    pipe.llen.assert_called_once_with("test_run_id")
+    assert screenshots == ["screenshot_2.png", "screenshot_3.png"]
+    assert total == 10
+    assert CACHE_HITS._value.get() == hits + 1
@@ -0,0 +1,122 @@
+import json
+import fakeredis
+import pytest
+from unittest.mock import AsyncMock, MagicMock
+from services.run_events import RunEvents, RunEventType
+
+
+@pytest.mark.asyncio
+async def test_publish_appends_to_the_run_stream_with_expiry():
+    # Arrange
+    pipe = MagicMock()
+    pipe.execute = AsyncMock()
+    cache_client = MagicMock()
+    cache_client.pipeline.return_value.__aenter__.return_value = pipe
+    run_events = RunEvents(cache_client, ttl_seconds=60)
+
+    # Act
+    await run_events.publish("test_run_id", RunEventType.PAGE, {"index": 0})
+
+    # Assert
+    pipe.xadd.assert_called_once_with("events:test_run_id", {"type": "page", "data": json.dumps({"index": 0})})
+    pipe.expire.assert_called_once_with("events:test_run_id", 60)
+
+
+@pytest.mark.asyncio
+async def test_listen_stops_after_the_terminal_event():
+    # Arrange
+    cache_client = MagicMock()
+    cache_client.xread = AsyncMock(side_effect=[
+        [],
+        [("events:test_run_id", [
+            ("1-0", {"type": "page", "data": '{"index": 0}'}),
+            ("2-0", {"type": "done", "data": '{"screenshots": []}'}),
+            ("3-0", {"type": "page", "data": '{"index": 1}'}),
+        ])],
+    ])
+    cache_client.exists = AsyncMock(return_value=1)
+    run_events = RunEvents(cache_client)
+
+    # Act
+    events = [event async for event in run_events.listen("test_run_id")]
+
+    # Assert
+    assert events == [
+        None,
+        ("1-0", "page", {"index": 0}),
+        ("2-0", "done", {"screenshots": []}),
+    ]
+    assert cache_client.xread.call_args_list[-1].args == ({"events:test_run_id": "0"},)
+
+
+@pytest.mark.asyncio
+async def test_listen_ends_when_the_stream_expired():
+    # Arrange
+    cache_client = MagicMock()
+    cache_client.xread = AsyncMock(return_value=[])
+    cache_client.exists = AsyncMock(return_value=0)
+    run_events = RunEvents(cache_client)
+
+    # Act
+    events = [event async for event in run_events.listen("test_run_id", last_id="5-0")]
+
+    # Assert
+    assert events == []
+
+
+@pytest.mark.asyncio
+async def test_streams_read_on_their_own_client_up_to_the_limit():
+    # Arrange
+    server = fakeredis.FakeServer()
+    cache_client = fakeredis.FakeAsyncRedis(server=server, decode_responses=True)
+    stream_client = fakeredis.FakeAsyncRedis(server=server, decode_responses=True)
+    reads = []
+    xread = stream_client.xread
+
+    async def counted_xread(*args, **kwargs):
+        reads.append(args)
+        return await xread(*args, **kwargs)
+
+    stream_client.xread = counted_xread
+    run_events = RunEvents(cache_client, block_ms=10, stream_client=stream_client, max_streams=1)
+    await run_events.publish("test_run_id", RunEventType.PAGE, {"index": 0})
+    await run_events.publish("test_run_id", RunEventType.DONE, {"screenshots": []})
+
+    # Act
+    slot = run_events.acquire()
+    refused = run_events.acquire()
+    stream = run_events.stream("test_run_id", slot)
+    first = await stream.__anext__()
+    rest = [event async for event in stream]
+    # Released again by the response once sent
+    slot.release()
+
+    # Assert
+    assert first[1:] == ("page", {"index": 0})
+    assert [event[1] for event in rest] == ["done"]
+    assert refused is None
+    assert run_events.open_streams == 0
+    assert run_events.acquire() is not None
+    assert reads
+
+
+@pytest.mark.asyncio
+async def test_a_following_run_streams_the_pages_of_the_crawl_and_its_own_outcome():
+    # Arrange
+    run_events = RunEvents(fakeredis.FakeAsyncRedis(decode_responses=True), block_ms=10)
+    await run_events.publish("leader", RunEventType.PAGE, {"index": 0})
+    await run_events.publish("leader", RunEventType.DONE, {"screenshots": ["leader_screenshot_0.png"]})
+    await run_events.publish("follower", RunEventType.STATUS, {"status": "running"})
+    await run_events.publish("follower", RunEventType.DONE, {"screenshots": ["copied_screenshot_0.png"]})
+    await run_events.follow("follower", "leader")
+
+    # Act
+    events = [event async for event in run_events.stream("follower", run_events.acquire())]
+
+    # Assert
+    assert [event[1:] for event in events] == [
+        ("page", {"index": 0}),
+        ("done", {"screenshots": ["copied_screenshot_0.png"]}),
+    ]
+    await run_events.follow("follower", None)
+    assert await run_events.leader_of("follower") is None
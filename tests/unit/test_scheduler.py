@@ -0,0 +1,166 @@
+import mongomock
+import pytest
+from datetime import datetime, timedelta
+from fastapi import FastAPI
+from fastapi.testclient import TestClient
+from unittest.mock import AsyncMock, MagicMock
+from controllers.schedules import router
+from dep_container import get_crawl_scheduler, get_schedule_repository
+from models.schedule_document import ScheduleDocument
+from repositories.schedule_repository import AsyncScheduleRepository
+from services.scheduler import CrawlScheduler, next_run_at
+from utils.cron import CronExpression
+
+REQUEST = {"start_url": "https://example.com/", "number_of_links_to_follow": 1}
+
+
+def make_scheduler(repository, job_status=None, **kwargs):
+    job_runner = MagicMock()
+    job_runner.submit = AsyncMock()
+    job_tracker = MagicMock()
+    job_tracker.get = AsyncMock(return_value={"status": job_status} if job_status else None)
+    return CrawlScheduler(repository, job_runner, job_tracker, MagicMock(), MagicMock(), MagicMock(), jitter_seconds=0, **kwargs)
+
+
+async def store_schedule(repository, schedule_id: str, next_run: datetime, **fields):
+    await repository.insert_schedule(ScheduleDocument(
+        _id=schedule_id, request=REQUEST, interval_seconds=3600, next_run_at=next_run, created_at=datetime.now(), **fields
+    ))
+
+
+def test_cron_expression_finds_the_next_matching_minute():
+    moment = datetime(2024, 8, 20, 10, 17, 30)  # A Tuesday
+
+    assert CronExpression("*/15 * * * *").next_after(moment) == datetime(2024, 8, 20, 10, 30)
+    assert CronExpression("0 9-17/4 * * *").next_after(moment) == datetime(2024, 8, 20, 13, 0)
+    assert CronExpression("30 2 * * 0").next_after(moment) == datetime(2024, 8, 25, 2, 30)
+    assert CronExpression("@monthly").next_after(moment) == datetime(2024, 9, 1, 0, 0)
+    assert CronExpression("0 0 29 2 *").next_after(moment) == datetime(2028, 2, 29, 0, 0)
+    for invalid in ("* * * *", "60 * * * *", "*/0 * * * *", "a * * * *", "0 0 31 2 *"):
+        with pytest.raises(ValueError):
+            CronExpression(invalid).next_after(moment)
+
+
+def test_interval_schedules_are_spread_over_their_interval():
+    # Arrange
+    after = datetime(2024, 8, 20, 10, 0, 0)
+
+    # Act
+    runs = [next_run_at(f"schedule_{i}", after, interval_seconds=3600) for i in range(20)]
+    following = next_run_at("schedule_0", runs[0], interval_seconds=3600)
+
+    # Assert
+    assert all(after < run <= after + timedelta(hours=1) for run in runs)
+    assert len({run.minute for run in runs}) > 10
+    assert following - runs[0] == timedelta(hours=1)
+
+
+def test_cron_schedules_are_spread_after_their_minute():
+    # Arrange
+    after = datetime(2024, 8, 20, 10, 30, 0)
+
+    # Act
+    runs = [next_run_at(f"schedule_{i}", after, cron="0 * * * *", cron_spread_seconds=300) for i in range(20)]
+    # Fired at its shifted time, the schedule moves to the next hour with the same shift
+    following = next_run_at("schedule_0", runs[0], cron="0 * * * *", cron_spread_seconds=300)
+    every_minute = [next_run_at(f"schedule_{i}", after, cron="* * * * *", cron_spread_seconds=300) for i in range(20)]
+
+    # Assert
+    assert all(datetime(2024, 8, 20, 11, 0) <= run < datetime(2024, 8, 20, 11, 5) for run in runs)
+    assert len({run.second + 60 * run.minute for run in runs}) > 10
+    assert following - runs[0] == timedelta(hours=1)
+    # Every minute only spreads over a tenth of it
+    assert all(after < run < after + timedelta(seconds=66) for run in every_minute)
+
+
+@pytest.mark.asyncio
+async def test_due_schedules_start_a_run_and_move_to_their_next_slot():
+    # Arrange
+    repository = AsyncScheduleRepository(mongomock.MongoClient()['screenshots_db'])
+    now = datetime.now()
+    await store_schedule(repository, "due", now - timedelta(seconds=5))
+    await store_schedule(repository, "later", now + timedelta(minutes=5))
+    await store_schedule(repository, "disabled", now - timedelta(seconds=5), enabled=False)
+    scheduler = make_scheduler(repository)
+
+    # Act
+    started = await scheduler.run_due_schedules()
+
+    # Assert
+    assert started == 1
+    schedule = await repository.get_schedule("due")
+    [[run_id, _]] = [call.args for call in scheduler._job_runner.submit.await_args_list]
+    assert schedule["last_run_id"] == run_id
+    assert now < schedule["next_run_at"] <= now + timedelta(hours=1)
+    assert await scheduler.run_due_schedules() == 0
+
+
+@pytest.mark.asyncio
+async def test_a_run_is_skipped_while_the_previous_one_is_running():
+    # Arrange
+    repository = AsyncScheduleRepository(mongomock.MongoClient()['screenshots_db'])
+    now = datetime.now()
+    await store_schedule(repository, "busy", now, last_run_id="previous", last_run_at=now - timedelta(minutes=10))
+    await store_schedule(repository, "stuck", now, last_run_id="lost", last_run_at=now - timedelta(hours=3))
+    scheduler = make_scheduler(repository, job_status="running", max_run_seconds=3600)
+
+    # Act
+    started = await scheduler.run_due_schedules()
+
+    # Assert
+    assert started == 1
+    busy = await repository.get_schedule("busy")
+    assert busy["skipped_runs"] == 1
+    assert busy["last_run_id"] == "previous"
+    assert busy["next_run_at"] > now
+    # The run of the other one was lost with its process long ago
+    assert (await repository.get_schedule("stuck"))["last_run_id"] != "lost"
+
+
+@pytest.mark.asyncio
+async def test_a_claimed_schedule_is_due_again_after_its_lease():
+    # Arrange
+    repository = AsyncScheduleRepository(mongomock.MongoClient()['screenshots_db'])
+    now = datetime.now()
+    await store_schedule(repository, "claimed", now)
+
+    # Act
+    claimed = await repository.claim_due_schedule(now, now + timedelta(seconds=60))
+    claimed_again = await repository.claim_due_schedule(now + timedelta(seconds=30), now + timedelta(seconds=90))
+    after_the_lease = await repository.claim_due_schedule(now + timedelta(seconds=61), now + timedelta(seconds=121))
+
+    # Assert
+    assert claimed["_id"] == "claimed"
+    assert claimed_again is None
+    assert after_the_lease["_id"] == "claimed"
+
+
+def test_schedules_api_validates_and_stores_the_schedules():
+    # Arrange
+    repository = AsyncScheduleRepository(mongomock.MongoClient()['screenshots_db'])
+    app = FastAPI()
+    app.include_router(router)
+    app.dependency_overrides[get_schedule_repository] = lambda: repository
+    app.dependency_overrides[get_crawl_scheduler] = lambda: make_scheduler(repository)
+    client = TestClient(app)
+
+    # Act
+    both = client.post("/schedules", json={"request": REQUEST, "interval_seconds": 3600, "cron": "@hourly"})
+    bad_cron = client.post("/schedules", json={"request": REQUEST, "cron": "61 * * * *"})
+    created = client.post("/schedules", json={"request": REQUEST, "cron": "0 * * * *"})
+    schedule_id = created.json()["schedule_id"]
+    updated = client.put(f"/schedules/{schedule_id}", json={"request": REQUEST, "interval_seconds": 600, "enabled": False})
+    listed = client.get("/schedules")
+    deleted = client.delete(f"/schedules/{schedule_id}")
+    missing = client.get(f"/schedules/{schedule_id}")
+
+    # Assert
+    assert both.status_code == 422
+    assert bad_cron.status_code == 422
+    assert created.status_code == 201
+    assert created.json()["next_run_at"][14:16] in ("00", "01", "02", "03", "04", "05")
+    assert updated.json()["interval_seconds"] == 600
+    assert updated.json()["enabled"] is False
+    assert [schedule["schedule_id"] for schedule in listed.json()["schedules"]] == [schedule_id]
+    assert deleted.status_code == 204
+    assert missing.status_code == 404
@@ -0,0 +1,78 @@
+import pytest
+from unittest.mock import AsyncMock, MagicMock
+from services.screenshot_cache import ScreenshotCache
+from services.storage import LocalStorage
+
+SETTINGS = {"viewport": {"width": 800, "height": 600}, "format": "png", "full_page": False}
+
+
+def test_key_ignores_url_spelling_but_not_settings():
+    # Arrange
+    screenshot_cache = ScreenshotCache(MagicMock(), MagicMock())
+
+    # Act & Assert
+    assert screenshot_cache.key("https://Example.com/#top", SETTINGS) == \
+        screenshot_cache.key("https://example.com/", SETTINGS)
+    assert screenshot_cache.key("https://example.com/", SETTINGS) != \
+        screenshot_cache.key("https://example.com/", dict(SETTINGS, full_page=True))
+
+
+@pytest.mark.asyncio
+async def test_get_returns_existing_file(tmp_path):
+    # Arrange
+    (tmp_path / "ab").mkdir()
+    (tmp_path / "ab" / "previous_run_screenshot_0.png").write_bytes(b"png")
+    cache_client = MagicMock()
+    cache_client.get = AsyncMock(return_value="ab/previous_run_screenshot_0.png")
+    screenshot_cache = ScreenshotCache(cache_client, LocalStorage(tmp_path))
+
+    # Act
+    result = await screenshot_cache.get("https://example.com/", SETTINGS)
+
+    # Assert
+    assert result == "ab/previous_run_screenshot_0.png"
+
+
+@pytest.mark.asyncio
+async def test_get_ignores_removed_files(tmp_path):
+    # Arrange
+    cache_client = MagicMock()
+    cache_client.get = AsyncMock(return_value="ab/removed.png")
+    screenshot_cache = ScreenshotCache(cache_client, LocalStorage(tmp_path))
+
+    # Act
+    result = await screenshot_cache.get("https://example.com/", SETTINGS)
+
+    # Assert
+    assert result is None
+
+
+@pytest.mark.asyncio
+async def test_put_expires_after_freshness_window():
+    # Arrange
+    cache_client = MagicMock()
+    cache_client.set = AsyncMock()
+    screenshot_cache = ScreenshotCache(cache_client, MagicMock(), freshness_seconds=60)
+
+    # Act
+    await screenshot_cache.put("https://example.com/", SETTINGS, "/tmp/screenshot.png")
+
+    # Assert
+    cache_client.set.assert_awaited_once_with(
+        screenshot_cache.key("https://example.com/", SETTINGS), "/tmp/screenshot.png", ex=60)
+
+
+@pytest.mark.asyncio
+async def test_disabled_cache_never_hits_redis():
+    # Arrange
+    cache_client = MagicMock()
+    screenshot_cache = ScreenshotCache(cache_client, MagicMock(), freshness_seconds=0)
+
+    # Act
+    result = await screenshot_cache.get("https://example.com/", SETTINGS)
+    await screenshot_cache.put("https://example.com/", SETTINGS, "/tmp/screenshot.png")
+
+    # Assert
+    assert result is None
+    cache_client.get.assert_not_called()
+    cache_client.set.assert_not_called()
@@ -0,0 +1,150 @@
+import asyncio
+import fakeredis
+import pytest
+from unittest.mock import AsyncMock, MagicMock
+from models.screenshot_document import PageCapture
+from services.task_queue import CaptureTaskQueue
+from workers.crawler import CaptureWorker
+
+
+def make_queue(**kwargs) -> CaptureTaskQueue:
+    return CaptureTaskQueue(fakeredis.FakeAsyncRedis(decode_responses=True), **kwargs)
+
+
+@pytest.mark.asyncio
+async def test_claim_returns_each_new_task_to_one_consumer():
+    # Arrange
+    queue = make_queue()
+    await queue.ensure_group()
+    await queue.ensure_group()
+    await queue.enqueue("test_run_id", 0, "https://example.com/", {"image_format": "png"})
+    await queue.enqueue("test_run_id", 1, "https://example.com/about", {"image_format": "png"})
+
+    # Act
+    first = await queue.claim("worker-1", count=1, block_ms=10)
+    second = await queue.claim("worker-2", count=5, block_ms=10)
+    third = await queue.claim("worker-3", count=5, block_ms=10)
+
+    # Assert
+    assert [(task.index, task.url) for task in first] == [(0, "https://example.com/")]
+    assert [(task.index, task.url) for task in second] == [(1, "https://example.com/about")]
+    assert second[0].capture == {"image_format": "png"}
+    assert third == []
+
+
+@pytest.mark.asyncio
+async def test_expired_lease_is_claimed_again_until_acknowledged():
+    # Arrange
+    queue = make_queue(lease_ms=0)
+    await queue.ensure_group()
+    await queue.enqueue("test_run_id", 0, "https://example.com/", {})
+    [task] = await queue.claim("dead-worker", block_ms=10)
+
+    # Act
+    [redelivered] = await queue.claim("worker-2", block_ms=10)
+    await queue.ack(redelivered.task_id)
+    after_ack = await queue.claim("worker-3", block_ms=10)
+
+    # Assert
+    assert redelivered.task_id == task.task_id
+    assert redelivered.deliveries == 2
+    assert after_ack == []
+
+
+@pytest.mark.asyncio
+async def test_worker_stores_and_reports_the_page_before_acknowledging():
+    # Arrange
+    queue = make_queue()
+    await queue.ensure_group()
+    await queue.enqueue("test_run_id", 3, "https://example.com/", {"image_format": "jpeg", "quality": 70})
+
+    page = PageCapture(url="https://example.com/", path="/tmp/test_run_id_screenshot_3.jpg")
+    crawler = MagicMock()
+    crawler.capture_page = AsyncMock(return_value=page)
+    crawler.report_page = AsyncMock()
+    repository = MagicMock()
+    repository.save_page_capture = AsyncMock()
+    browser_pool = MagicMock()
+    browser_pool.acquire.return_value.__aenter__.return_value = "browser"
+    worker = CaptureWorker(queue, crawler, repository, browser_pool, MagicMock(), "worker-1", block_ms=10)
+
+    # Act
+    run = asyncio.create_task(worker.run())
+    while not crawler.report_page.await_count:
+        await asyncio.sleep(0.01)
+    worker.stop()
+    await run
+
+    # Assert
+    capture = crawler.capture_page.await_args.args[4]
+    assert crawler.capture_page.await_args.args[:4] == ("browser", "test_run_id", 3, "https://example.com/")
+    assert capture.quality == 70
+    repository.save_page_capture.assert_awaited_once_with("test_run_id", 3, page)
+    crawler.report_page.assert_awaited_once_with("test_run_id", 3, "https://example.com/", page, None)
+    assert await queue.claim("worker-2", block_ms=10) == []
+
+
+@pytest.mark.asyncio
+async def test_worker_gives_up_after_max_deliveries():
+    # Arrange
+    queue = make_queue(lease_ms=0, max_deliveries=1)
+    await queue.ensure_group()
+    await queue.enqueue("test_run_id", 0, "https://example.com/", {})
+    await queue.claim("dead-worker", block_ms=10)
+
+    crawler = MagicMock()
+    crawler.capture_page = AsyncMock()
+    crawler.report_page = AsyncMock()
+    worker = CaptureWorker(queue, crawler, MagicMock(), MagicMock(), MagicMock(), "worker-2", block_ms=10)
+
+    # Act
+    [task] = await queue.claim("worker-2", block_ms=10)
+    await worker._handle(task)
+
+    # Assert
+    crawler.capture_page.assert_not_awaited()
+    crawler.report_page.assert_awaited_once_with(
+        "test_run_id", 0, "https://example.com/", error="gave up after 1 attempts"
+    )
+    assert await queue.claim("worker-3", block_ms=10) == []
+
+
+@pytest.mark.asyncio
+async def test_tasks_of_a_timed_out_run_are_dropped():
+    # Arrange
+    queue = make_queue()
+    await queue.ensure_group()
+    task_ids = [await queue.enqueue("test_run_id", i, f"https://example.com/{i}", {}) for i in range(3)]
+    [taken] = await queue.claim("worker-1", block_ms=10)
+    await queue.enqueue("other_run_id", 0, "https://example.com/", {})
+
+    page = PageCapture(url="https://example.com/0", path="test_run_id_screenshot_0.png", thumbnail="test_run_id_screenshot_0_thumb.png")
+    crawler = MagicMock()
+    crawler.capture_page = AsyncMock(return_value=page)
+    crawler.report_page = AsyncMock()
+    crawler.storage.delete = AsyncMock()
+    repository = MagicMock()
+    repository.save_page_capture = AsyncMock()
+    repository.referenced_keys = AsyncMock(return_value=set())
+    browser_pool = MagicMock()
+    browser_pool.acquire.return_value.__aenter__.return_value = "browser"
+    worker = CaptureWorker(queue, crawler, repository, browser_pool, MagicMock(), "worker-1", block_ms=10)
+
+    async def finish_run(*args):
+        # The run times out while the page is captured
+        await queue.cancel("test_run_id", task_ids)
+        return page
+
+    crawler.capture_page.side_effect = finish_run
+
+    # Act
+    await worker._handle(taken)
+    left = await queue.claim("worker-2", count=5, block_ms=10)
+
+    # Assert
+    repository.save_page_capture.assert_not_awaited()
+    crawler.report_page.assert_not_awaited()
+    deleted = {call.args[0] for call in crawler.storage.delete.await_args_list}
+    assert deleted == {"test_run_id_screenshot_0.png", "test_run_id_screenshot_0_thumb.png"}
+    assert [task.run_id for task in left] == ["other_run_id"]
+    assert await queue.finished("test_run_id")
@@ -0,0 +1,13 @@
+import pytest
+from utils.urls import normalize_url
+
+
+@pytest.mark.parametrize("url, expected", [
+    ("HTTPS://Example.COM", "https://example.com/"),
+    ("https://example.com:443/page", "https://example.com/page"),
+    ("http://example.com:8080/page", "http://example.com:8080/page"),
+    ("https://example.com/page#section", "https://example.com/page"),
+    ("https://example.com/page?b=2&a=1", "https://example.com/page?a=1&b=2"),
+])
+def test_normalize_url(url, expected):
+    assert normalize_url(url) == expected
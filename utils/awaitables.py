@@ -0,0 +1,11 @@
+import inspect
+from typing import Any
+
+async def maybe_await(value: Any) -> Any:
+    """
+    Resolves the result of a call that can be either synchronous or a
+    coroutine, so callers work with both kinds of implementations.
+    """
+    if inspect.isawaitable(value):
+        return await value
+    return value
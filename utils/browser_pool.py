@@ -0,0 +1,106 @@
+import asyncio
+from contextlib import asynccontextmanager
+from typing import AsyncIterator, List, Optional, Union
+from pyppeteer.browser import Browser, BrowserContext
+from utils.context_managers import launch_browser
+
+class BrowserPool:
+    """
+    Keeps a fixed number of warm Chromium instances alive for the whole
+    application lifetime and lends them to the crawls.
+
+    A crawl checks out one browser with `acquire()` and gives it back when the
+    `async with` block ends. When `incognito` is set, the crawl receives a fresh
+    incognito context of the browser instead, so cookies and storage never leak
+    between runs. Browsers whose process died while checked out are relaunched
+    on release.
+    """
+
+    def __init__(self, size: int = 2, headless: bool = True, incognito: bool = True):
+        if size < 1:
+            raise ValueError("The browser pool needs at least one browser")
+        self.size = size
+        self.headless = headless
+        self.incognito = incognito
+        self._browsers: List[Browser] = []
+        self._available: Optional[asyncio.Queue] = None
+        self._start_lock = asyncio.Lock()
+
+    @property
+    def started(self) -> bool:
+        return self._available is not None
+
+    async def start(self):
+        async with self._start_lock:
+            if self.started:
+                return
+            browsers = await asyncio.gather(
+                *(launch_browser(self.headless) for _ in range(self.size)),
+                return_exceptions=True
+            )
+            errors = [browser for browser in browsers if isinstance(browser, BaseException)]
+            launched = [browser for browser in browsers if not isinstance(browser, BaseException)]
+            if errors:
+                await asyncio.gather(*(browser.close() for browser in launched), return_exceptions=True)
+                raise errors[0]
+
+            self._browsers = launched
+            self._available = asyncio.Queue()
+            for browser in launched:
+                self._available.put_nowait(browser)
+
+    async def close(self):
+        async with self._start_lock:
+            browsers, self._browsers = self._browsers, []
+            self._available = None
+            await asyncio.gather(*(browser.close() for browser in browsers), return_exceptions=True)
+
+    @asynccontextmanager
+    async def acquire(self) -> AsyncIterator[Union[Browser, BrowserContext]]:
+        # Warm up lazily when the pool was not started by the app lifespan
+        if not self.started:
+            await self.start()
+
+        available = self._available
+        browser: Browser = await available.get()
+        context: Optional[BrowserContext] = None
+        try:
+            if self.incognito:
+                context = await browser.createIncognitoBrowserContext()
+                yield context
+            else:
+                yield browser
+        finally:
+            if context is not None:
+                try:
+                    await context.close()
+                except Exception:
+                    pass
+            await self._release(browser, available)
+
+    async def _release(self, browser: Browser, available: asyncio.Queue):
+        if available is not self._available:
+            # The pool was closed while the browser was checked out
+            await browser.close()
+            return
+
+        if self._is_alive(browser):
+            available.put_nowait(browser)
+            return
+
+        self._browsers.remove(browser)
+        try:
+            replacement = await launch_browser(self.headless)
+        except Exception:
+            # Put the dead browser back so waiters are not starved, the next
+            # release of it will try to relaunch again
+            self._browsers.append(browser)
+            available.put_nowait(browser)
+            return
+        self._browsers.append(replacement)
+        available.put_nowait(replacement)
+
+    @staticmethod
+    def _is_alive(browser: Browser) -> bool:
+        process = browser.process
+        return process is None or process.poll() is None
@@ -1,6 +1,26 @@
+import asyncio
 from pyppeteer import launch
 from pyppeteer.page import Page
 from pyppeteer.browser import Browser
+from utils.metrics import LIVE_BROWSERS, OPEN_PAGES, Stage, time_stage
+
+async def launch_browser(headless=True) -> Browser:
+    # Launch the browser
+    with time_stage(Stage.BROWSER_LAUNCH):
+        browser = await launch({
+            'headless': headless,
+            'args' : [
+                '--no-sandbox',  # Required to run Chrome in a container
+                '--disable-dev-shm-usage',  # Required to run Chrome in a container
+                '--disable-setuid-sandbox',
+                '--disable-web-security',
+                '--disable-features=IsolateOrigins,site-per-process'
+            ]
+        })
+    LIVE_BROWSERS.inc()
+    # Emitted when the browser is closed as well as when its process dies
+    browser.once('disconnected', LIVE_BROWSERS.dec)
+    return browser
 
 class BrowserContextManager:
     def __init__(self, headless=True):
@@ -9,17 +29,7 @@ class BrowserContextManager:
 
     async def __aenter__(self) -> Browser:
         try:
-            # Launch the browser
-            self.browser = await launch({
-                'headless': self.headless,
-                'args' : [
-                    '--no-sandbox',  # Required to run Chrome in a container
-                    '--disable-dev-shm-usage'  # Required to run Chrome in a container
-                    '--disable-setuid-sandbox',
-                    '--disable-web-security',
-                    '--disable-features=IsolateOrigins,site-per-process'
-                ]
-            })
+            self.browser = await launch_browser(self.headless)
             return self.browser
         except Exception as e:
             if self.browser:
@@ -40,7 +50,9 @@ class PageContextManager:
     async def __aenter__(self) -> Page:
         try:
             # Open a new page
-            self.page = await self.browser.newPage()
+            with time_stage(Stage.PAGE_CREATE):
+                self.page = await self.browser.newPage()
+            OPEN_PAGES.inc()
             return self.page
         except Exception as e:
             if self.page:
@@ -50,4 +62,32 @@ class PageContextManager:
     async def __aexit__(self, exc_type, exc_val, exc_tb):
         # Close the page when done
         if self.page:
+            OPEN_PAGES.dec()
             await self.page.close()
+
+class LazyBrowserSession:
+    """
+    Opens the browser session given by `session_factory` only when the browser
+    is first asked for, so a crawl that never needs it does not pay for it.
+    """
+    def __init__(self, session_factory):
+        self._session_factory = session_factory
+        self._session = None
+        self._lock = asyncio.Lock()
+        self.browser = None
+
+    async def get(self) -> Browser:
+        async with self._lock:
+            if self.browser is None:
+                session = self._session_factory()
+                self.browser = await session.__aenter__()
+                self._session = session
+            return self.browser
+
+    async def __aenter__(self) -> "LazyBrowserSession":
+        return self
+
+    async def __aexit__(self, exc_type, exc_val, exc_tb):
+        # Close the session only if it was opened
+        if self._session is not None:
+            await self._session.__aexit__(exc_type, exc_val, exc_tb)
@@ -0,0 +1,80 @@
+# Five field cron expressions, `minute hour day-of-month month day-of-week`,
+# enough for the crawl schedules. Each field is `*`, a value, a range `a-b`,
+# a step `*/n` or `a-b/n`, or a comma separated list of them.
+from datetime import datetime, timedelta
+from typing import FrozenSet
+
+FIELDS = [("minute", 0, 59), ("hour", 0, 23), ("day of month", 1, 31), ("month", 1, 12), ("day of week", 0, 7)]
+MACROS = {
+    "@hourly": "0 * * * *",
+    "@daily": "0 0 * * *",
+    "@weekly": "0 0 * * 0",
+    "@monthly": "0 0 1 * *",
+    "@yearly": "0 0 1 1 *",
+}
+# Far enough for any expression that can match, like the 29th of February
+SEARCH_LIMIT = timedelta(days=366 * 5)
+
+
+def _parse_field(text: str, name: str, low: int, high: int) -> FrozenSet[int]:
+    values = set()
+    for part in text.split(","):
+        bounds, _, step_text = part.partition("/")
+        try:
+            step = int(step_text) if step_text else 1
+            if bounds == "*":
+                start, end = low, high
+            elif "-" in bounds:
+                start, end = (int(bound) for bound in bounds.split("-", 1))
+            else:
+                start = int(bounds)
+                end = high if step_text else start
+        except ValueError:
+            raise ValueError(f"invalid {name} field {text!r}")
+        if step < 1 or not low <= start <= end <= high:
+            raise ValueError(f"invalid {name} field {text!r}, values go from {low} to {high}")
+        values.update(range(start, end + 1, step))
+    return frozenset(values)
+
+
+class CronExpression:
+    def __init__(self, expression: str):
+        self.expression = expression.strip()
+        fields = MACROS.get(self.expression, self.expression).split()
+        if len(fields) != len(FIELDS):
+            raise ValueError(f"cron expressions have {len(FIELDS)} fields, got {expression!r}")
+        minutes, hours, days, months, weekdays = (
+            _parse_field(text, *field) for text, field in zip(fields, FIELDS)
+        )
+        self.minutes, self.hours, self.days, self.months = minutes, hours, days, months
+        # 0 and 7 are both Sunday
+        self.weekdays = frozenset(day % 7 for day in weekdays)
+        self._any_day = fields[2] == "*"
+        self._any_weekday = fields[4] == "*"
+
+    def _day_matches(self, moment: datetime) -> bool:
+        in_days = moment.day in self.days
+        in_weekdays = (moment.weekday() + 1) % 7 in self.weekdays
+        # As in cron, when both fields are restricted either one is enough
+        if self._any_day or self._any_weekday:
+            return in_days and in_weekdays
+        return in_days or in_weekdays
+
+    def next_after(self, moment: datetime) -> datetime:
+        """
+        First minute strictly after `moment` matching the expression.
+        """
+        candidate = moment.replace(second=0, microsecond=0) + timedelta(minutes=1)
+        limit = candidate + SEARCH_LIMIT
+        while candidate < limit:
+            if candidate.month not in self.months:
+                candidate = (candidate.replace(day=1) + timedelta(days=32)).replace(day=1, hour=0, minute=0)
+            elif not self._day_matches(candidate):
+                candidate = candidate.replace(hour=0, minute=0) + timedelta(days=1)
+            elif candidate.hour not in self.hours:
+                candidate = candidate.replace(minute=0) + timedelta(hours=1)
+            elif candidate.minute not in self.minutes:
+                candidate += timedelta(minutes=1)
+            else:
+                return candidate
+        raise ValueError(f"cron expression {self.expression!r} never matches")
@@ -0,0 +1,122 @@
+# HTTP caching and byte range helpers for serving files that never change
+# once written, like the screenshots of a run.
+import os
+import stat
+from email.utils import formatdate
+from typing import Optional, Tuple
+
+import anyio
+from starlette.responses import FileResponse
+from starlette.types import Receive, Scope, Send
+
+# A year, the longest lifetime caches are asked to honour
+IMMUTABLE_CACHE_CONTROL = "public, max-age=31536000, immutable"
+ZERO_COPY_SEND = "http.response.zerocopysend"
+
+
+class RangeNotSatisfiable(Exception):
+    pass
+
+
+def strong_etag(stat_result: os.stat_result) -> str:
+    """
+    ETag of a file that is never rewritten in place: a new file, even with the
+    same name, comes with a new inode or modification time.
+    """
+    return f'"{stat_result.st_ino:x}-{stat_result.st_mtime_ns:x}-{stat_result.st_size:x}"'
+
+
+def etag_matches(if_none_match: Optional[str], etag: str) -> bool:
+    """
+    Weak comparison of `If-None-Match` with the ETag, as RFC 9110 asks for
+    conditional GETs.
+    """
+    if not if_none_match:
+        return False
+    if if_none_match.strip() == "*":
+        return True
+    tags = (tag.strip() for tag in if_none_match.split(","))
+    return any(tag.removeprefix("W/") == etag for tag in tags)
+
+
+def parse_range(range_header: Optional[str], size: int) -> Optional[Tuple[int, int]]:
+    """
+    Returns the inclusive `(start, end)` of a single byte range, or None to send
+    the whole file: no header, another unit or several ranges.
+    Raises RangeNotSatisfiable when the range is past the end of the file.
+    """
+    if not range_header:
+        return None
+    unit, _, ranges = range_header.partition("=")
+    if unit.strip().lower() != "bytes" or "," in ranges:
+        return None
+    first, dash, last = ranges.strip().partition("-")
+    if not dash or not (first.isdigit() or last.isdigit()):
+        return None
+    if not first.isdigit():
+        # Suffix range, the last bytes of the file
+        length = int(last)
+        if length == 0 or size == 0:
+            raise RangeNotSatisfiable()
+        return max(0, size - length), size - 1
+    start = int(first)
+    if start >= size:
+        raise RangeNotSatisfiable()
+    end = int(last) if last.isdigit() else size - 1
+    if end < start:
+        return None
+    return start, min(end, size - 1)
+
+
+def caching_headers(stat_result: os.stat_result) -> dict:
+    return {
+        "ETag": strong_etag(stat_result),
+        "Last-Modified": formatdate(stat_result.st_mtime, usegmt=True),
+        "Cache-Control": IMMUTABLE_CACHE_CONTROL,
+        "Accept-Ranges": "bytes",
+    }
+
+
+class RangeFileResponse(FileResponse):
+    """
+    File response sending only the bytes from `start` to `end`, both included.
+    The body is handed to the server with the `zerocopysend` ASGI extension
+    when it offers it, so it goes from the file to the socket with sendfile,
+    and read in chunks otherwise.
+    """
+
+    def __init__(self, path: str, stat_result: os.stat_result, byte_range: Optional[Tuple[int, int]] = None, **kwargs):
+        self.start, self.end = byte_range or (0, stat_result.st_size - 1)
+        if byte_range is not None:
+            kwargs.setdefault("status_code", 206)
+        super().__init__(path, stat_result=stat_result, **kwargs)
+        if byte_range is not None:
+            self.headers["content-range"] = f"bytes {self.start}-{self.end}/{stat_result.st_size}"
+
+    def set_stat_headers(self, stat_result: os.stat_result) -> None:
+        self.headers.setdefault("content-length", str(self.end - self.start + 1))
+        for key, value in caching_headers(stat_result).items():
+            self.headers.setdefault(key.lower(), value)
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        if not stat.S_ISREG(self.stat_result.st_mode):
+            raise RuntimeError(f"File at path {self.path} is not a file.")
+        await send({"type": "http.response.start", "status": self.status_code, "headers": self.raw_headers})
+        count = self.end - self.start + 1
+        if scope["method"].upper() == "HEAD" or count <= 0:
+            await send({"type": "http.response.body", "body": b"", "more_body": False})
+        elif ZERO_COPY_SEND in scope.get("extensions", {}):
+            with open(self.path, "rb") as file:
+                await send({"type": ZERO_COPY_SEND, "file": file.fileno(), "offset": self.start, "count": count})
+        else:
+            async with await anyio.open_file(self.path, mode="rb") as file:
+                await file.seek(self.start)
+                while count > 0:
+                    chunk = await file.read(min(self.chunk_size, count))
+                    count -= len(chunk)
+                    more_body = count > 0 and len(chunk) > 0
+                    await send({"type": "http.response.body", "body": chunk, "more_body": more_body})
+                    if not chunk:
+                        break
+        if self.background is not None:
+            await self.background()
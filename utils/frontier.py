@@ -0,0 +1,123 @@
+import hashlib
+import math
+from collections import deque
+from typing import Deque, Iterable, Iterator, List, Optional, Tuple
+from urllib.parse import urlsplit
+from utils.urls import normalize_url
+
+CRAWLABLE_SCHEMES = ("http", "https")
+
+
+class BloomFilter:
+    """
+    Probabilistic set of strings using a fixed bit array. Lookups never miss an
+    added item, and report an item that was never added with a probability
+    close to `error_rate` while fewer than `capacity` items were added.
+    """
+
+    def __init__(self, capacity: int = 500_000, error_rate: float = 0.001):
+        self.size = max(8, math.ceil(-capacity * math.log(error_rate) / math.log(2) ** 2))
+        self.hash_count = max(1, round(self.size / capacity * math.log(2)))
+        self._bits = bytearray((self.size + 7) // 8)
+        self._count = 0
+
+    def _positions(self, item: str) -> Iterator[int]:
+        # Double hashing over one 128 bits digest
+        digest = hashlib.blake2b(item.encode(), digest_size=16).digest()
+        h1 = int.from_bytes(digest[:8], "little")
+        h2 = int.from_bytes(digest[8:], "little") | 1
+        for i in range(self.hash_count):
+            yield (h1 + i * h2) % self.size
+
+    def add(self, item: str) -> bool:
+        """
+        Adds the item, returns False when it was (probably) already there.
+        """
+        added = False
+        for position in self._positions(item):
+            byte, bit = divmod(position, 8)
+            if not self._bits[byte] & (1 << bit):
+                self._bits[byte] |= 1 << bit
+                added = True
+        if added:
+            self._count += 1
+        return added
+
+    def __contains__(self, item: str) -> bool:
+        return all(
+            self._bits[position // 8] & (1 << (position % 8))
+            for position in self._positions(item)
+        )
+
+    def __len__(self) -> int:
+        return self._count
+
+
+class CrawlFrontier:
+    """
+    Breadth first frontier of a crawl. URLs are normalized, kept only when
+    they are in the scope of the crawl and seen for the first time, and only
+    the pages above `max_depth` are queued to have their links extracted.
+
+    Scope: with `allowed_domains` the host must be one of them (or one of their
+    subdomains), the host of the start URL being always allowed. Otherwise with
+    `same_origin` the scheme, host and port must match the start URL. Otherwise
+    any http(s) URL is followed.
+    """
+
+    def __init__(self,
+                 start_url: str,
+                 max_depth: int = 1,
+                 same_origin: bool = False,
+                 allowed_domains: Optional[Iterable[str]] = None,
+                 capacity: int = 500_000):
+        self.start_url = normalize_url(start_url)
+        self.max_depth = max_depth
+        self.same_origin = same_origin
+        start = urlsplit(self.start_url)
+        self._origin = (start.scheme, start.netloc)
+        self._allowed_domains: List[str] = [
+            domain.lower().lstrip(".") for domain in (allowed_domains or [])
+        ]
+        if self._allowed_domains and start.hostname:
+            self._allowed_domains.append(start.hostname)
+        self._seen = BloomFilter(capacity)
+        self._queue: Deque[Tuple[str, int]] = deque()
+        self.push(self.start_url, 0)
+
+    def in_scope(self, url: str) -> bool:
+        parts = urlsplit(url)
+        if parts.scheme not in CRAWLABLE_SCHEMES or not parts.hostname:
+            return False
+        if self._allowed_domains:
+            host = parts.hostname
+            return any(host == domain or host.endswith(f".{domain}") for domain in self._allowed_domains)
+        if self.same_origin:
+            return (parts.scheme, parts.netloc) == self._origin
+        return True
+
+    def push(self, url: str, depth: int) -> Optional[str]:
+        """
+        Returns the normalized URL when it is new and in scope, None otherwise.
+        """
+        try:
+            normalized = normalize_url(url)
+        except ValueError:
+            # Malformed URL, e.g. an invalid port
+            return None
+        if not self.in_scope(normalized) or not self._seen.add(normalized):
+            return None
+        if depth < self.max_depth:
+            self._queue.append((normalized, depth))
+        return normalized
+
+    def pop(self) -> Optional[Tuple[str, int]]:
+        """
+        Next page whose links have to be extracted, with its depth.
+        """
+        if not self._queue:
+            return None
+        return self._queue.popleft()
+
+    def __len__(self) -> int:
+        return len(self._seen)
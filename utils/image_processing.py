@@ -0,0 +1,77 @@
+# CPU bound image work. The functions are module level so they can be sent
+# to the worker processes of `services.image_processor.ImageProcessor`.
+import hashlib
+import io
+from pathlib import PurePosixPath
+from typing import Optional, Tuple
+
+PILLOW_FORMATS = {"png": "PNG", "jpeg": "JPEG", "webp": "WEBP"}
+
+
+def _save(image, image_format: str, quality: Optional[int]) -> bytes:
+    options = {}
+    if quality is not None and image_format != "png":
+        options["quality"] = quality
+    if image_format == "jpeg" and image.mode not in ("RGB", "L"):
+        # JPEG has no alpha channel
+        image = image.convert("RGB")
+    buffer = io.BytesIO()
+    image.save(buffer, PILLOW_FORMATS[image_format], **options)
+    return buffer.getvalue()
+
+
+def encode_image(data: bytes, image_format: str, quality: Optional[int] = None) -> bytes:
+    """
+    Re-encodes the screenshot bytes returned by the browser.
+    """
+    from PIL import Image
+
+    with Image.open(io.BytesIO(data)) as image:
+        return _save(image, image_format, quality)
+
+
+def make_thumbnail(data: bytes, width: int, image_format: str, quality: Optional[int] = None) -> bytes:
+    """
+    Returns a copy of the image downscaled to `width`, keeping the aspect ratio.
+    """
+    from PIL import Image
+
+    with Image.open(io.BytesIO(data)) as image:
+        if image.width > width:
+            height = max(1, round(image.height * width / image.width))
+            image = image.resize((width, height), Image.LANCZOS)
+        return _save(image, image_format, quality)
+
+
+def fingerprint(data: bytes, hash_size: int = 8) -> Tuple[str, str]:
+    """
+    Returns the SHA-256 of the image bytes, equal only for identical files,
+    and its difference hash: `hash_size`² bits telling whether each pixel of a
+    tiny grayscale copy is brighter than its right neighbour, so images that
+    look the same get the same or a close hash.
+    """
+    from PIL import Image
+
+    with Image.open(io.BytesIO(data)) as image:
+        small = image.convert("L").resize((hash_size + 1, hash_size), Image.LANCZOS)
+        pixels = small.tobytes()
+    bits = 0
+    for row in range(hash_size):
+        for column in range(hash_size):
+            left = pixels[row * (hash_size + 1) + column]
+            right = pixels[row * (hash_size + 1) + column + 1]
+            bits = (bits << 1) | (left > right)
+    return hashlib.sha256(data).hexdigest(), f"{bits:0{hash_size * hash_size // 4}x}"
+
+
+def hash_distance(first: str, second: str) -> int:
+    """
+    Number of differing bits between two perceptual hashes.
+    """
+    return bin(int(first, 16) ^ int(second, 16)).count("1")
+
+
+def thumbnail_path(path: str, width: int) -> str:
+    # By width, the captures are shared by the runs asking for other thumbnails
+    image_path = PurePosixPath(path)
+    return str(image_path.with_name(f"{image_path.stem}_thumb_w{width}{image_path.suffix}"))
@@ -0,0 +1,56 @@
+import os
+from enum import Enum
+from prometheus_client import REGISTRY, CollectorRegistry, Gauge, Histogram, multiprocess
+
+class Stage(str, Enum):
+    BROWSER_LAUNCH = "browser_launch"
+    PAGE_CREATE = "page_create"
+    GOTO = "goto"
+    LINK_EVALUATION = "link_evaluation"
+    SCREENSHOT_ENCODE = "screenshot_encode"
+    # Re-encoding of the screenshots the browser can not encode, like webp
+    IMAGE_ENCODE = "image_encode"
+    FILE_WRITE = "file_write"
+    MONGO_INSERT = "mongo_insert"
+    REDIS_PUSH = "redis_push"
+
+
+STAGE_LATENCY = Histogram(
+    'crawl_stage_seconds',
+    'Time spent in each stage of the crawl pipeline',
+    ['stage'],
+    buckets=(0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+)
+# Summed over the live processes with PROMETHEUS_MULTIPROC_DIR
+RUNS_IN_FLIGHT = Gauge('crawl_runs_in_flight', 'Crawls currently running in this process', multiprocess_mode='livesum')
+OPEN_PAGES = Gauge('browser_open_pages', 'Browser tabs currently open', multiprocess_mode='livesum')
+LIVE_BROWSERS = Gauge('browser_live_instances', 'Chromium instances currently running', multiprocess_mode='livesum')
+
+
+def time_stage(stage: Stage):
+    """
+    Context manager observing the time spent in the `with` block, awaits
+    included, in the histogram of the stage.
+    """
+    return STAGE_LATENCY.labels(stage.value).time()
+
+
+def metrics_registry() -> CollectorRegistry:
+    """
+    The metrics to expose: those of this process, or with
+    PROMETHEUS_MULTIPROC_DIR set, those every process of the app, like the
+    crawl processes, writes in that directory.
+    """
+    if not os.getenv('PROMETHEUS_MULTIPROC_DIR'):
+        return REGISTRY
+    registry = CollectorRegistry()
+    multiprocess.MultiProcessCollector(registry)
+    return registry
+
+
+def mark_process_dead(pid: int):
+    """
+    Drops the live gauges of a process that exited, with PROMETHEUS_MULTIPROC_DIR.
+    """
+    if os.getenv('PROMETHEUS_MULTIPROC_DIR'):
+        multiprocess.mark_process_dead(pid)
@@ -0,0 +1,77 @@
+import asyncio
+import fnmatch
+import re
+from pyppeteer.page import Page
+from models.capture_options import CaptureProfile, WaitUntil
+from utils.metrics import Stage, time_stage
+
+# Navigation defaults of pyppeteer
+DEFAULT_WAIT_UNTIL = WaitUntil.LOAD
+DEFAULT_NAVIGATION_TIMEOUT_MS = 30000
+
+
+def navigation_options(profile: CaptureProfile) -> dict:
+    options = {}
+    if profile.wait_until != DEFAULT_WAIT_UNTIL:
+        options["waitUntil"] = profile.wait_until.value
+    if profile.navigation_timeout_ms != DEFAULT_NAVIGATION_TIMEOUT_MS:
+        options["timeout"] = profile.navigation_timeout_ms
+    return options
+
+
+async def block_requests(page: Page, profile: CaptureProfile):
+    """
+    Aborts the requests of the page whose resource type or URL is blocked by
+    the profile. The document itself is never blocked.
+    """
+    blocked_types = {resource_type.value for resource_type in profile.blocked_resource_types}
+    blocked_urls = None
+    if profile.blocked_url_patterns:
+        blocked_urls = re.compile("|".join(fnmatch.translate(pattern) for pattern in profile.blocked_url_patterns))
+
+    def on_request(request):
+        blocked = request.resourceType != "document" and (
+            request.resourceType in blocked_types 
+            or (blocked_urls is not None and blocked_urls.match(request.url))
+        )
+        # The event handlers of pyppeteer are synchronous
+        asyncio.ensure_future(request.abort() if blocked else request.continue_())
+
+    await page.setRequestInterception(True)
+    page.on("request", on_request)
+
+
+async def load_page(page: Page, url: str, profile: CaptureProfile):
+    """
+    Navigates to the URL and waits as the profile says.
+    """
+    if profile.intercepts_requests:
+        await block_requests(page, profile)
+    with time_stage(Stage.GOTO):
+        await page.goto(url, **navigation_options(profile))
+        if profile.wait_for_selector:
+            await page.waitForSelector(profile.wait_for_selector, timeout=profile.navigation_timeout_ms)
+
+
+async def reload_page(page: Page, profile: CaptureProfile):
+    """
+    Reloads the page and waits as the profile says.
+    """
+    with time_stage(Stage.GOTO):
+        await page.reload(**navigation_options(profile))
+        if profile.wait_for_selector:
+            await page.waitForSelector(profile.wait_for_selector, timeout=profile.navigation_timeout_ms)
+
+
+async def emulate_viewport(page: Page, viewport: dict) -> bool:
+    """
+    Sets the viewport like `Page.setViewport`, through the
+    Emulation.setDeviceMetricsOverride and Emulation.setTouchEmulationEnabled
+    commands of its emulation manager, but without the reload it does with the
+    default navigation options when the mobile or touch emulation changes.
+    Returns whether the page needs that reload.
+    """
+    needs_reload = await page._emulationManager.emulateViewport(viewport)
+    # Restored by the full page screenshots
+    page._viewport = viewport
+    return needs_reload
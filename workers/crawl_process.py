@@ -0,0 +1,35 @@
+from contextlib import asynccontextmanager
+from typing import AsyncIterator
+from services.crawler import Crawler
+
+
+@asynccontextmanager
+async def process_crawler() -> AsyncIterator[Crawler]:
+    """
+    Crawler of a process of the crawl process pool, with its own browsers,
+    image workers and clients, closed when the process stops.
+    """
+    # Imported here, the process loads the configuration it got from the API
+    from dep_container import (
+        get_browser_pool,
+        get_cache_client,
+        get_http_client,
+        get_image_processor,
+        get_mongo_client,
+        get_process_crawler,
+        get_stream_client
+    )
+
+    browser_pool = get_browser_pool()
+    image_processor = get_image_processor()
+    await browser_pool.start()
+    image_processor.start()
+    try:
+        yield get_process_crawler()
+    finally:
+        await browser_pool.close()
+        image_processor.close()
+        await get_http_client().aclose()
+        await get_cache_client().aclose()
+        await get_stream_client().aclose()
+        get_mongo_client().close()
@@ -0,0 +1,193 @@
+"""
+Crawl worker capturing the pages queued by the API nodes.
+
+    python -m workers.crawler
+
+Every worker keeps its own pool of browsers, takes capture tasks from the
+shared Redis stream, stores the pages through the screenshot repository and
+reports them on the events of their run. Run as many as the browsers need.
+"""
+import asyncio
+import os
+import signal
+import socket
+from logging import Logger
+from typing import Optional, Set, Union
+from models.capture_options import CaptureOptions
+from models.screenshot_document import CaptureSource, PageCapture, PageChange
+from repositories.screenshot_repository import AsyncScreenshotRepository, ScreenshotRepository
+from services.crawler import Crawler
+from services.task_queue import CaptureTask, CaptureTaskQueue
+from utils.awaitables import maybe_await
+from utils.browser_pool import BrowserPool
+
+
+class CaptureWorker:
+    def __init__(self,
+                 task_queue: CaptureTaskQueue,
+                 crawler: Crawler,
+                 repository: Union[ScreenshotRepository, AsyncScreenshotRepository],
+                 browser_pool: BrowserPool,
+                 logger: Logger,
+                 consumer: str,
+                 concurrency: int = 4,
+                 block_ms: int = 5000):
+        self.task_queue = task_queue
+        self.crawler = crawler
+        self._repository = repository
+        self._browser_pool = browser_pool
+        self.logger = logger
+        self.consumer = consumer
+        self.concurrency = max(1, concurrency)
+        self.block_ms = block_ms
+        self._stopping = asyncio.Event()
+        self._in_flight: Set[asyncio.Task] = set()
+
+    def stop(self):
+        self._stopping.set()
+
+    async def run(self):
+        """
+        Takes tasks until `stop` is called, then waits for the ones in progress.
+        """
+        await self.task_queue.ensure_group()
+        self.logger.info(f"Crawl worker started {{'consumer': '{self.consumer}'}}")
+        slots = asyncio.Semaphore(self.concurrency)
+        while not self._stopping.is_set():
+            await slots.acquire()
+            try:
+                tasks = await self.task_queue.claim(self.consumer, count=1, block_ms=self.block_ms)
+            except Exception as e:
+                slots.release()
+                self.logger.error(f"Could not read the capture tasks 'exception': {e}")
+                await asyncio.sleep(1)
+                continue
+            if not tasks:
+                slots.release()
+                continue
+            in_flight = asyncio.create_task(self._handle(tasks[0]))
+            self._in_flight.add(in_flight)
+            in_flight.add_done_callback(self._in_flight.discard)
+            in_flight.add_done_callback(lambda _: slots.release())
+
+        await asyncio.gather(*self._in_flight, return_exceptions=True)
+        self.logger.info(f"Crawl worker stopped {{'consumer': '{self.consumer}'}}")
+
+    async def _handle(self, task: CaptureTask):
+        log_dict = {"run_id": task.run_id, "index": task.index, "url": task.url, "deliveries": task.deliveries}
+        if task.deliveries > self.task_queue.max_deliveries:
+            self.logger.error(f"Giving up capture task {log_dict}")
+            await self.crawler.report_page(
+                task.run_id, task.index, task.url, error=f"gave up after {task.deliveries - 1} attempts"
+            )
+            await self.task_queue.ack(task.task_id)
+            return
+
+        if await self._dropped(task, log_dict):
+            return
+
+        lease = asyncio.create_task(self._keep_lease(task))
+        try:
+            page: Optional[PageCapture] = None
+            error: Optional[str] = None
+            async with self._browser_pool.acquire() as browser:
+                try:
+                    page = await self.crawler.capture_page(
+                        browser, task.run_id, task.index, task.url, CaptureOptions(**task.capture)
+                    )
+                except Exception as e:
+                    self.logger.error(f"Error taking screenshot 'url': {task.url} 'exception': {e}")
+                    error = str(e)
+            if await self._dropped(task, log_dict, page):
+                return
+            # Stored before it is reported, the API collects the pages once all are reported
+            if page is not None:
+                await maybe_await(self._repository.save_page_capture(task.run_id, task.index, page))
+            await self.crawler.report_page(task.run_id, task.index, task.url, page, error)
+            await self.task_queue.ack(task.task_id)
+        except Exception as e:
+            # Left pending, another worker takes it again once the lease expires
+            self.logger.error(f"Capture task failed {log_dict} 'exception': {e}")
+        finally:
+            lease.cancel()
+
+    async def _dropped(self, task: CaptureTask, log_dict: dict, page: Optional[PageCapture] = None) -> bool:
+        """
+        Drops the task of a run that stopped waiting for its pages, with the
+        files `page` wrote for it, and tells whether it was.
+        """
+        try:
+            if not await self.task_queue.finished(task.run_id):
+                return False
+        except Exception as e:
+            self.logger.warn(f"Could not check the run of the capture task {log_dict} 'exception': {e}")
+            return False
+        self.logger.info(f"Dropping capture task of a finished run {log_dict}")
+        if page is not None:
+            keys = set()
+            for capture in page.captures():
+                # The files reused from another run are not the task's
+                if capture.source == CaptureSource.FRESH and capture.change != PageChange.UNCHANGED:
+                    keys.update(key for key in (capture.path, capture.thumbnail) if key)
+            keys -= await maybe_await(self._repository.referenced_keys(keys, []))
+            for key in keys:
+                await self.crawler.storage.delete(key)
+        await self.task_queue.ack(task.task_id)
+        return True
+
+    async def _keep_lease(self, task: CaptureTask):
+        interval = self.task_queue.lease_ms / 3000
+        while True:
+            await asyncio.sleep(interval)
+            try:
+                await self.task_queue.extend(self.consumer, task.task_id)
+            except Exception as e:
+                self.logger.warn(f"Could not renew the lease 'task_id': {task.task_id} 'exception': {e}")
+
+
+async def main():
+    # Imported here so the module can be loaded without the configuration
+    from dep_container import (
+        get_browser_pool,
+        get_cache_client,
+        get_capture_task_queue,
+        get_http_client,
+        get_image_processor,
+        get_logger,
+        get_mongo_client,
+        get_screenshot_repository,
+        get_worker_crawler,
+        get_stream_client
+    )
+
+    browser_pool = get_browser_pool()
+    image_processor = get_image_processor()
+    await browser_pool.start()
+    image_processor.start()
+
+    worker = CaptureWorker(
+        get_capture_task_queue(),
+        get_worker_crawler(),
+        get_screenshot_repository(),
+        browser_pool,
+        get_logger(),
+        os.getenv('WORKER_NAME') or f"{socket.gethostname()}-{os.getpid()}",
+        int(os.getenv('WORKER_CONCURRENCY', '4'))
+    )
+    loop = asyncio.get_running_loop()
+    for signal_number in (signal.SIGINT, signal.SIGTERM):
+        loop.add_signal_handler(signal_number, worker.stop)
+
+    try:
+        await worker.run()
+    finally:
+        await browser_pool.close()
+        image_processor.close()
+        await get_http_client().aclose()
+        await get_cache_client().aclose()
+        await get_stream_client().aclose()
+        get_mongo_client().close()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())